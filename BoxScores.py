@@ -0,0 +1,192 @@
+import os
+import csv
+import argparse
+import numpy as np
+from typing import Callable, Dict, Optional, Union
+from PillarTable import PillarTable
+
+def entropy(probabilities: np.ndarray) -> np.ndarray:
+    """Shannon entropy in bits of each probability row, NaN for unscored rows."""
+    p = np.asarray(probabilities, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(p > 0, -p * np.log2(p), 0.0)
+    result = terms.sum(axis=1)
+    # Without any class columns nothing was scored
+    result[np.isnan(p).any(axis=1) | (p.shape[1] == 0)] = np.nan
+    return result
+
+def decide(probabilities: np.ndarray, thresholds: Optional[Dict[int, float]] = None,
+           min_confidence: float = 0.0, max_entropy: Optional[float] = None) -> np.ndarray:
+    """
+    Classes under a decision rule, without re-running the model.
+
+    Args:
+        probabilities: NxC class probabilities, NaN rows for unscored boxes
+        thresholds: Minimum probability for a class to be chosen, e.g. {3: 0.7};
+            below it the most probable other class is taken
+        min_confidence: Boxes whose chosen class is less probable than this are uncertain
+        max_entropy: Boxes with a higher entropy (bits) are uncertain
+
+    Returns:
+        Class per box, -1 for unscored and uncertain boxes
+    """
+    p = np.asarray(probabilities, dtype=np.float32)
+    classes = np.full(len(p), -1, dtype=np.int64)
+    if not p.shape[1]:
+        return classes
+    scored = ~np.isnan(p).any(axis=1)
+
+    candidates = p.copy()
+    for class_id, threshold in (thresholds or {}).items():
+        candidates[candidates[:, class_id] < threshold, class_id] = -np.inf
+    chosen = candidates.argmax(axis=1)
+    confidence = p[np.arange(len(p)), chosen]
+
+    # A box where every class misses its threshold gets no class
+    keep = scored & np.isfinite(candidates.max(axis=1)) & (confidence >= min_confidence)
+    if max_entropy is not None:
+        keep &= entropy(p) <= max_entropy
+    classes[keep] = chosen[keep]
+    return classes
+
+class BoxScores:
+    """Softmax vector and entropy of every box of a series, float16 and row-aligned with its PillarTable"""
+
+    def __init__(self, cell_id: np.ndarray, probabilities: np.ndarray, model: str = ""):
+
+        self.cell_id = np.asarray(cell_id, dtype=np.int64)
+        # NaN rows for pillars whose box was not scored
+        self.probabilities = np.asarray(probabilities, dtype=np.float16)
+        if self.probabilities.ndim != 2:
+            self.probabilities = self.probabilities.reshape(len(self.cell_id), -1)
+        self.entropy = entropy(self.probabilities).astype(np.float16)
+        self.model = model
+
+    def __len__(self) -> int:
+        return len(self.cell_id)
+
+    @classmethod
+    def from_predictions(cls, pillar_table: PillarTable, cell_ids: np.ndarray, probabilities: np.ndarray,
+                         model: str = "") -> 'BoxScores':
+        """
+        Align per-box probabilities with the rows of the pillar table.
+
+        Args:
+            pillar_table: Pillars of the series
+            cell_ids: cell_id of each scored box
+            probabilities: NxC class probabilities of the boxes
+            model: Model that scored them
+
+        Returns:
+            BoxScores with one row per pillar
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if probabilities.ndim != 2:
+            probabilities = probabilities.reshape(len(cell_ids), -1)
+        aligned = np.full((len(pillar_table), probabilities.shape[1]), np.nan, dtype=np.float32)
+        rows = pillar_table.rows(cell_ids)
+        found = rows >= 0
+        aligned[rows[found]] = probabilities[found]
+        return cls(pillar_table.cell_id, aligned, model)
+
+    @staticmethod
+    def path(series_folder: str, series_name: Optional[str] = None, variant: Optional[str] = None) -> str:
+        """Scores file of a series, next to its pillar table; a variant names one model of an ensemble."""
+        series_name = series_name or os.path.basename(os.path.normpath(series_folder))
+        suffix = f"_{variant}" if variant else ""
+        return os.path.join(series_folder, f"{series_name}_scores{suffix}.npz")
+
+    def save(self, series_folder: str, series_name: Optional[str] = None, variant: Optional[str] = None):
+        """Write the scores atomically."""
+        path = self.path(series_folder, series_name, variant)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, cell_id=self.cell_id, probabilities=self.probabilities, entropy=self.entropy,
+                     model=np.array(self.model))
+        os.replace(tmp_path, path)
+        print(f"Saved scores of {len(self)} boxes to {path}")
+
+    @classmethod
+    def load(cls, series_folder: str, series_name: Optional[str] = None,
+             variant: Optional[str] = None) -> Optional['BoxScores']:
+        """Load the scores of a series, or None if it has not been scored."""
+        path = cls.path(series_folder, series_name, variant)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['cell_id'], data['probabilities'], str(data['model']))
+
+    def classes(self, rule: Union[None, Dict, Callable[[np.ndarray], np.ndarray]] = None) -> np.ndarray:
+        """
+        Class of every box under a decision rule.
+
+        Args:
+            rule: None for argmax, keyword arguments of decide() as a dict, or a
+                function from NxC probabilities to classes
+
+        Returns:
+            Class per pillar row, -1 for unscored and uncertain boxes
+        """
+        if callable(rule):
+            return np.asarray(rule(self.probabilities.astype(np.float32)), dtype=np.int64)
+        return decide(self.probabilities, **(rule or {}))
+
+    def count_classes(self, rule=None) -> Dict[int, int]:
+        """Class counts under a decision rule, as in MyelinScorer.count_classes."""
+        classes = self.classes(rule)
+        return {class_id: int(np.count_nonzero(classes == class_id)) for class_id in range(self.probabilities.shape[1])}
+
+def recount_plate(parent_directory: str, rule: Optional[Dict] = None, output_name: str = "recount_summary.csv",
+                  variant: Optional[str] = None):
+    """
+    Recount every scored series of a plate under a new decision rule and save a summary CSV.
+
+    Args:
+        parent_directory: Plate folder
+        rule: Keyword arguments of decide()
+        output_name: CSV written to the plate folder
+        variant: One model of an ensemble run, default the aggregated scores
+    """
+    rows = []
+    for item in sorted(os.listdir(parent_directory)):
+        subfolder_path = os.path.join(parent_directory, item)
+        if not os.path.isdir(subfolder_path):
+            continue
+        scores = BoxScores.load(subfolder_path, item, variant)
+        if scores is None:
+            continue
+        classes = scores.classes(rule)
+        scored = ~np.isnan(scores.probabilities.astype(np.float32)).any(axis=1)
+        counts = scores.count_classes(rule)
+        rows.append({
+            'subfolder_name': item,
+            'scored_count': int(scored.sum()),
+            'uncertain_count': int(np.count_nonzero(scored & (classes < 0))),
+            **{f'class_{c}_count': n for c, n in counts.items()}
+        })
+        print(f"{item}: {counts} ({rows[-1]['uncertain_count']} uncertain)")
+
+    if not rows:
+        print(f"No scored series found in {parent_directory}")
+        return
+    output_path = os.path.join(parent_directory, output_name)
+    with open(output_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Saved recount to: {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recount scored series under a new decision rule")
+    parser.add_argument('parent_directory', help="Plate folder")
+    parser.add_argument('--threshold', action='append', default=[], metavar="CLASS=P",
+                        help="Minimum probability for a class, e.g. 3=0.7 (repeatable)")
+    parser.add_argument('--min-confidence', type=float, default=0.0, help="Mark less confident boxes uncertain")
+    parser.add_argument('--max-entropy', type=float, default=None, help="Mark boxes above this entropy (bits) uncertain")
+    parser.add_argument('--output', default="recount_summary.csv")
+    parser.add_argument('--variant', default=None, help="Recount one model of an ensemble run, by name")
+    args = parser.parse_args()
+
+    thresholds = {int(c): float(p) for c, p in (t.split('=') for t in args.threshold)}
+    recount_plate(args.parent_directory, {'thresholds': thresholds, 'min_confidence': args.min_confidence,
+                                          'max_entropy': args.max_entropy}, args.output, args.variant)
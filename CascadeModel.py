@@ -0,0 +1,334 @@
+import os
+import time
+import argparse
+import joblib
+import cv2
+import numpy as np
+from PIL import Image
+from sklearn.ensemble import HistGradientBoostingClassifier
+from typing import Dict, List, Optional, Sequence, Tuple
+from RingThickness import LOWER_CYAN, UPPER_CYAN
+from StudentModel import StudentProcessor
+from ScoringEngine import ScoringEngine, parse_cell_id
+from DistillStudent import Distiller, collect_boxes, collect_crop_stores
+
+# Crops are shrunk to this side before the colour features are taken
+FEATURE_SIZE = 64
+# Stain coverage in rings around the crop centre, and in angular sectors of the ring band
+RADIAL_BINS = 6
+SECTORS = 16
+HUE_BINS = 12
+VALUE_BINS = 8
+NUM_CLASSES = 4
+
+def crop_features(crops: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Cheap colour and ring-shape features of RGB box crops.
+
+    Each crop gives the share of cyan (MBP) pixels in rings around the centre, the sorted
+    coverage of angular sectors of the ring band (so rotation does not matter), saturation-weighted
+    hue and value histograms, and brightness and mean colour statistics.
+
+    Args:
+        crops: NxHxWx3 batch or list of RGB crops of any size
+
+    Returns:
+        NxF float32 features
+    """
+    processor = StudentProcessor(FEATURE_SIZE)
+    offsets = np.arange(FEATURE_SIZE) - (FEATURE_SIZE - 1) / 2
+    yy, xx = np.meshgrid(offsets, offsets, indexing='ij')
+    radius = np.hypot(xx, yy) / (FEATURE_SIZE / 2)
+    radial_bin = np.minimum((radius * RADIAL_BINS).astype(np.int64), RADIAL_BINS).ravel()
+    sector = (((np.arctan2(yy, xx) + np.pi) / (2 * np.pi) * SECTORS).astype(np.int64) % SECTORS).ravel()
+    band = ((radius > 0.2) & (radius < 0.9)).ravel()
+    radial_pixels = np.bincount(radial_bin, minlength=RADIAL_BINS + 1)
+    sector_pixels = np.bincount(sector[band], minlength=SECTORS)
+
+    features = np.zeros((len(crops), RADIAL_BINS + 1 + SECTORS + HUE_BINS + VALUE_BINS + 7), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        small = processor.resize(np.ascontiguousarray(crop))
+        hsv = cv2.cvtColor(small, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        mask = (cv2.inRange(hsv.reshape(FEATURE_SIZE, FEATURE_SIZE, 3), LOWER_CYAN, UPPER_CYAN) > 0).ravel()
+        radial = np.bincount(radial_bin[mask], minlength=RADIAL_BINS + 1) / radial_pixels
+        sectors = np.sort(np.bincount(sector[band & mask], minlength=SECTORS) / sector_pixels)
+        hue = np.histogram(hsv[:, 0], bins=HUE_BINS, range=(0, 180), weights=hsv[:, 1] / 255.0)[0] / len(hsv)
+        value = np.histogram(hsv[:, 2], bins=VALUE_BINS, range=(0, 256))[0] / len(hsv)
+        stained = hsv[mask, 2]
+        stats = [mask.mean(), stained.mean() / 255.0 if len(stained) else 0.0,
+                 hsv[:, 2].mean() / 255.0, hsv[:, 2].std() / 255.0, *(small.reshape(-1, 3).mean(axis=0) / 255.0)]
+        features[i] = np.concatenate([radial, sectors, hue, value, stats])
+    return features
+
+class CascadeStage:
+    """Colour-feature classifier that settles confident boxes before the ViT sees them"""
+
+    def __init__(self, teacher: Optional[str] = None, threshold: float = 1.01, num_classes: int = NUM_CLASSES):
+
+        # Model whose predictions the stage imitates
+        self.teacher = teacher
+        # Boxes whose top probability is below the threshold are escalated; above 1 escalates all
+        self.threshold = threshold
+        self.num_classes = num_classes
+        self.classifier = None
+        self.metrics = {}
+
+    def fit(self, features: np.ndarray, labels: np.ndarray) -> 'CascadeStage':
+        """Train on teacher predictions."""
+        # Regularised so its probabilities stay usable for the confidence threshold
+        self.classifier = HistGradientBoostingClassifier(max_iter=100, learning_rate=0.05, l2_regularization=1.0,
+                                                         min_samples_leaf=20, random_state=0)
+        self.classifier.fit(features, labels)
+        return self
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """
+        Class probabilities per box.
+
+        Returns:
+            NxC float32 probabilities, column c for class c
+        """
+        probabilities = np.zeros((len(features), self.num_classes), dtype=np.float32)
+        classes = self.classifier.classes_.astype(np.int64)
+        if len(classes) == 1:
+            # The teacher only ever predicted one class in training
+            probabilities[:, classes[0]] = 1.0
+        elif len(features):
+            probabilities[:, classes] = self.classifier.predict_proba(features)
+        return probabilities
+
+    def calibrate(self, features: np.ndarray, labels: np.ndarray, target_agreement: float = 0.99) -> float:
+        """
+        Pick the lowest threshold at which the boxes the stage keeps still agree with the teacher.
+
+        Args:
+            features: Held-out features
+            labels: Teacher predictions for them
+            target_agreement: Required agreement of the kept boxes with the teacher
+
+        Returns:
+            The threshold, also stored on the stage with its held-out metrics
+        """
+        probabilities = self.predict_proba(features)
+        confidence = probabilities.max(axis=1)
+        order = np.argsort(-confidence, kind='stable')
+        sorted_confidence = confidence[order]
+        agreed = np.cumsum(probabilities.argmax(axis=1)[order] == labels[order])
+        # The threshold keeps every box tied at it, so only cut after the last box of each run of equal confidences
+        ends = np.flatnonzero(np.append(sorted_confidence[1:] != sorted_confidence[:-1], True)) \
+            if len(order) else np.zeros(0, dtype=np.int64)
+        kept = ends[agreed[ends] / (ends + 1) >= target_agreement]
+        # Keep the most boxes for which the agreement target still holds
+        count = int(kept[-1]) + 1 if len(kept) else 0
+        self.threshold = float(sorted_confidence[count - 1]) if count else 1.01
+        accepted = confidence >= self.threshold
+        count = int(accepted.sum())
+        correct = int((probabilities.argmax(axis=1)[accepted] == labels[accepted]).sum())
+        self.metrics.update({
+            'held_out_boxes': int(len(labels)),
+            'target_agreement': target_agreement,
+            'threshold': self.threshold,
+            'escalation_rate': 1.0 - count / len(labels) if len(labels) else 1.0,
+            'kept_agreement': correct / count if count else None,
+            # Escalated boxes are scored by the teacher itself
+            'cascade_agreement': (correct + len(labels) - count) / len(labels) if len(labels) else None
+        })
+        return self.threshold
+
+    def save(self, stage_path: str):
+        """Save the stage with its threshold and calibration metrics."""
+        os.makedirs(os.path.dirname(os.path.abspath(stage_path)), exist_ok=True)
+        joblib.dump({'teacher': self.teacher, 'threshold': self.threshold, 'num_classes': self.num_classes,
+                     'classifier': self.classifier, 'metrics': self.metrics}, stage_path)
+        print(f"Saved cascade stage to {stage_path}")
+
+    @classmethod
+    def load(cls, stage_path: str) -> 'CascadeStage':
+        """Load a stage saved by save."""
+        data = joblib.load(stage_path)
+        stage = cls(data['teacher'], data['threshold'], data['num_classes'])
+        stage.classifier = data['classifier']
+        stage.metrics = data.get('metrics', {})
+        return stage
+
+class CascadeEngine:
+    """Settles confident boxes with a CascadeStage and escalates the rest, with the ScoringEngine interface"""
+
+    def __init__(self, stage: CascadeStage, engine, audit_fraction: float = 0.05, seed: int = 0):
+
+        self.stage = stage
+        # Full model for escalated boxes: a ScoringEngine or ProbeEngine
+        self.engine = engine
+        # Share of kept boxes also scored by the full model, to measure agreement while running
+        self.audit_fraction = audit_fraction
+        self.rng = np.random.default_rng(seed)
+        self.take_report()
+
+    def take_report(self) -> dict:
+        """
+        Escalation and audit counts since the last call, then start counting afresh.
+
+        Returns:
+            boxes, escalated, escalation_rate, audited, audit_agreed, audit_agreement and timings
+        """
+        report = dict(getattr(self, 'counts', {}))
+        if report:
+            report['escalation_rate'] = report['escalated'] / report['boxes'] if report['boxes'] else 0.0
+            report['audit_agreement'] = report['audit_agreed'] / report['audited'] if report['audited'] else None
+        self.counts = {'boxes': 0, 'escalated': 0, 'audited': 0, 'audit_agreed': 0,
+                       'stage_seconds': 0.0, 'full_model_seconds': 0.0}
+        return report
+
+    def score_crops(self, crops: Sequence[np.ndarray], resized: bool = False,
+                    model_crops: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Class probabilities for RGB crops, from the stage where it is confident and the full model elsewhere.
+
+        Args:
+            crops: NxHxWx3 batch or list of RGB crops, at the box size the stage was trained on
+            resized: Crops are already at the full model's input size
+            model_crops: The same boxes already at the full model's input size, scored instead of
+                crops when escalating
+
+        Returns:
+            NxC float32 probabilities
+        """
+        start_time = time.time()
+        probabilities = self.stage.predict_proba(crop_features(crops))
+        escalate = probabilities.max(axis=1) < self.stage.threshold
+        audit = ~escalate & (self.rng.random(len(crops)) < self.audit_fraction)
+        run = np.flatnonzero(escalate | audit)
+        self.counts['stage_seconds'] += time.time() - start_time
+
+        if len(run):
+            start_time = time.time()
+            if model_crops is not None:
+                full = self.engine.score_arrays(model_crops[run], resized=True)
+            else:
+                full = self.engine.score_arrays([crops[i] for i in run] if isinstance(crops, list) else crops[run],
+                                                resized=resized)
+            self.counts['full_model_seconds'] += time.time() - start_time
+            audited = audit[run]
+            kept = ScoringEngine.predict(probabilities[run][audited])
+            self.counts['audited'] += int(audited.sum())
+            self.counts['audit_agreed'] += int(np.sum(kept == ScoringEngine.predict(full[audited])))
+            probabilities[run[~audited]] = full[~audited]
+        self.counts['boxes'] += len(crops)
+        self.counts['escalated'] += int(escalate.sum())
+        return probabilities
+
+    def score_folder(self, boxes_folder: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(filenames, cell_ids, probabilities) for a folder of box images."""
+        filenames = [f for f in sorted(os.listdir(boxes_folder))
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        crops = []
+        loaded = []
+        for filename in filenames:
+            try:
+                with Image.open(os.path.join(boxes_folder, filename)) as image:
+                    crops.append(np.asarray(image.convert('RGB')))
+                loaded.append(True)
+            except Exception as e:
+                print(f"Error processing {filename}: {str(e)}")
+                loaded.append(False)
+        probabilities = np.full((len(filenames), self.stage.num_classes), np.nan, dtype=np.float32)
+        if crops:
+            probabilities[np.asarray(loaded, dtype=bool)] = self.score_crops(crops)
+        return filenames, np.array([parse_cell_id(f) for f in filenames], dtype=np.int64), probabilities
+
+    def score_store(self, crop_store) -> Tuple[np.ndarray, np.ndarray]:
+        """(cell_ids, probabilities) for a packed crop store."""
+        crops, index = crop_store.load()
+        cell_ids = np.array([entry['cell_id'] for entry in index], dtype=np.int64)
+        return cell_ids, self.score_crops(crops)
+
+    def score_arrays(self, crops: np.ndarray, resized: bool = False,
+                     model_crops: Optional[np.ndarray] = None) -> np.ndarray:
+        """Class probabilities for an in-memory batch of RGB crops, see score_crops."""
+        return self.score_crops(crops, resized=resized, model_crops=model_crops)
+
+def train_cascade(teacher_path: str, dataset_folders: List[str], plate_folders: List[str], stage_path: str,
+                  cache_folder: Optional[str] = None, target_agreement: float = 0.99, val_fraction: float = 0.2,
+                  seed: int = 0, batch_size: int = 64, num_workers: Optional[int] = None) -> CascadeStage:
+    """
+    Train and calibrate a cascade stage on the teacher's predictions.
+
+    Args:
+        teacher_path: Fine-tuned ViT whose predictions the stage imitates
+        dataset_folders: Box image datasets (labels are ignored; test/validation splits are held out)
+        plate_folders: Plates whose crop stores are added
+        stage_path: Where to save the stage
+        cache_folder: Teacher logits cache, shared with DistillStudent.py; default next to the stage
+        target_agreement: Agreement with the teacher required of the boxes the stage keeps
+        val_fraction: Share held out for calibration when the data has no test split
+        seed: Seed of the hold-out split
+        batch_size: Teacher batch size
+        num_workers: Teacher DataLoader workers
+
+    Returns:
+        The calibrated CascadeStage
+    """
+    distiller = Distiller(teacher_path, cache_folder or os.path.dirname(os.path.abspath(stage_path)),
+                          input_size=FEATURE_SIZE, batch_size=batch_size, num_workers=num_workers)
+    paths, held_out = [], []
+    for folder in dataset_folders:
+        folder_paths, _, folder_held_out = collect_boxes(folder)
+        paths += folder_paths
+        held_out.append(folder_held_out)
+    crop_stores = [path for plate in plate_folders for path in collect_crop_stores(plate)]
+    _, logits = distiller.teacher_logits(paths, crop_stores)
+    images = distiller.load_images(paths, crop_stores)
+    labels = ScoringEngine.predict(logits) if len(logits) else np.zeros(0, dtype=np.int64)
+
+    held_out = np.concatenate(held_out + [np.zeros(len(labels) - len(paths), dtype=bool)])
+    if not held_out.any():
+        held_out = np.random.default_rng(seed).random(len(labels)) < val_fraction
+    train_rows = np.flatnonzero((labels >= 0) & ~held_out)
+    val_rows = np.flatnonzero((labels >= 0) & held_out)
+    if not len(train_rows) or not len(val_rows):
+        raise ValueError("Need teacher-scored boxes both to train and to calibrate the cascade stage")
+
+    features = crop_features(images)
+    print(f"Training cascade stage on {len(train_rows)} boxes, calibrating on {len(val_rows)}")
+    stage = CascadeStage(os.path.abspath(teacher_path)).fit(features[train_rows], labels[train_rows])
+    stage.calibrate(features[val_rows], labels[val_rows], target_agreement)
+
+    # Stage throughput includes computing the features
+    start_time = time.time()
+    stage.predict_proba(crop_features(images[val_rows]))
+    stage.metrics['stage_boxes_per_second'] = len(val_rows) / max(time.time() - start_time, 1e-9)
+    if distiller.teacher_boxes_per_second:
+        stage.metrics['teacher_boxes_per_second'] = distiller.teacher_boxes_per_second
+        # Every escalated box costs the stage and the teacher
+        stage.metrics['expected_speedup'] = 1.0 / (
+            distiller.teacher_boxes_per_second / stage.metrics['stage_boxes_per_second']
+            + stage.metrics['escalation_rate'])
+    stage.metrics['train_boxes'] = int(len(train_rows))
+
+    print(f"Threshold {stage.threshold:.3f}: {stage.metrics['escalation_rate']:.1%} of held-out boxes escalated, "
+          f"cascade agreement with the ViT {stage.metrics['cascade_agreement']:.4f}")
+    stage.save(stage_path)
+    return stage
+
+def summarise_reports(reports: Dict[str, dict]) -> dict:
+    """Plate totals of per-series CascadeEngine reports."""
+    totals = {key: sum(r.get(key, 0) for r in reports.values())
+              for key in ('boxes', 'escalated', 'audited', 'audit_agreed', 'stage_seconds', 'full_model_seconds')}
+    totals['escalation_rate'] = totals['escalated'] / totals['boxes'] if totals['boxes'] else 0.0
+    totals['audit_agreement'] = totals['audit_agreed'] / totals['audited'] if totals['audited'] else None
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the fast first stage of the scoring cascade")
+    parser.add_argument('--datasets', nargs='*', default=[], help="Box image datasets")
+    parser.add_argument('--plates', nargs='*', default=[], help="Plate folders with crop stores")
+    parser.add_argument('--model', default="./Modelv1.4/Run3New", help="Fine-tuned ViT to imitate")
+    parser.add_argument('--output', default="./Modelv1.4/cascade/stage.joblib", help="Stage file to write")
+    parser.add_argument('--cache', default=None, help="Teacher logits cache folder, e.g. the student folder")
+    parser.add_argument('--target', type=float, default=0.99, help="Agreement with the ViT of kept boxes")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    train_cascade(args.model, args.datasets, args.plates, args.output, args.cache, args.target,
+                  batch_size=args.batch_size, num_workers=args.workers)
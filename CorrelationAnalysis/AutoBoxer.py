@@ -1,15 +1,25 @@
 import cv2
 import numpy as np
 import os
+import sys
 import json
+import time
+import argparse
 from tkinter import Tk, filedialog, messagebox
 import glob
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SeriesPool import SeriesPool
+from PillarDetector import REFERENCE_UM_PER_PIXEL, load_pixel_size
+
 
 class NucleiAnalyser:
-    def __init__(self, image_path, output_folder):
+    def __init__(self, image_path, output_folder, um_per_pixel=None):
         self.image_path = image_path
         self.output_folder = output_folder
+        # Size limits are in pixels at the reference pixel size and scale with the series pixel size
+        self.area_scale = (REFERENCE_UM_PER_PIXEL / (um_per_pixel or REFERENCE_UM_PER_PIXEL)) ** 2
         self.image = None
         self.nuclei_count = []
         self.nuclei_prop = []
@@ -37,7 +47,7 @@ class NucleiAnalyser:
         # Find them nuclei
         contours, _ = cv2.findContours(binary_cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        MIN_CONTOUR_AREA = 20
+        MIN_CONTOUR_AREA = 20 * self.area_scale
         filtered_contours = []
 
         for cnt in contours:
@@ -50,8 +60,8 @@ class NucleiAnalyser:
 
         contours_final, _ = cv2.findContours(final_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        MIN_SIZE_THRESHOLD = 450
-        MAX_SIZE_THRESHOLD = 10000
+        MIN_SIZE_THRESHOLD = 450 * self.area_scale
+        MAX_SIZE_THRESHOLD = 10000 * self.area_scale
 
         self.nuclei_count = []
         self.nuclei_prop = []
@@ -128,50 +138,65 @@ class NucleiAnalyser:
         self.load_single_image()
 
         if not self.detect_nuclei():
-            messagebox.showinfo("No Nuclei", "No nuclei of acceptable size were detected in the image.")
+            print(f"No nuclei of acceptable size were detected in {self.image_path}")
             return False
         
         self.visualise()
         return True
 
-def process_all_subfolders(parent_directory):
-    """Process all subfolders in the parent directory that contain nuclei_mip.png"""
-    processed_folders = 0
-    successful_folders = 0
-    
+def analyse_series(folder_name, subfolder_path):
+    """Analyse one series without any GUI calls and return a structured result."""
+    nuclei_image_path = os.path.join(subfolder_path, "nuclei_mip.png")
+    result = {'series': folder_name, 'path': subfolder_path}
+
+    # Check if the nuclei image exists
+    if not os.path.exists(nuclei_image_path):
+        result.update(status='skipped', message="nuclei_mip.png not found")
+        return result
+
+    # Process this folder - output goes to the same subfolder
+    start_time = time.time()
+    analyser = NucleiAnalyser(nuclei_image_path, subfolder_path, load_pixel_size(subfolder_path))
+    success = analyser.process()
+
+    result.update(
+        status='ok' if success else 'no_nuclei',
+        nuclei=len(analyser.nuclei_count),
+        message=f"Found {len(analyser.nuclei_count)} nuclei" if success else "No nuclei detected",
+        seconds=time.time() - start_time
+    )
+    return result
+
+def process_all_subfolders(parent_directory, workers=None):
+    """Process all subfolders in the parent directory that contain nuclei_mip.png over a process pool"""
+    tasks = {}
+
     # Get all subdirectories in the parent directory
-    for folder_name in os.listdir(parent_directory):
+    for folder_name in sorted(os.listdir(parent_directory)):
         subfolder_path = os.path.join(parent_directory, folder_name)
-        
-        # Check if it's a directory
         if os.path.isdir(subfolder_path):
-            # Look for nuclei_mip.png in the subfolder
-            nuclei_image_path = os.path.join(subfolder_path, "nuclei_mip.png")
-            
-            # Check if the nuclei image exists
-            if os.path.exists(nuclei_image_path):
-                print(f"Processing folder: {folder_name}")
-                processed_folders += 1
-                
-                try:
-                    # Process this folder - output goes to the same subfolder
-                    analyser = NucleiAnalyser(nuclei_image_path, subfolder_path)
-                    success = analyser.process()
-                    
-                    if success:
-                        successful_folders += 1
-                        print(f"✓ Successfully processed {folder_name} - Found {len(analyser.nuclei_count)} nuclei")
-                    else:
-                        print(f"✗ No nuclei detected in {folder_name}")
-                        
-                except Exception as e:
-                    print(f"✗ Error processing {folder_name}: {str(e)}")
-            else:
-                print(f"Skipping {folder_name}: nuclei_mip.png not found")
-    
+            tasks[folder_name] = (folder_name, subfolder_path)
+
+    pool = SeriesPool(workers)
+    results = pool.run(analyse_series, tasks)
+    pool.save_results(results, os.path.join(parent_directory, "nuclei_results.json"))
+
+    processed_folders = sum(1 for r in results if r['status'] != 'skipped')
+    successful_folders = sum(1 for r in results if r['status'] == 'ok')
     return processed_folders, successful_folders
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect nuclei in every series in a parent directory")
+    parser.add_argument('parent_directory', nargs='?', help="Parent directory (asks with a dialog if omitted)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    # With a directory on the command line the run is fully headless
+    if args.parent_directory:
+        processed, successful = process_all_subfolders(args.parent_directory, workers=args.workers)
+        print(f"Processed {processed} folders, successfully completed: {successful}, failed: {processed - successful}")
+        sys.exit()
+
     root = Tk()
     root.withdraw()
 
@@ -183,7 +208,7 @@ if __name__ == "__main__":
         exit()
     
     try:
-        processed, successful = process_all_subfolders(parent_directory)
+        processed, successful = process_all_subfolders(parent_directory, workers=args.workers)
         
         messagebox.showinfo("Processing Complete", 
                            f"Processed {processed} folders\n"
@@ -192,5 +217,3 @@ if __name__ == "__main__":
         
     except Exception as e:
         messagebox.showerror("Error", f"An error occurred: {str(e)}")
-    
-    root.destroy()
\ No newline at end of file
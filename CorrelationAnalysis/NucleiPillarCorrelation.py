@@ -4,6 +4,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 from tkinter import Tk, filedialog, messagebox
 import os
+import sys
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PillarTable import PillarTable
 
 class PillarNucleiAnalyser:
     def __init__(self):
@@ -52,20 +57,24 @@ class PillarNucleiAnalyser:
         # Analyse within search radisu
         self.analysis_results = []
         
-        for pillar in self.wrapped_pillars:
+        # Nuclei within the radius of every pillar from one KD-tree query
+        pillar_table = PillarTable.from_records(self.wrapped_pillars)
+        nuclei_xy = np.array([(nucleus['x_c'], nucleus['y_c']) for nucleus in self.nuclei_properties], dtype=np.float64).reshape(-1, 2)
+        nearby = pillar_table.within(nuclei_xy, search_radius)
+        
+        for pillar, nuclei_indices in zip(self.wrapped_pillars, nearby):
             pillar_coords = pillar['center_coordinates']
             prox_nuclei = []
             
-            for nucleus in self.nuclei_properties:
+            for nuclei_index in nuclei_indices.tolist():
+                nucleus = self.nuclei_properties[nuclei_index]
                 distance = self.calculate_distance(pillar_coords, nucleus)
-                
-                if distance <= search_radius:
-                    prox_nuclei.append({
-                        'nuclei_id': nucleus['nuclei_id'],
-                        'distance': distance,
-                        'area': nucleus['area'],
-                        'circularity': nucleus.get('circularity', 0)
-                    })
+                prox_nuclei.append({
+                    'nuclei_id': nucleus['nuclei_id'],
+                    'distance': distance,
+                    'area': nucleus['area'],
+                    'circularity': nucleus.get('circularity', 0)
+                })
             
             # Sort by distance
             prox_nuclei.sort(key=lambda x: x['distance'])
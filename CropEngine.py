@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, List, Sequence, Tuple
+
+class CropEngine:
+    """Cuts fixed-size boxes around pillar centres in one vectorised pass"""
+
+    def __init__(self, box_size: int = 100, border_value: int = 0):
+
+        self.box_size = box_size
+        self.half = box_size // 2
+        # Fill for the part of an edge box that lies outside the image
+        self.border_value = border_value
+
+    def bounds(self, centres: List[Tuple[int, int]], image_shape: Tuple[int, ...]) -> List[Tuple[int, int, int, int]]:
+        """
+        Box around each centre, clipped to the image.
+
+        Args:
+            centres: (x, y) pillar centres
+            image_shape: Shape of the image the boxes are cut from
+
+        Returns:
+            (x1, y1, x2, y2) for each centre
+        """
+        if len(centres) == 0:
+            return []
+        img_h, img_w = image_shape[:2]
+        points = np.asarray(centres, dtype=np.int64)
+        x1 = np.maximum(0, points[:, 0] - self.half)
+        y1 = np.maximum(0, points[:, 1] - self.half)
+        x2 = np.minimum(img_w, points[:, 0] + self.half)
+        y2 = np.minimum(img_h, points[:, 1] + self.half)
+        return [tuple(box) for box in np.column_stack([x1, y1, x2, y2]).tolist()]
+
+    def pad(self, image: np.ndarray) -> np.ndarray:
+        """
+        Pad the image once so every box around an in-image centre is a full window.
+
+        Args:
+            image: HxW or HxWxC image
+
+        Returns:
+            Padded image, with pixel (x, y) of the original at (x + half, y + half)
+        """
+        after = self.box_size - self.half
+        return cv2.copyMakeBorder(image, self.half, after, self.half, after,
+                                  cv2.BORDER_CONSTANT, value=[self.border_value] * 4)
+
+    def extract(self, image: np.ndarray, centres: List[Tuple[int, int]], rgb: bool = True) -> np.ndarray:
+        """
+        Cut a box_size x box_size window around every centre.
+
+        Args:
+            image: BGR (or greyscale) image the boxes are cut from
+            centres: (x, y) pillar centres
+            rgb: Convert BGR crops to RGB for the classifier
+
+        Returns:
+            Contiguous NxSxSx3 (or NxSxS) uint8 batch, pillar at the centre of each crop
+        """
+        channels = image.shape[2:]
+        if len(centres) == 0:
+            return np.zeros((0, self.box_size, self.box_size) + channels, dtype=image.dtype)
+
+        padded = self.pad(image)
+        windows = sliding_window_view(padded, (self.box_size, self.box_size), axis=(0, 1))
+
+        # Window (y, x) of the padded image starts at (x - half, y - half) of the original
+        points = np.asarray(centres, dtype=np.int64)
+        xs = np.clip(points[:, 0], 0, image.shape[1] - 1)
+        ys = np.clip(points[:, 1], 0, image.shape[0] - 1)
+        crops = windows[ys, xs]
+
+        # sliding_window_view puts the window axes last
+        if channels:
+            crops = np.moveaxis(crops, 1, -1)
+            if rgb:
+                crops = crops[..., ::-1]
+        return np.ascontiguousarray(crops)
+
+    def resize_matrix(self, src: int, dst: int) -> np.ndarray:
+        """
+        1D resampling weights from src to dst pixels.
+
+        Shrinking averages the source pixels each output pixel covers (area
+        interpolation); enlarging interpolates linearly between pixel centres,
+        as cv2.INTER_AREA and PIL bilinear do.
+
+        Args:
+            src: Input length
+            dst: Output length
+
+        Returns:
+            dst x src float32 weight matrix with rows summing to 1
+        """
+        weights = np.zeros((dst, src), dtype=np.float64)
+        scale = src / dst
+        if dst <= src:
+            for i in range(dst):
+                start, stop = i * scale, (i + 1) * scale
+                for j in range(int(np.floor(start)), min(src, int(np.ceil(stop)))):
+                    weights[i, j] = min(stop, j + 1) - max(start, j)
+        else:
+            centres = np.clip((np.arange(dst) + 0.5) * scale - 0.5, 0, src - 1)
+            left = np.floor(centres).astype(int)
+            right = np.minimum(left + 1, src - 1)
+            frac = centres - left
+            weights[np.arange(dst), left] += 1 - frac
+            weights[np.arange(dst), right] += frac
+        return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    def resize_batch(self, crops: np.ndarray, output_size: int) -> np.ndarray:
+        """
+        Resize a whole NxSxS(xC) batch with one pair of matrix products.
+
+        Args:
+            crops: Batch of square crops
+            output_size: Output side length
+
+        Returns:
+            Nxoutput_sizexoutput_size(xC) batch of the input dtype
+        """
+        size = crops.shape[1]
+        if size == output_size:
+            return crops
+        weights = self.resize_matrix(size, output_size)
+        subscripts = 'oy,nyxc,px->nopc' if crops.ndim == 4 else 'oy,nyx,px->nop'
+        resized = np.einsum(subscripts, weights, crops.astype(np.float32), weights, optimize=True)
+        if np.issubdtype(crops.dtype, np.integer):
+            info = np.iinfo(crops.dtype)
+            resized = np.clip(np.rint(resized), info.min, info.max)
+        return np.ascontiguousarray(resized.astype(crops.dtype))
+
+    def extract_sizes(self, image: np.ndarray, centres: List[Tuple[int, int]],
+                      sizes: Sequence[Tuple[int, int]], rgb: bool = True) -> Dict[Tuple[int, int], np.ndarray]:
+        """
+        Crops at several box sizes and output resolutions from one padded copy of the image.
+
+        Args:
+            image: BGR (or greyscale) image the boxes are cut from
+            centres: (x, y) pillar centres, e.g. PillarTable.centres()
+            sizes: (box_size, output_size) pairs, e.g. [(100, 100), (100, 224), (30, 30)]
+            rgb: Convert BGR crops to RGB for the classifier
+
+        Returns:
+            Batch for each (box_size, output_size) pair
+        """
+        largest = max(box_size for box_size, _ in sizes)
+        padder = CropEngine(largest, self.border_value)
+        padded = padder.pad(image)
+
+        points = np.asarray(centres, dtype=np.int64).reshape(-1, 2)
+        xs = np.clip(points[:, 0], 0, image.shape[1] - 1)
+        ys = np.clip(points[:, 1], 0, image.shape[0] - 1)
+
+        batches = {}
+        crops_by_box = {}
+        for box_size, output_size in sizes:
+            if box_size not in crops_by_box:
+                # Windows of every box size come from the same padded image, offset to stay centred
+                offset = padder.half - box_size // 2
+                windows = sliding_window_view(padded, (box_size, box_size), axis=(0, 1))
+                crops = windows[ys + offset, xs + offset] if len(points) else \
+                    np.zeros((0,) + image.shape[2:] + (box_size, box_size), dtype=image.dtype)
+                if image.ndim == 3:
+                    crops = np.moveaxis(crops, 1, -1)
+                    if rgb:
+                        crops = crops[..., ::-1]
+                crops_by_box[box_size] = np.ascontiguousarray(crops)
+            batches[(box_size, output_size)] = self.resize_batch(crops_by_box[box_size], output_size)
+        return batches
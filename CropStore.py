@@ -0,0 +1,127 @@
+import os
+import json
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+from CropEngine import CropEngine
+
+class CropStore:
+    """Packed per-series pillar crops: one NxSxSx3 uint8 RGB .npy plus a JSON index"""
+
+    def __init__(self, series_folder: str, series_name: Optional[str] = None, box_size: int = 100):
+
+        self.series_folder = series_folder
+        self.series_name = series_name or os.path.basename(os.path.normpath(series_folder))
+        self.box_size = box_size
+        self.engine = CropEngine(box_size)
+        self.crops_path = os.path.join(series_folder, f"{self.series_name}_crops.npy")
+        self.index_path = os.path.join(series_folder, f"{self.series_name}_crops_index.json")
+
+    def exists(self) -> bool:
+        """Check that both the crop array and its index are on disk."""
+        return os.path.exists(self.crops_path) and os.path.exists(self.index_path)
+
+    def bounds(self, centres: List[Tuple[int, int]], image_shape: Tuple[int, ...]) -> List[Tuple[int, int, int, int]]:
+        """Box around each centre, clipped to the image."""
+        return self.engine.bounds(centres, image_shape)
+
+    def pack(self, image: np.ndarray, centres: List[Tuple[int, int]]) -> np.ndarray:
+        """
+        Cut every box out of the image into one fixed-size array.
+
+        Boxes reaching past the image border keep the pillar at the centre and
+        are zero outside the image.
+
+        Args:
+            image: BGR myelin image
+            centres: (x, y) pillar centres
+
+        Returns:
+            NxSxSx3 uint8 array of RGB crops
+        """
+        return self.engine.extract(image, centres)
+
+    def save(self, crops: np.ndarray, index: List[dict]):
+        """
+        Write the crops and index, replacing any previous store atomically.
+
+        Args:
+            crops: NxSxSx3 uint8 RGB crops
+            index: One entry per crop with 'cell_id', 'center_coordinates' and 'bounds'
+        """
+        tmp_path = self.crops_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(crops, dtype=np.uint8))
+        os.replace(tmp_path, self.crops_path)
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"box_size": self.box_size, "crops": index}, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+        print(f"Saved {len(index)} crops to {self.crops_path}")
+
+    def load(self, mmap: bool = True) -> Tuple[np.ndarray, List[dict]]:
+        """
+        Load the crops and index.
+
+        Args:
+            mmap: Memory-map the crops instead of reading them into memory
+
+        Returns:
+            (crops, index) with crops[i] belonging to index[i]
+        """
+        crops = np.load(self.crops_path, mmap_mode='r' if mmap else None)
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)["crops"]
+        return crops, index
+
+    def get_crop(self, cell_id: int) -> np.ndarray:
+        """Load a single crop by cell_id."""
+        crops, index = self.load()
+        for row, entry in enumerate(index):
+            if entry["cell_id"] == cell_id:
+                return crops[row]
+        raise KeyError(f"cell_id {cell_id} not in {self.index_path}")
+
+    def export_pngs(self, output_folder: Optional[str] = None) -> str:
+        """
+        Write every crop as boxes/box_{cell_id}.png for inspection.
+
+        Args:
+            output_folder: Destination, defaults to the series 'boxes' folder
+
+        Returns:
+            The folder the PNGs were written to
+        """
+        output_folder = output_folder or os.path.join(self.series_folder, "boxes")
+        os.makedirs(output_folder, exist_ok=True)
+        crops, index = self.load()
+        for crop, entry in zip(crops, index):
+            cv2.imwrite(os.path.join(output_folder, f"box_{entry['cell_id']}.png"),
+                        cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+        print(f"Exported {len(index)} crops to {output_folder}")
+        return output_folder
+
+    def export_dataset(self, labels: dict, dataset_folder: str, output_size: Optional[int] = None):
+        """
+        Write labelled crops into class subfolders for training (imagefolder layout).
+
+        Args:
+            labels: Mapping of cell_id to class label; unlabelled crops are skipped
+            dataset_folder: Root of the training set, one subfolder per class
+            output_size: Resize the whole batch to this side length first, e.g. the model input size
+        """
+        crops, index = self.load()
+        if output_size:
+            crops = self.engine.resize_batch(np.asarray(crops), output_size)
+        written = 0
+        for crop, entry in zip(crops, index):
+            label = labels.get(entry["cell_id"])
+            if label is None:
+                continue
+            class_folder = os.path.join(dataset_folder, str(label))
+            os.makedirs(class_folder, exist_ok=True)
+            filename = f"{self.series_name}_box_{entry['cell_id']}.png"
+            cv2.imwrite(os.path.join(class_folder, filename), cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+            written += 1
+        print(f"Exported {written} labelled crops to {dataset_folder}")
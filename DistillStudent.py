@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import argparse
+import glob
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from typing import Dict, List, Optional, Tuple
+from CropEngine import CropEngine
+from ScoringEngine import ScoringEngine, BoxImageDataset, CropArrayDataset
+from StudentModel import StudentClassifier, StudentProcessor
+from ScoringBackends import load_backend
+from EmbeddingStore import crop_hash, model_id
+
+# Path components that mark a held-out split of an imagefolder dataset
+HELD_OUT_SPLITS = {'test', 'validation', 'val'}
+
+def collect_boxes(dataset_folder: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Box images of an imagefolder dataset, e.g. one written by CropStore.export_dataset.
+
+    Args:
+        dataset_folder: Root folder, boxes in numbered class subfolders or unlabelled
+
+    Returns:
+        (paths, labels, held_out), label -1 for boxes outside a numbered class folder
+    """
+    paths = sorted(p for p in glob.glob(os.path.join(dataset_folder, '**', '*'), recursive=True)
+                   if p.lower().endswith(('.png', '.jpg', '.jpeg')))
+    labels = []
+    held_out = []
+    for path in paths:
+        parts = os.path.relpath(path, dataset_folder).split(os.sep)
+        labels.append(int(parts[-2]) if len(parts) > 1 and parts[-2].isdigit() else -1)
+        held_out.append(any(part.lower() in HELD_OUT_SPLITS for part in parts[:-1]))
+    return paths, np.array(labels, dtype=np.int64), np.array(held_out, dtype=bool)
+
+def collect_crop_stores(parent_directory: str) -> List[str]:
+    """Packed crop stores of every series under a plate folder."""
+    return sorted(glob.glob(os.path.join(parent_directory, '**', '*_crops.npy'), recursive=True))
+
+def box_key(path: str) -> str:
+    """Cache key of a box image; a rewritten file changes size or mtime."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+class Distiller:
+    """Trains a StudentClassifier on the logits of the fine-tuned ViT teacher"""
+
+    def __init__(self, teacher_path: str, output_path: str, input_size: int = 112, width: float = 1.0,
+                 temperature: float = 4.0, alpha: float = 0.7, batch_size: int = 64, num_workers: Optional[int] = None):
+
+        self.teacher_path = teacher_path
+        self.output_path = output_path
+        self.input_size = input_size
+        self.width = width
+        # Softened teacher distribution and weight of the distillation term against the labels
+        self.temperature = temperature
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.processor = StudentProcessor(input_size)
+        self.teacher_engine = None
+        self.teacher_boxes_per_second = None
+        self.cache_path = os.path.join(output_path, "teacher_logits.npz")
+
+    def get_teacher_engine(self) -> ScoringEngine:
+        """Load the teacher only when logits are missing from the cache."""
+        if self.teacher_engine is None:
+            model, processor = load_backend(self.teacher_path, "vit")
+            self.teacher_engine = ScoringEngine(model.to(self.device), processor, self.device,
+                                                batch_size=self.batch_size, num_workers=self.num_workers)
+        return self.teacher_engine
+
+    def load_cache(self) -> Dict[str, np.ndarray]:
+        """Teacher logits from earlier runs of the same teacher checkpoint, keyed by box_key or crop_hash."""
+        if not os.path.exists(self.cache_path):
+            return {}
+        with np.load(self.cache_path) as data:
+            if str(data['teacher']) != model_id(self.teacher_path):
+                return {}
+            return dict(zip(data['keys'].tolist(), data['logits']))
+
+    def save_cache(self, cache: Dict[str, np.ndarray]):
+        """Keep the teacher logits so further student runs skip the teacher."""
+        os.makedirs(self.output_path, exist_ok=True)
+        keys = list(cache)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=np.array(keys), logits=np.stack([cache[k] for k in keys]),
+                     teacher=np.array(model_id(self.teacher_path)))
+        os.replace(tmp_path, self.cache_path)
+
+    def teacher_logits(self, paths: List[str], crop_stores: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Teacher logits for every box image and stored crop, computing only those not cached.
+
+        Args:
+            paths: Box image paths
+            crop_stores: Paths of packed *_crops.npy stores
+
+        Returns:
+            (keys, NxC logits) with NaN rows for boxes the teacher could not load
+        """
+        cache = self.load_cache()
+        keys = [box_key(p) for p in paths]
+        missing = [(p, k) for p, k in zip(paths, keys) if k not in cache]
+        scored = 0
+        start_time = time.time()
+        if missing:
+            print(f"Scoring {len(missing)} box images with the teacher...")
+            missing_paths, missing_keys = zip(*missing)
+            logits = self.get_teacher_engine().logits(BoxImageDataset(list(missing_paths), self.get_teacher_engine().processor))
+            cache.update(zip(missing_keys, logits))
+            scored += len(missing)
+
+        for crops_path in crop_stores:
+            crops = np.load(crops_path, mmap_mode='r')
+            count = len(crops)
+            # Keyed by content, so a re-boxed series never picks up logits of the old crops
+            store_keys = [crop_hash(crop) for crop in crops]
+            keys += store_keys
+            if any(k not in cache for k in store_keys):
+                print(f"Scoring {count} crops of {crops_path} with the teacher...")
+                engine = self.get_teacher_engine()
+                logits = engine.logits(CropArrayDataset(engine.processor, crops_path=crops_path))
+                cache.update(zip(store_keys, logits))
+                scored += count
+
+        if scored:
+            self.teacher_boxes_per_second = scored / (time.time() - start_time)
+            self.save_cache(cache)
+        return keys, np.stack([cache[k] for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def load_images(self, paths: List[str], crop_stores: List[str]) -> np.ndarray:
+        """
+        Every box at the student input size, in the order of teacher_logits.
+
+        Returns:
+            NxSxSx3 uint8 RGB array
+        """
+        images = []
+        for path in paths:
+            try:
+                with Image.open(path) as image:
+                    images.append(self.processor.resize(np.asarray(image.convert('RGB'))))
+            except Exception as e:
+                print(f"Error loading {os.path.basename(path)}: {str(e)}")
+                images.append(np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8))
+        batches = [np.stack(images)] if images else []
+        engine = CropEngine()
+        for crops_path in crop_stores:
+            batches.append(engine.resize_batch(np.load(crops_path), self.input_size))
+        if not batches:
+            return np.zeros((0, self.input_size, self.input_size, 3), dtype=np.uint8)
+        return np.concatenate(batches)
+
+    def augment(self, crops: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Random 90 degree rotations and flips; ring completeness does not depend on orientation."""
+        out = np.empty_like(crops)
+        for i, crop in enumerate(crops):
+            crop = np.rot90(crop, rng.integers(4))
+            out[i] = crop[:, ::-1] if rng.random() < 0.5 else crop
+        return out
+
+    def loss(self, student_logits: torch.Tensor, teacher_logits: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        """Temperature-scaled KL to the teacher, plus cross-entropy on the labelled boxes."""
+        t = self.temperature
+        distillation = F.kl_div(F.log_softmax(student_logits / t, dim=-1), F.softmax(teacher_logits / t, dim=-1),
+                                reduction='batchmean') * t * t
+        labelled = labels >= 0
+        if not labelled.any():
+            return distillation
+        hard = F.cross_entropy(student_logits[labelled], labels[labelled])
+        return self.alpha * distillation + (1 - self.alpha) * hard
+
+    def student_logits(self, student: StudentClassifier, images: np.ndarray) -> np.ndarray:
+        """Student logits for boxes already at the input size."""
+        engine = ScoringEngine(student, self.processor, self.device, batch_size=self.batch_size, num_workers=0)
+        return engine.logits(CropArrayDataset(self.processor, crops=images, resized=True))
+
+    def train(self, images: np.ndarray, teacher_logits: np.ndarray, labels: np.ndarray, train_rows: np.ndarray,
+              val_rows: np.ndarray, epochs: int = 30, learning_rate: float = 2e-3, seed: int = 0) -> StudentClassifier:
+        """
+        Distil the teacher into a new student.
+
+        Args:
+            images: NxSxSx3 uint8 RGB boxes at the input size
+            teacher_logits: NxC teacher logits
+            labels: Manual labels, -1 where unlabelled
+            train_rows: Rows to train on
+            val_rows: Held-out rows; the epoch agreeing best with the teacher on them is kept
+            epochs: Passes over the training rows
+            learning_rate: Peak AdamW learning rate, cosine-decayed over the run
+            seed: Seed for shuffling, augmentation and initialisation
+
+        Returns:
+            Trained StudentClassifier
+        """
+        torch.manual_seed(seed)
+        rng = np.random.default_rng(seed)
+        student = StudentClassifier(teacher_logits.shape[1], self.input_size, self.width, metadata={
+            "teacher": self.teacher_path,
+            "temperature": self.temperature,
+            "alpha": self.alpha,
+            "epochs": epochs,
+            "train_boxes": int(len(train_rows))
+        }).to(self.device)
+        optimiser = torch.optim.AdamW(student.parameters(), lr=learning_rate, weight_decay=1e-4)
+        steps = epochs * max(1, int(np.ceil(len(train_rows) / self.batch_size)))
+        scheduler = torch.optim.lr_scheduler.OneCycleLR(optimiser, max_lr=learning_rate, total_steps=steps)
+
+        teacher = torch.from_numpy(teacher_logits.astype(np.float32))
+        targets = torch.from_numpy(labels)
+        teacher_classes = teacher_logits.argmax(axis=1)
+        best_agreement, best_state = -1.0, None
+
+        for epoch in range(epochs):
+            student.train()
+            epoch_start = time.time()
+            order = rng.permutation(train_rows)
+            total_loss = 0.0
+            for start in range(0, len(order), self.batch_size):
+                rows = order[start:start + self.batch_size]
+                pixel_values = self.processor(self.augment(images[rows], rng), do_resize=False)["pixel_values"]
+                logits = student(pixel_values=pixel_values.to(self.device)).logits
+                loss = self.loss(logits, teacher[rows].to(self.device), targets[rows].to(self.device))
+                optimiser.zero_grad()
+                loss.backward()
+                optimiser.step()
+                scheduler.step()
+                total_loss += loss.item() * len(rows)
+
+            rows = val_rows if len(val_rows) else train_rows
+            agreement = float(np.mean(self.student_logits(student, images[rows]).argmax(axis=1) == teacher_classes[rows]))
+            print(f"Epoch {epoch + 1}/{epochs}: loss {total_loss / max(1, len(order)):.4f}, "
+                  f"teacher agreement {agreement:.4f} ({time.time() - epoch_start:.1f} s)")
+            if agreement > best_agreement:
+                best_agreement = agreement
+                best_state = {k: v.detach().clone() for k, v in student.state_dict().items()}
+
+        student.load_state_dict(best_state)
+        student.metadata["held_out_agreement"] = best_agreement
+        return student
+
+    def parity_report(self, student: StudentClassifier, images: np.ndarray, teacher_logits: np.ndarray,
+                      labels: np.ndarray, rows: np.ndarray) -> dict:
+        """
+        Compare the student with the teacher on held-out boxes.
+
+        Args:
+            student: Trained student
+            images: Boxes at the input size
+            teacher_logits: Teacher logits for the same boxes
+            labels: Manual labels, -1 where unlabelled
+            rows: Held-out rows
+
+        Returns:
+            Report with agreement, Cohen's kappa, the confusion matrix (teacher rows,
+            student columns), per-class counts, accuracy against manual labels and throughput
+        """
+        num_labels = teacher_logits.shape[1]
+        start_time = time.time()
+        student_logits = self.student_logits(student.to(self.device), images[rows])
+        student_boxes_per_second = len(rows) / max(time.time() - start_time, 1e-9)
+
+        teacher_classes = teacher_logits[rows].argmax(axis=1)
+        student_classes = student_logits.argmax(axis=1)
+        confusion = np.zeros((num_labels, num_labels), dtype=np.int64)
+        np.add.at(confusion, (teacher_classes, student_classes), 1)
+
+        total = max(1, len(rows))
+        agreement = np.trace(confusion) / total
+        expected = (confusion.sum(axis=1) @ confusion.sum(axis=0)) / (total * total)
+        kappa = (agreement - expected) / (1 - expected) if expected < 1 else 1.0
+
+        report = {
+            'teacher': self.teacher_path,
+            'boxes': int(len(rows)),
+            'agreement': float(agreement),
+            'cohen_kappa': float(kappa),
+            'confusion_teacher_vs_student': confusion.tolist(),
+            'per_class_agreement': {
+                str(c): float(confusion[c, c] / confusion[c].sum()) if confusion[c].sum() else None
+                for c in range(num_labels)
+            },
+            'teacher_counts': {str(c): int(confusion[c].sum()) for c in range(num_labels)},
+            'student_counts': {str(c): int(confusion[:, c].sum()) for c in range(num_labels)},
+            'student_boxes_per_second': float(student_boxes_per_second)
+        }
+
+        labelled = labels[rows] >= 0
+        if labelled.any():
+            report['labelled_boxes'] = int(labelled.sum())
+            report['teacher_accuracy'] = float(np.mean(teacher_classes[labelled] == labels[rows][labelled]))
+            report['student_accuracy'] = float(np.mean(student_classes[labelled] == labels[rows][labelled]))
+
+        # Teacher timing is only known when this run had to score boxes with it
+        if self.teacher_boxes_per_second:
+            report['teacher_boxes_per_second'] = float(self.teacher_boxes_per_second)
+            report['speedup'] = float(student_boxes_per_second / self.teacher_boxes_per_second)
+        return report
+
+    def save_report(self, report: dict):
+        """Write parity_report.json next to the student and print the headline numbers."""
+        os.makedirs(self.output_path, exist_ok=True)
+        report_path = os.path.join(self.output_path, "parity_report.json")
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n=== PARITY REPORT ({report['boxes']} held-out boxes) ===")
+        print(f"Agreement with teacher: {report['agreement']:.4f} (kappa {report['cohen_kappa']:.4f})")
+        for c, value in report['per_class_agreement'].items():
+            print(f"  Class {c}: teacher {report['teacher_counts'][c]}, student {report['student_counts'][c]}, "
+                  f"agreement {value if value is None else round(value, 4)}")
+        if 'student_accuracy' in report:
+            print(f"Accuracy on {report['labelled_boxes']} labelled boxes: "
+                  f"teacher {report['teacher_accuracy']:.4f}, student {report['student_accuracy']:.4f}")
+        print(f"Student throughput: {report['student_boxes_per_second']:.1f} boxes/s")
+        if 'speedup' in report:
+            print(f"Teacher throughput: {report['teacher_boxes_per_second']:.1f} boxes/s ({report['speedup']:.1f}x faster)")
+        print(f"Saved parity report to {report_path}")
+
+    def run(self, dataset_folders: List[str], plate_folders: List[str], epochs: int = 30, learning_rate: float = 2e-3,
+            val_fraction: float = 0.15, seed: int = 0, report_only: bool = False):
+        """
+        Distil a student from box datasets and crop stores, then write its parity report.
+
+        Args:
+            dataset_folders: Imagefolder box datasets, e.g. the ViT training set
+            plate_folders: Plates whose crop stores are added as unlabelled boxes
+            epochs: Training epochs
+            learning_rate: Peak learning rate
+            val_fraction: Share held out when a dataset has no test split
+            seed: Random seed
+            report_only: Only report on the student already in output_path
+        """
+        paths, labels, held_out = [], [], []
+        for folder in dataset_folders:
+            folder_paths, folder_labels, folder_held_out = collect_boxes(folder)
+            paths += folder_paths
+            labels.append(folder_labels)
+            held_out.append(folder_held_out)
+        crop_stores = [p for plate in plate_folders for p in collect_crop_stores(plate)]
+        keys, teacher_logits = self.teacher_logits(paths, crop_stores)
+        if not keys:
+            print("No boxes found to distil from.")
+            return
+
+        store_count = len(keys) - len(paths)
+        labels = np.concatenate(labels + [np.full(store_count, -1, dtype=np.int64)])
+        held_out = np.concatenate(held_out + [np.zeros(store_count, dtype=bool)])
+        images = self.load_images(paths, crop_stores)
+        loaded = ~np.isnan(teacher_logits).any(axis=1)
+
+        # Without an explicit test split, hold out a random share of the boxes
+        if not held_out.any():
+            held_out = np.random.default_rng(seed).random(len(keys)) < val_fraction
+        train_rows = np.flatnonzero(loaded & ~held_out)
+        val_rows = np.flatnonzero(loaded & held_out)
+        print(f"{len(train_rows)} training boxes, {len(val_rows)} held-out boxes "
+              f"({int((labels >= 0).sum())} labelled, {store_count} from crop stores)")
+
+        if report_only:
+            student = StudentClassifier.from_pretrained(self.output_path)
+        else:
+            student = self.train(images, teacher_logits, labels, train_rows, val_rows, epochs, learning_rate, seed)
+            student.save_pretrained(self.output_path)
+        self.save_report(self.parity_report(student, images, teacher_logits, labels,
+                                            val_rows if len(val_rows) else train_rows))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil the ViT box classifier into a small CNN student")
+    parser.add_argument('datasets', nargs='*', help="Imagefolder box datasets (numbered class folders, optional test/ split)")
+    parser.add_argument('--plates', nargs='*', default=[], help="Plate folders whose crop stores add unlabelled boxes")
+    parser.add_argument('--teacher', default="./Modelv1.4/Run3New", help="Fine-tuned ViT teacher")
+    parser.add_argument('--output', default="./Modelv1.4/Student", help="Folder to save the student in")
+    parser.add_argument('--input-size', type=int, default=112, help="Student input side length")
+    parser.add_argument('--width', type=float, default=1.0, help="Channel width multiplier")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--lr', type=float, default=2e-3)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.7, help="Weight of the distillation loss against the labels")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help="DataLoader workers for the teacher")
+    parser.add_argument('--val-fraction', type=float, default=0.15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report-only', action='store_true', help="Only write the parity report of an existing student")
+    args = parser.parse_args()
+
+    if not args.datasets and not args.plates:
+        parser.error("give at least one dataset folder or --plates folder")
+
+    distiller = Distiller(args.teacher, args.output, args.input_size, args.width, args.temperature, args.alpha,
+                          args.batch_size, args.workers)
+    distiller.run(args.datasets, args.plates, args.epochs, args.lr, args.val_fraction, args.seed, args.report_only)
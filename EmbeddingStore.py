@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from PIL import Image
+from typing import List, Optional, Sequence, Tuple
+from ScoringEngine import ScoringEngine, CropArrayDataset, parse_cell_id
+from ScoringBackends import load_backend
+
+# Files whose contents identify a model; the weights are identified by size and mtime
+MODEL_FILES = ["config.json", "preprocessor_config.json"]
+WEIGHT_FILES = ["model.safetensors", "pytorch_model.bin"]
+
+def crop_hash(crop: np.ndarray) -> str:
+    """Content hash of one RGB crop."""
+    crop = np.ascontiguousarray(crop)
+    digest = hashlib.sha1(str((crop.shape, crop.dtype.str)).encode())
+    digest.update(crop.tobytes())
+    return digest.hexdigest()[:20]
+
+def model_id(model_path: str) -> str:
+    """
+    Identifier of a fine-tuned model, so embeddings from different checkpoints never mix.
+
+    Args:
+        model_path: ViT model folder
+
+    Returns:
+        Short hash of the model config, preprocessing config and weight files
+    """
+    digest = hashlib.sha1()
+    for name in MODEL_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    for name in WEIGHT_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+class EmbeddingStore:
+    """ViT CLS embeddings of box crops, computed once and kept as an fp16 memmap keyed by crop hash"""
+
+    def __init__(self, model_path: str, root: Optional[str] = None, engine: Optional[ScoringEngine] = None,
+                 batch_size: int = 32, num_workers: Optional[int] = None):
+
+        self.model_path = model_path
+        self.model_id = model_id(model_path)
+        # One folder per model under the root, next to the model by default
+        self.root = root or os.path.join(model_path, "embeddings")
+        self.folder = os.path.join(self.root, self.model_id)
+        self.embeddings_path = os.path.join(self.folder, "embeddings.f16")
+        self.keys_path = os.path.join(self.folder, "keys.npy")
+        self.meta_path = os.path.join(self.folder, "meta.json")
+        # The backbone is only loaded when a crop is missing from the store
+        self.engine = engine
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.load()
+
+    def load(self):
+        """Open the stored embeddings read-only."""
+        self.dim = 0
+        self.keys = {}
+        self.embeddings = np.zeros((0, 0), dtype=np.float16)
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, 'r') as f:
+            meta = json.load(f)
+        # Rows past the recorded count are from an interrupted write and are ignored
+        count, self.dim = meta["count"], meta["dim"]
+        keys = np.load(self.keys_path)[:count]
+        self.keys = {key: row for row, key in enumerate(keys.astype(str).tolist())}
+        if count:
+            self.embeddings = np.memmap(self.embeddings_path, dtype=np.float16, mode='r', shape=(count, self.dim))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_engine(self) -> ScoringEngine:
+        """Load the ViT backbone on first use."""
+        if self.engine is None:
+            model, processor = load_backend(self.model_path, "vit")
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            self.engine = ScoringEngine(model.to(device), processor, device,
+                                        batch_size=self.batch_size, num_workers=self.num_workers)
+        return self.engine
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        """Row of each crop hash, -1 where it has not been embedded."""
+        return np.array([self.keys.get(key, -1) for key in keys], dtype=np.int64)
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        """
+        Append embeddings for new crop hashes.
+
+        Args:
+            keys: Crop hashes not yet in the store
+            vectors: NxD embeddings
+        """
+        if not keys:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float16)
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding size {vectors.shape[1]} does not match the store ({self.dim})")
+
+        # Windows cannot resize a file that is still mapped
+        count = len(self.keys)
+        self.embeddings = np.zeros((0, self.dim), dtype=np.float16)
+        with open(self.embeddings_path, 'r+b' if count else 'wb') as f:
+            f.seek(count * vectors.shape[1] * 2)
+            f.write(vectors.tobytes())
+            f.truncate()
+
+        all_keys = np.array(list(self.keys) + list(keys), dtype='S20')
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, all_keys)
+        os.replace(tmp_path, self.keys_path)
+
+        # The count is written last, so a crash leaves the store at its previous size
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"model_path": os.path.abspath(self.model_path), "model_id": self.model_id,
+                       "dim": int(vectors.shape[1]), "count": len(all_keys)}, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+        self.load()
+
+    def embed(self, crops: Sequence[np.ndarray], resized: bool = False) -> np.ndarray:
+        """
+        Embeddings of RGB crops, running the backbone only on crops not in the store.
+
+        Args:
+            crops: NxHxWx3 batch or list of RGB crops
+            resized: Crops are already at the model input size
+
+        Returns:
+            NxD float16 embeddings, NaN rows for crops the backbone could not process
+        """
+        keys = [crop_hash(crop) for crop in crops]
+        rows = self.rows(keys)
+
+        missing = {}
+        for i in np.flatnonzero(rows < 0).tolist():
+            missing.setdefault(keys[i], i)
+        if missing:
+            print(f"Embedding {len(missing)} new crops ({len(keys) - int((rows < 0).sum())} cached)")
+            engine = self.get_engine()
+            new_crops = [crops[i] for i in missing.values()]
+            vectors = engine.embeddings(CropArrayDataset(engine.processor, crops=new_crops, resized=resized))
+            embedded = ~np.isnan(vectors).any(axis=1) if vectors.shape[1] else np.zeros(len(vectors), dtype=bool)
+            self.add([k for k, ok in zip(missing, embedded) if ok], vectors[embedded])
+            rows = self.rows(keys)
+
+        result = np.full((len(keys), self.dim), np.nan, dtype=np.float16)
+        found = rows >= 0
+        result[found] = self.embeddings[rows[found]]
+        return result
+
+    def embed_store(self, crop_store) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embeddings of every crop of a packed crop store.
+
+        Returns:
+            (cell_ids, NxD embeddings)
+        """
+        crops, index = crop_store.load()
+        cell_ids = np.array([entry['cell_id'] for entry in index], dtype=np.int64)
+        return cell_ids, self.embed(crops)
+
+    def embed_folder(self, boxes_folder: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Embeddings of the box images of a folder.
+
+        Returns:
+            (filenames, cell_ids, NxD embeddings), cell_id -1 where the name has no box number
+        """
+        filenames = [f for f in sorted(os.listdir(boxes_folder))
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        return filenames, np.array([parse_cell_id(f) for f in filenames], dtype=np.int64), \
+            self.embed_paths([os.path.join(boxes_folder, f) for f in filenames])
+
+    def embed_paths(self, image_paths: List[str]) -> np.ndarray:
+        """Embeddings of box images by path, NaN rows for images that fail to load."""
+        crops = []
+        loaded = []
+        for image_path in image_paths:
+            try:
+                with Image.open(image_path) as image:
+                    crops.append(np.asarray(image.convert('RGB')))
+                loaded.append(True)
+            except Exception as e:
+                print(f"Error processing {os.path.basename(image_path)}: {str(e)}")
+                loaded.append(False)
+        embeddings = self.embed(crops)
+        result = np.full((len(image_paths), embeddings.shape[1]), np.nan, dtype=np.float16)
+        result[np.asarray(loaded, dtype=bool)] = embeddings
+        return result
+
+    def vit_head_logits(self, embeddings: np.ndarray) -> np.ndarray:
+        """Logits of the fine-tuned ViT's own classifier, applied to stored CLS embeddings."""
+        classifier = self.get_engine().model.classifier
+        with torch.no_grad():
+            weights = classifier.weight.float().cpu().numpy()
+            bias = classifier.bias.float().cpu().numpy()
+        return embeddings.astype(np.float32) @ weights.T + bias
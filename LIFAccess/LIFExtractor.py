@@ -6,14 +6,23 @@ from tkinter import filedialog
 from PIL import Image
 from readlif.reader import LifFile
 import numpy as np
+import tifffile
 from matplotlib import pyplot
 import matplotlib.colors as mcolors
 import re
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PillarDetector import save_pixel_size
+
 class LIFProcessor:
     """Class to process LIF files and extract images as PNGs"""
     
-    def __init__(self):
+    def __init__(self, save_raw=False):
+        # Also keep each plane at native bit depth in <channel>/raw/ for raw-intensity MIPs (MIP.py --raw).
+        # The stretched PNGs are still written: StackValidator classifies them, its manifest names them,
+        # and MIP.py maps the planes it selects onto their raw copies, so the raw MIP never reads them
+        self.save_raw = save_raw
         self.channel_names = {0: "nuclei", 1: "mbp", 2: "pillar"}
         self.yellow_cmap = mcolors.LinearSegmentedColormap.from_list('yellow_cmap', ['black', 'yellow'])
         self.cyan_cmap = mcolors.LinearSegmentedColormap.from_list('cyan_cmap', ['black', 'cyan'])
@@ -66,11 +75,19 @@ class LIFProcessor:
                 series_dir = os.path.join(output_dir, series_name)
                 os.makedirs(series_dir, exist_ok=True)
 
+                # Physical pixel size (readlif scale is px/um) so detection can size its kernels
+                scale_x = lif_image.scale[0] if lif_image.scale else None
+                if scale_x:
+                    save_pixel_size(series_dir, 1.0 / scale_x, source=os.path.basename(lif_file_path))
+                    print(f"  Pixel size: {1.0 / scale_x:.4f} um")
+
                 # Create channel subfolders within the series folder
                 for channel in [0, 1, 2]:
                     if channel < lif_image.channels:
                         channel_dir = os.path.join(output_dir, series_name, self.channel_names[channel])
                         os.makedirs(channel_dir, exist_ok=True)
+                        if self.save_raw:
+                            os.makedirs(os.path.join(channel_dir, "raw"), exist_ok=True)
 
                 for channel in [0, 1, 2]:
                     if channel >= lif_image.channels:
@@ -119,6 +136,10 @@ class LIFProcessor:
 
                                 img.save(filepath, format='PNG')
                                 print(f"    Saved: {os.path.join(self.channel_names[channel], series_name, filename)}")
+
+                                if self.save_raw:
+                                    raw_filename = os.path.splitext(filename)[0] + '.tif'
+                                    tifffile.imwrite(os.path.join(channel_dir, "raw", raw_filename), np_image)
                                 
                             except Exception as e:
                                 print(f"    Error processing frame: {e}")
@@ -158,5 +179,5 @@ class LIFProcessor:
         input("Press Enter to exit...")
 
 if __name__ == "__main__":
-    processor = LIFProcessor()
+    processor = LIFProcessor(save_raw='--raw' in sys.argv)
     processor.main()
\ No newline at end of file
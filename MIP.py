@@ -1,12 +1,20 @@
 import os
+import json
+import argparse
 import tkinter as tk
 from tkinter import filedialog
 from pathlib import Path
 from PIL import Image
 import numpy as np
-from typing import List, Optional
-from skimage import filters, morphology
+import re
+from typing import List, Optional, Tuple
+from skimage import filters
 import cv2
+import tifffile
+from PillarDetector import REFERENCE_UM_PER_PIXEL, PIXEL_SIZE_NAME, load_mosaic_pixel_size, save_pixel_size
+
+# Per-plane validity written by StackValidator next to the mbp/pillar planes
+MANIFEST_NAME = 'validation_manifest.json'
 
 class MIPProcessor:
     """Maximum Intensity Projection processing"""
@@ -14,6 +22,7 @@ class MIPProcessor:
     def __init__(self):
 
         self.supported_formats = {'.png', '.jpg', '.jpeg'}
+        self.mask_engine = BatchMaskProcessor()
     
     def create_mip(self, image_paths: List[str], dim: bool = False, 
                    apply_otsu: bool = False, apply_yellow: bool = False) -> Optional[Image.Image]:
@@ -68,6 +77,102 @@ class MIPProcessor:
             print(f"Error creating MIP: {e}")
             return None
 
+    def load_raw_plane(self, image_path: str) -> np.ndarray:
+        """
+        Load a plane at its native bit depth.
+
+        Args:
+            image_path: Path to a .tif/.tiff or 16-bit PNG plane
+
+        Returns:
+            Greyscale array in the instrument's own intensity units
+        """
+        if Path(image_path).suffix.lower() in ('.tif', '.tiff'):
+            plane = tifffile.imread(image_path)
+        else:
+            plane = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+            if plane is None:
+                raise ValueError(f"Failed to load raw plane: {image_path}")
+        if plane.ndim == 3:
+            plane = plane.max(axis=-1)
+        return plane
+
+    def create_raw_mip(self, planes, colour: str = 'cyan', dim: bool = False,
+                       apply_otsu: bool = False, apply_yellow: bool = False) -> Optional[Image.Image]:
+        """
+        Project raw intensities first, then normalise and colour the MIP once.
+
+        Args:
+            planes: Raw plane paths or arrays, any iterable; paths are loaded one plane at a time
+            colour: 'cyan' or 'yellow', matching the channel colours of the LIF extractor
+            dim: Whether to dim the MIP to 25% brightness
+            apply_otsu: Whether to apply Otsu thresholding
+            apply_yellow: Whether to apply yellow mask to the MIP
+
+        Returns:
+            PIL Image object containing the MIP, or None if processing fails
+        """
+        try:
+            mip_array = None
+            for plane in planes:
+                if isinstance(plane, (str, Path)):
+                    plane = self.load_raw_plane(str(plane))
+                plane = np.asarray(plane)
+
+                # Max in the native integer dtype, no per-plane float work
+                if mip_array is None:
+                    mip_array = plane.copy()
+                else:
+                    np.maximum(mip_array, plane, out=mip_array)
+
+            if mip_array is None:
+                return None
+
+            # One min/max stretch over the whole projection
+            mip_min, mip_max = mip_array.min(), mip_array.max()
+            normalized = mip_array.astype(np.float32)
+            if mip_max > mip_min:
+                normalized -= mip_min
+                normalized /= float(mip_max - mip_min)
+            else:
+                normalized[:] = 0
+
+            if dim:
+                normalized *= 0.25
+
+            mip_image = Image.fromarray(self.colourise(normalized, colour))
+
+            if apply_otsu:
+                mip_image = self.apply_otsu(mip_image)
+
+            if apply_yellow:
+                mip_image = self.apply_yellow(mip_image)
+
+            return mip_image
+
+        except Exception as e:
+            print(f"Error creating raw MIP: {e}")
+            return None
+
+    def colourise(self, normalized: np.ndarray, colour: str) -> np.ndarray:
+        """
+        Map a 0-1 image onto the black-to-colour ramp used by the LIF extractor.
+
+        Args:
+            normalized: Float image in the range 0-1
+            colour: 'cyan' or 'yellow'
+
+        Returns:
+            HxWx3 uint8 RGB array
+        """
+        channels = {'cyan': (0, 1, 1), 'yellow': (1, 1, 0)}[colour]
+        grey = (normalized * 255).astype(np.uint8)
+        rgb = np.zeros(grey.shape + (3,), dtype=np.uint8)
+        for i, enabled in enumerate(channels):
+            if enabled:
+                rgb[:, :, i] = grey
+        return rgb
+
     def apply_otsu(self, image: Image.Image) -> Image.Image:
         """
         Apply Otsu thresholding to an image with denoising.
@@ -115,18 +220,7 @@ class MIPProcessor:
             Denoised binary image array
         """
         try:
-            # Remove small noise with opening
-            kernel = np.ones((3, 3), np.uint8)
-            denoised = cv2.morphologyEx(binary_array, cv2.MORPH_OPEN, kernel)
-            
-            # Fill small holes with closing
-            denoised = cv2.morphologyEx(denoised, cv2.MORPH_CLOSE, kernel)
-            
-            # Remove very small objects
-            denoised = morphology.remove_small_objects(denoised.astype(bool), min_size=50)
-            denoised = denoised.astype(np.uint8) * 255
-            
-            return denoised
+            return self.mask_engine.denoise_mask(binary_array)
             
         except Exception as e:
             print(f"Error applying morphological denoising: {e}")
@@ -179,14 +273,459 @@ class MIPProcessor:
             print(f"Error applying yellow mask: {e}")
             return image
 
+class BatchMaskProcessor:
+    """
+    Vectorised Otsu thresholding and morphological denoising for stacks of MIPs.
+
+    Histograms and Otsu thresholds for an NxHxW stack are computed in one pass,
+    then each mask goes through open/close and a connected-components pass for
+    small-object removal using buffers that are allocated once per image size.
+    """
+
+    def __init__(self, min_size: int = 50, denoise: bool = True):
+
+        self.min_size = min_size
+        # Keep the fastNlMeansDenoising step of MIPProcessor.apply_otsu
+        self.denoise = denoise
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.buffers = {}
+
+    def get_buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the two uint8 work buffers and the label buffer for an image size."""
+        if shape not in self.buffers:
+            self.buffers[shape] = (
+                np.empty(shape, dtype=np.uint8),
+                np.empty(shape, dtype=np.uint8),
+                np.empty(shape, dtype=np.int32)
+            )
+        return self.buffers[shape]
+
+    def histograms(self, grey_stack: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            grey_stack: NxHxW uint8 stack
+
+        Returns:
+            Nx256 array of intensity histograms
+        """
+        hists = np.empty((grey_stack.shape[0], 256), dtype=np.int64)
+        for i, grey in enumerate(grey_stack):
+            hists[i] = np.bincount(grey.ravel(), minlength=256)
+        return hists
+
+    def otsu_thresholds(self, hists: np.ndarray) -> np.ndarray:
+        """
+        Otsu thresholds for every histogram at once, matching filters.threshold_otsu.
+
+        Args:
+            hists: Nx256 intensity histograms
+
+        Returns:
+            Array of N integer thresholds
+        """
+        hists = hists.astype(np.float64)
+        centers = np.arange(hists.shape[1], dtype=np.float64)
+
+        weight1 = np.cumsum(hists, axis=1)
+        weight2 = np.cumsum(hists[:, ::-1], axis=1)[:, ::-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean1 = np.cumsum(hists * centers, axis=1) / weight1
+            mean2 = (np.cumsum((hists * centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+            variance12 = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+
+        # Split points outside the occupied intensity range carry no variance
+        variance12[~np.isfinite(variance12)] = 0
+        thresholds = np.argmax(variance12, axis=1)
+
+        # Single-intensity images threshold at that intensity, like threshold_otsu
+        uniform = np.count_nonzero(hists, axis=1) <= 1
+        thresholds[uniform] = np.argmax(hists[uniform], axis=1)
+        return thresholds
+
+    def denoise_mask(self, binary_array: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Open/close and drop objects smaller than min_size (4-connected), in place of
+        cv2.morphologyEx + morphology.remove_small_objects.
+
+        Args:
+            binary_array: HxW uint8 binary image (0/255)
+            out: Optional HxW uint8 array to write the result into
+
+        Returns:
+            Denoised binary image array
+        """
+        buf_a, buf_b, labels = self.get_buffers(binary_array.shape)
+        if out is None:
+            out = np.empty_like(binary_array)
+
+        cv2.morphologyEx(binary_array, cv2.MORPH_OPEN, self.kernel, dst=buf_a)
+        cv2.morphologyEx(buf_a, cv2.MORPH_CLOSE, self.kernel, dst=buf_b)
+
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(buf_b, labels=labels, connectivity=4)
+        lut = np.where(stats[:, cv2.CC_STAT_AREA] >= self.min_size, 255, 0).astype(np.uint8)
+        lut[0] = 0
+        np.take(lut, labels, out=out, mode='clip')
+        return out
+
+    def threshold_stack(self, grey_stack: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Otsu threshold and denoise a stack of same-sized greyscale MIPs.
+
+        Args:
+            grey_stack: NxHxW uint8 stack
+            out: Optional NxHxW uint8 array to write the masks into
+
+        Returns:
+            NxHxW uint8 masks (0/255)
+        """
+        if out is None:
+            out = np.empty_like(grey_stack)
+        thresholds = self.otsu_thresholds(self.histograms(grey_stack))
+
+        for i, grey in enumerate(grey_stack):
+            buf_a, buf_b, _ = self.get_buffers(grey.shape)
+            cv2.threshold(grey, int(thresholds[i]), 255, cv2.THRESH_BINARY, dst=buf_a)
+            if self.denoise:
+                cv2.fastNlMeansDenoising(buf_a, dst=buf_b)
+                buf_a[:] = buf_b
+            self.denoise_mask(buf_a, out=out[i])
+        return out
+
+class TiledMIPProcessor:
+    """
+    Out-of-core MIP and mask processing for large tile-scan mosaics.
+
+    Planes are streamed tile by tile into a disk-backed MIP, the Otsu threshold
+    is taken from a histogram merged over all tiles and the mask chain runs on
+    tiles padded with an overlap halo, so peak memory is bounded by the tile
+    size. Planes saved as .npy or uncompressed .tif are memory mapped; other
+    formats have to be decoded one whole plane at a time.
+
+    The rest of the pipeline reads *_mip.png, so each TIFF also gets a PNG
+    copy, downsampled until it fits in preview_max_side pixels.
+    """
+
+    def __init__(self, tile_size: int = 2048, halo: int = 64, preview_max_side: int = 8192):
+
+        self.tile_size = tile_size
+        # Longest side of the PNG copy, which is held in memory while it is encoded
+        self.preview_max_side = preview_max_side
+        # Must cover the NL-means search window (10 px), the 3x3 open/close
+        # and the 50 px small-object limit so tile borders come out seamless
+        self.halo = halo
+        self.mip_processor = MIPProcessor()
+        self.supported_formats = self.mip_processor.supported_formats | {'.tif', '.tiff', '.npy'}
+
+    def open_plane(self, image_path: str) -> np.ndarray:
+        """
+        Open a plane for tile access without decoding it if possible.
+
+        Args:
+            image_path: Path to the plane
+
+        Returns:
+            Array (memory mapped where the format allows it) of shape HxW or HxWx3
+        """
+        suffix = Path(image_path).suffix.lower()
+        if suffix == '.npy':
+            return np.load(image_path, mmap_mode='r')
+        if suffix in ('.tif', '.tiff'):
+            try:
+                return tifffile.memmap(image_path, mode='r')
+            except ValueError:
+                # Compressed or tiled TIFFs cannot be memory mapped
+                return tifffile.imread(image_path)
+        return np.asarray(Image.open(image_path).convert('RGB'))
+
+    def tiles(self, height: int, width: int):
+        """Yield (y0, y1, x0, x1) bounds covering an image of the given size."""
+        for y0 in range(0, height, self.tile_size):
+            for x0 in range(0, width, self.tile_size):
+                yield y0, min(y0 + self.tile_size, height), x0, min(x0 + self.tile_size, width)
+
+    def create_mip(self, image_paths: List[str], output_path: str, dim: bool = False,
+                   apply_otsu: bool = False, apply_yellow: bool = False) -> bool:
+        """
+        Args:
+            image_paths: List of paths to images in the stack
+            output_path: TIFF file the result is written to incrementally
+            dim: Whether to dim each image to 25% brightness
+            apply_otsu: Whether to apply Otsu thresholding
+            apply_yellow: Whether to apply yellow mask to the MIP
+
+        Returns:
+            True if the MIP was written, False if processing fails
+        """
+        if not image_paths:
+            return False
+
+        output_path = Path(output_path)
+        masked = apply_otsu or apply_yellow
+        mip_path = output_path.with_name(output_path.stem + '_raw.npy') if masked else output_path
+
+        try:
+            first_plane = self.open_plane(image_paths[0])
+            height, width = first_plane.shape[:2]
+            del first_plane
+
+            # Without a mask step the MIP itself is the output
+            if masked:
+                mip = np.lib.format.open_memmap(mip_path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+            else:
+                mip = tifffile.memmap(mip_path, shape=(height, width, 3), dtype=np.uint8, photometric='rgb')
+
+            for img_path in image_paths:
+                plane = self.open_plane(img_path)
+                for y0, y1, x0, x1 in self.tiles(height, width):
+                    tile = plane[y0:y1, x0:x1]
+                    if tile.ndim == 2:
+                        tile = tile[:, :, None]
+                    tile = tile[:, :, :3]
+
+                    # Truncating each plane before the max is the same as truncating the max
+                    if dim:
+                        tile = (tile.astype(np.float32) * 0.25).astype(np.uint8)
+
+                    np.maximum(mip[y0:y1, x0:x1], tile, out=mip[y0:y1, x0:x1])
+                del plane
+
+            mip.flush()
+            if masked:
+                self.write_masked(mip, output_path, apply_yellow)
+            del mip
+            return True
+
+        except Exception as e:
+            print(f"Error creating tiled MIP: {e}")
+            return False
+
+        finally:
+            if masked and mip_path.exists():
+                try:
+                    os.remove(mip_path)
+                except OSError:
+                    pass
+
+    def preview_factor(self, height: int, width: int) -> int:
+        """Integer downsampling factor that fits the PNG copy in preview_max_side."""
+        return max(1, -(-max(height, width) // self.preview_max_side))
+
+    def write_preview(self, tiff_path: Path, png_path: Path) -> int:
+        """
+        Write the PNG copy of a tiled MIP for the downstream stages.
+
+        Args:
+            tiff_path: Tiled MIP written by create_mip
+            png_path: PNG file to write
+
+        Returns:
+            Factor the PNG was downsampled by
+        """
+        mip = tifffile.memmap(tiff_path, mode='r')
+        height, width = mip.shape[:2]
+        factor = self.preview_factor(height, width)
+        preview = np.zeros((-(-height // factor), -(-width // factor), 3), dtype=np.uint8)
+        # Tiles are whole multiples of the factor so each output pixel averages one full block
+        step = max(factor, self.tile_size - self.tile_size % factor)
+        for y0 in range(0, height, step):
+            for x0 in range(0, width, step):
+                y1, x1 = min(y0 + step, height), min(x0 + step, width)
+                tile = np.asarray(mip[y0:y1, x0:x1])
+                if factor > 1:
+                    tile = self.block_mean(tile, factor)
+                preview[y0 // factor:y0 // factor + tile.shape[0], x0 // factor:x0 // factor + tile.shape[1]] = tile
+        del mip
+
+        if not cv2.imwrite(str(png_path), cv2.cvtColor(preview, cv2.COLOR_RGB2BGR)):
+            raise ValueError(f"Failed to write {png_path}")
+        return factor
+
+    def block_mean(self, tile: np.ndarray, factor: int) -> np.ndarray:
+        """Average factor x factor blocks of an HxWx3 tile; partial blocks at the edge average what they cover."""
+        height, width = tile.shape[:2]
+        out_height, out_width = -(-height // factor), -(-width // factor)
+        padded = np.zeros((out_height * factor, out_width * factor, 3), dtype=np.float32)
+        padded[:height, :width] = tile
+        sums = padded.reshape(out_height, factor, out_width, factor, 3).sum(axis=(1, 3))
+        counts = (np.minimum(factor, height - np.arange(out_height) * factor)[:, None] *
+                  np.minimum(factor, width - np.arange(out_width) * factor)[None, :])
+        return np.round(sums / counts[:, :, None]).astype(np.uint8)
+
+    def global_otsu(self, mip: np.ndarray) -> int:
+        """
+        Compute the Otsu threshold of the whole MIP from per-tile histograms.
+
+        Args:
+            mip: HxWx3 uint8 MIP (usually memory mapped)
+
+        Returns:
+            Threshold on the greyscale MIP
+        """
+        height, width = mip.shape[:2]
+        hist = np.zeros(256, dtype=np.int64)
+        for y0, y1, x0, x1 in self.tiles(height, width):
+            grey = cv2.cvtColor(np.ascontiguousarray(mip[y0:y1, x0:x1]), cv2.COLOR_RGB2GRAY)
+            hist += np.bincount(grey.ravel(), minlength=256)
+
+        return int(self.mip_processor.mask_engine.otsu_thresholds(hist[None])[0])
+
+    def write_masked(self, mip: np.ndarray, output_path: Path, apply_yellow: bool):
+        """
+        Threshold and denoise the MIP tile by tile and stream the result to disk.
+
+        Args:
+            mip: HxWx3 uint8 MIP
+            output_path: TIFF file to write
+            apply_yellow: Colour the mask yellow instead of white
+        """
+        height, width = mip.shape[:2]
+        threshold = self.global_otsu(mip)
+        colour = np.array([255, 255, 0] if apply_yellow else [255, 255, 255], dtype=np.uint8)
+
+        output = tifffile.memmap(output_path, shape=(height, width, 3), dtype=np.uint8, photometric='rgb')
+        for y0, y1, x0, x1 in self.tiles(height, width):
+            # Pad the tile with a halo so neighbourhood operations see across the border
+            hy0, hy1 = max(0, y0 - self.halo), min(height, y1 + self.halo)
+            hx0, hx1 = max(0, x0 - self.halo), min(width, x1 + self.halo)
+
+            grey = cv2.cvtColor(np.ascontiguousarray(mip[hy0:hy1, hx0:hx1]), cv2.COLOR_RGB2GRAY)
+            binary = (grey > threshold).astype(np.uint8) * 255
+            binary = cv2.fastNlMeansDenoising(binary)
+            binary = self.mip_processor.apply_morphological_denoising(binary)
+
+            core = binary[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0] > 0
+            out_tile = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+            out_tile[core] = colour
+            output[y0:y1, x0:x1] = out_tile
+
+        output.flush()
+        del output
+
+class MIPCache:
+    """Make-style up-to-date check for the MIP outputs of one series folder"""
+
+    CACHE_NAME = '.mip_cache.json'
+    # Bump when the MIP processing itself changes so old outputs get rebuilt
+    VERSION = 1
+
+    def __init__(self, series_folder: Path):
+
+        self.series_folder = series_folder
+        self.cache_path = series_folder / self.CACHE_NAME
+        self.entries = self.load()
+
+    def load(self) -> dict:
+        """
+        Load the stored dependency records, ignoring a missing or corrupt cache.
+
+        Returns:
+            Dictionary mapping output file names to their recorded signatures
+        """
+        if not self.cache_path.exists():
+            return {}
+        try:
+            with open(self.cache_path, 'r') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def signature(self, image_paths: List[str], options: dict) -> dict:
+        """
+        Build the dependency record for an output.
+
+        Args:
+            image_paths: Input planes the MIP is built from
+            options: Processing options passed to create_mip
+
+        Returns:
+            Dictionary of the input plane list with sizes/mtimes and the options
+        """
+        inputs = []
+        for img_path in image_paths:
+            stat = os.stat(img_path)
+            rel_path = os.path.relpath(img_path, self.series_folder)
+            inputs.append([rel_path, stat.st_size, stat.st_mtime_ns])
+
+        return {
+            'version': self.VERSION,
+            'options': options,
+            'inputs': inputs
+        }
+
+    def is_up_to_date(self, output_path: Path, signature: dict) -> bool:
+        """
+        Check whether an output exists and was built from exactly these inputs.
+
+        Args:
+            output_path: Path of the MIP output
+            signature: Dependency record from signature()
+
+        Returns:
+            True if the output can be reused as is
+        """
+        entry = self.entries.get(output_path.name)
+        if entry is None or not output_path.exists():
+            return False
+
+        # A deleted or hand-edited output has to be rebuilt as well
+        stat = output_path.stat()
+        if entry.get('output') != [stat.st_size, stat.st_mtime_ns]:
+            return False
+
+        return entry.get('signature') == signature
+
+    def update(self, output_path: Path, signature: dict):
+        """Record the signature of a freshly written output."""
+        stat = output_path.stat()
+        self.entries[output_path.name] = {
+            'signature': signature,
+            'output': [stat.st_size, stat.st_mtime_ns]
+        }
+
+    def save(self):
+        """Write the cache atomically so an interrupted run never corrupts it."""
+        tmp_path = self.cache_path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"  Warning: could not save MIP cache: {e}")
+
 class FolderProcessor:
     """Processes folder structure and manages MIP creation"""
     
-    def __init__(self, parent_folder: str):
+    def __init__(self, parent_folder: str, force: bool = False, tiled: bool = False, tile_size: int = 2048,
+                 raw: bool = False, z_range: Optional[Tuple[int, int]] = None,
+                 batch_masks: bool = False, batch_size: int = 32, preview_max_side: int = 8192):
 
         self.parent_folder = Path(parent_folder)
         self.mip_processor = MIPProcessor()
+        # Tiled mode streams large mosaics through disk and writes *_mip.tif, plus a downsampled *_mip.png
+        self.tiled = tiled
+        self.tiled_processor = TiledMIPProcessor(tile_size=tile_size, preview_max_side=preview_max_side) if tiled else None
+        # Raw mode projects the native-depth planes in <channel>/raw/ when present; tiled mode reads 8-bit planes only
+        self.raw = raw
+        if raw and tiled:
+            print("Warning: raw planes are not used in tiled mode, MIPs are built from the 8-bit planes")
+        self.channel_colours = {'nuclei': 'cyan', 'mbp': 'cyan', 'pillar': 'yellow'}
+        self.channel_indices = {'nuclei': 0, 'mbp': 1, 'pillar': 2}
+        # Inclusive (first, last) z band to project; None keeps every selected plane
+        self.z_range = z_range
+        # Batch mode defers Otsu/yellow masks and thresholds up to batch_size MIPs per call
+        self.batch_masks = batch_masks
+        self.batch_size = batch_size
+        self.pending_masks = []
+        self.failed_series = set()
         self.target_folders = ['nuclei', 'mbp', 'pillar']
+        # Rebuild every MIP even if the cache says it is up to date
+        self.force = force
+        self.mip_options = {
+            'nuclei': {'dim': True, 'apply_otsu': True, 'apply_yellow': False},
+            'pillar': {'dim': False, 'apply_otsu': True, 'apply_yellow': True},
+            'mbp': {'dim': False, 'apply_otsu': False, 'apply_yellow': False}
+        }
     
     def find_series_folders(self) -> List[Path]:
 
@@ -199,15 +738,78 @@ class FolderProcessor:
     
     def get_folder_images(self, folder_path: Path) -> List[str]:
 
+        supported_formats = self.tiled_processor.supported_formats if self.tiled else self.mip_processor.supported_formats
         image_paths = []
         for img_file in folder_path.iterdir():
-            if img_file.is_file() and img_file.suffix.lower() in self.mip_processor.supported_formats:
+            if img_file.is_file() and img_file.suffix.lower() in supported_formats:
                 image_paths.append(str(img_file))
         
         return sorted(image_paths)
     
+    def load_manifest(self, folder_path: Path) -> Optional[List[dict]]:
+
+        # Planes recorded by StackValidator, so validity is known without listing the folder
+        manifest_path = folder_path / MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)['planes']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  Warning: could not read {manifest_path}: {e}")
+            return None
+    
+    def in_z_range(self, z: Optional[int]) -> bool:
+
+        if self.z_range is None:
+            return True
+        return z is not None and self.z_range[0] <= z <= self.z_range[1]
+    
+    def get_manifest_images(self, folder_path: Path, planes: List[dict]) -> List[str]:
+
+        selected = [p for p in planes if self.in_z_range(p.get('z'))]
+        valid_planes = [p for p in selected if p['valid']]
+        if not valid_planes:
+            valid_planes = [p for p in selected if not p['valid']]
+            if valid_planes:
+                print(f"  No valid planes in manifest, using invalid planes for {folder_path.name}")
+        
+        # Paths come straight from the manifest; rejected planes are never touched
+        return [str(folder_path / p['file']) for p in valid_planes]
+    
+    def get_z_range_images(self, folder_path: Path) -> List[str]:
+
+        # Build the LIFExtractor plane names directly so only the selected z are looked up
+        series_name = folder_path.parent.name
+        channel = self.channel_indices.get(folder_path.name)
+        image_paths = []
+        if channel is not None:
+            colour = self.channel_colours[folder_path.name]
+            for z in range(self.z_range[0], self.z_range[1] + 1):
+                filename = f"{series_name}_c{channel}_{colour}_z{z}_t0.png"
+                for subfolder in ('', 'valid', 'invalid'):
+                    candidate = folder_path / subfolder / filename
+                    if candidate.exists():
+                        image_paths.append(str(candidate))
+                        break
+        if image_paths:
+            return image_paths
+        
+        # Other naming schemes: fall back to listing and parsing the z index
+        main_images = self.get_folder_images(folder_path)
+        return [p for p in main_images if self.in_z_range(self.parse_z_index(p))]
+    
+    def parse_z_index(self, image_path: str) -> Optional[int]:
+
+        match = re.search(r'_z(\d+)', Path(image_path).name)
+        return int(match.group(1)) if match else None
+    
     def has_valid_pillar_images(self, folder_path: Path) -> bool:
 
+        planes = self.load_manifest(folder_path)
+        if planes is not None:
+            return any(p['valid'] and self.in_z_range(p.get('z')) for p in planes)
+        
         valid_folder = folder_path / 'valid'
         if valid_folder.exists():
             valid_images = self.get_folder_images(valid_folder)
@@ -217,6 +819,14 @@ class FolderProcessor:
 
     def get_valid_folder_images(self, folder_path: Path) -> List[str]:
         
+        # A validation manifest takes priority over valid/invalid subfolders
+        planes = self.load_manifest(folder_path)
+        if planes is not None:
+            return self.get_manifest_images(folder_path, planes)
+        
+        if self.z_range is not None:
+            return self.get_z_range_images(folder_path)
+        
         valid_folder = folder_path / 'valid'
         invalid_folder = folder_path / 'invalid'
         
@@ -241,8 +851,32 @@ class FolderProcessor:
         
         return []
     
+    def get_raw_images(self, image_paths: List[str]) -> List[str]:
+        """
+        Map selected 8-bit planes onto their native-depth exports.
+
+        Args:
+            image_paths: Planes chosen for the MIP (possibly inside valid/ or invalid/)
+
+        Returns:
+            Matching raw plane paths, or an empty list if any of them is missing
+        """
+        raw_paths = []
+        for img_path in image_paths:
+            img_path = Path(img_path)
+            channel_folder = img_path.parent
+            if channel_folder.name in ('valid', 'invalid'):
+                channel_folder = channel_folder.parent
+            raw_path = channel_folder / 'raw' / f"{img_path.stem}.tif"
+            if not raw_path.exists():
+                return []
+            raw_paths.append(str(raw_path))
+        return raw_paths
+    
     def get_nuclei_images(self, nuclei_folder: Path) -> List[str]:
 
+        if self.z_range is not None:
+            return self.get_z_range_images(nuclei_folder)
         return self.get_folder_images(nuclei_folder)
     
     def process_series_folder(self, series_folder: Path) -> bool:
@@ -260,6 +894,7 @@ class FolderProcessor:
             return False
         
         success = True
+        cache = MIPCache(series_folder)
         
         for folder_name in self.target_folders:
             target_folder = series_folder / folder_name
@@ -279,38 +914,65 @@ class FolderProcessor:
                 success = False
                 continue
             
-            # Create MIP with appropriate processing
-            if folder_name == 'nuclei':
-                mip_image = self.mip_processor.create_mip(
-                    image_paths, 
-                    dim=True,
-                    apply_otsu=True,
-                    apply_yellow_mask=False
-                )
-            elif folder_name == 'pillar':
-                mip_image = self.mip_processor.create_mip(
-                    image_paths, 
-                    dim=False,
-                    apply_otsu=True,
-                    apply_yellow_mask=True
-                )
-            else:  # mbp
-                mip_image = self.mip_processor.create_mip(
-                    image_paths, 
-                    dim=False,
-                    apply_otsu=False,
-                    apply_yellow_mask=False
-                )
-            
-            if mip_image is None:
-                print(f"  Error: Failed to create MIP for {folder_name}")
-                success = False
+            # Use the native-depth planes when every selected plane has one
+            raw_paths = self.get_raw_images(image_paths) if self.raw and not self.tiled else []
+            if raw_paths:
+                image_paths = raw_paths
+            
+            output_suffix = '.tif' if self.tiled else '.png'
+            output_path = series_folder / f"{folder_name}_mip{output_suffix}"
+            options = self.mip_options[folder_name]
+            signature = cache.signature(image_paths, options)
+            
+            # Skip outputs whose inputs and options have not changed
+            if not self.force and cache.is_up_to_date(output_path, signature):
+                print(f"  Up to date: {output_path.name}")
+                if self.tiled and not self.update_preview(series_folder, folder_name, output_path, signature, cache):
+                    success = False
                 continue
             
+            # Tiled MIPs are written straight to disk as they are built
+            if self.tiled:
+                if not self.tiled_processor.create_mip(image_paths, output_path, **options):
+                    print(f"  Error: Failed to create MIP for {folder_name}")
+                    success = False
+                    continue
+            else:
+                # Masks are applied later for the whole batch in batch mode
+                deferred = self.batch_masks and (options['apply_otsu'] or options['apply_yellow'])
+                mip_options = dict(options, apply_otsu=False, apply_yellow=False) if deferred else options
+                
+                # Create MIP with appropriate processing
+                if raw_paths:
+                    mip_image = self.mip_processor.create_raw_mip(
+                        image_paths, colour=self.channel_colours[folder_name], **mip_options
+                    )
+                else:
+                    mip_image = self.mip_processor.create_mip(image_paths, **mip_options)
+                
+                if mip_image is None:
+                    print(f"  Error: Failed to create MIP for {folder_name}")
+                    success = False
+                    continue
+                
+                if deferred:
+                    self.pending_masks.append({
+                        'series_folder': series_folder,
+                        'rgb': np.array(mip_image.convert('RGB')),
+                        'options': options,
+                        'output_path': output_path,
+                        'signature': signature,
+                        'cache': cache
+                    })
+                    if len(self.pending_masks) >= self.batch_size:
+                        self.flush_pending_masks()
+                    continue
+            
             # Save MIP in series folder
-            output_path = series_folder / f"{folder_name}_mip.png"
             try:
-                mip_image.save(output_path, 'PNG')
+                if not self.tiled:
+                    mip_image.save(output_path, 'PNG')
+                cache.update(output_path, signature)
                 
                 # Create status message
                 status_parts = []
@@ -323,13 +985,106 @@ class FolderProcessor:
                 
                 status_str = " + ".join(status_parts)
                 print(f"  Created MIP: {output_path.name} ({status_str})")
+                if self.tiled and not self.update_preview(series_folder, folder_name, output_path, signature, cache):
+                    success = False
                 
             except Exception as e:
                 print(f"  Error saving MIP for {folder_name}: {e}")
                 success = False
         
+        cache.save()
         return success
     
+    def update_preview(self, series_folder: Path, folder_name: str, tiff_path: Path, signature: dict,
+                       cache: MIPCache) -> bool:
+        """
+        Keep the downsampled PNG of a tiled MIP and the pixel-size sidecar in step with the TIFF.
+
+        Args:
+            series_folder: Series folder
+            folder_name: Channel the MIP belongs to
+            tiff_path: Tiled MIP
+            signature: Dependency record of the TIFF
+            cache: Build cache of the series
+
+        Returns:
+            True if the PNG is up to date
+        """
+        png_path = series_folder / f"{folder_name}_mip.png"
+        png_signature = dict(signature, preview_max_side=self.tiled_processor.preview_max_side)
+        try:
+            if self.force or not cache.is_up_to_date(png_path, png_signature):
+                factor = self.tiled_processor.write_preview(tiff_path, png_path)
+                cache.update(png_path, png_signature)
+                print(f"  Created PNG copy: {png_path.name} ({factor}x downsampled)")
+            else:
+                height, width = tifffile.memmap(tiff_path, mode='r').shape[:2]
+                factor = self.tiled_processor.preview_factor(height, width)
+            self.update_pixel_size(series_folder, factor)
+            return True
+        except Exception as e:
+            print(f"  Error writing PNG copy of {tiff_path.name}: {e}")
+            return False
+
+    def update_pixel_size(self, series_folder: Path, factor: int):
+        """
+        Record the pixel size of the downsampled PNGs, so detection and box sizes follow them.
+
+        Args:
+            series_folder: Series folder
+            factor: Downsampling factor of the PNG copies
+        """
+        um_per_pixel = load_mosaic_pixel_size(str(series_folder))
+        if um_per_pixel is None and factor == 1:
+            return
+        source = ''
+        sidecar_path = series_folder / PIXEL_SIZE_NAME
+        if sidecar_path.exists():
+            try:
+                with open(sidecar_path, 'r') as f:
+                    source = json.load(f).get('source', '')
+            except (OSError, ValueError, AttributeError):
+                pass
+        save_pixel_size(str(series_folder), um_per_pixel or REFERENCE_UM_PER_PIXEL, source=source, downsample=factor)
+
+    def flush_pending_masks(self):
+        
+        # Threshold every queued MIP of the same size in one batched call
+        pending, self.pending_masks = self.pending_masks, []
+        groups = {}
+        for entry in pending:
+            groups.setdefault(entry['rgb'].shape, []).append(entry)
+        
+        for entries in groups.values():
+            print(f"  Thresholding batch of {len(entries)} MIPs")
+            grey_stack = np.stack([cv2.cvtColor(e['rgb'], cv2.COLOR_RGB2GRAY) for e in entries])
+            try:
+                masks = self.mip_processor.mask_engine.threshold_stack(grey_stack, out=grey_stack)
+            except Exception as e:
+                print(f"  Error thresholding batch: {e}")
+                self.failed_series.update(entry['series_folder'].name for entry in entries)
+                continue
+            
+            for entry, mask in zip(entries, masks):
+                options = entry['options']
+                white = mask > 0
+                if options['apply_otsu']:
+                    result = np.zeros_like(entry['rgb'])
+                    result[white] = 255
+                else:
+                    result = entry['rgb']
+                if options['apply_yellow']:
+                    result[white] = (255, 255, 0)
+                
+                try:
+                    Image.fromarray(result).save(entry['output_path'], 'PNG')
+                    entry['cache'].update(entry['output_path'], entry['signature'])
+                    entry['cache'].save()
+                    print(f"  Created MIP: {entry['series_folder'].name}/{entry['output_path'].name} (batched mask)")
+                except Exception as e:
+                    print(f"  Error saving MIP {entry['output_path']}: {e}")
+                    self.failed_series.add(entry['series_folder'].name)
+    
     def process_all_series(self) -> dict:
         """
         Process all folders in the parent folder.
@@ -356,8 +1111,15 @@ class FolderProcessor:
             'details': []
         }
         
+        series_success = {}
         for series_folder in series_folders:
-            if self.process_series_folder(series_folder):
+            series_success[series_folder.name] = self.process_series_folder(series_folder)
+        
+        if self.pending_masks:
+            self.flush_pending_masks()
+        
+        for series_folder in series_folders:
+            if series_success[series_folder.name] and series_folder.name not in self.failed_series:
                 results['successful_folders'] += 1
                 results['details'].append(f"✓ {series_folder.name} - Success")
             else:
@@ -369,12 +1131,34 @@ class FolderProcessor:
 
 def main():
     """Main function to run the MIP processing."""
-    # Use filedialog to select folder
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
+    parser = argparse.ArgumentParser(description='Create MIPs for every series folder')
+    parser.add_argument('folder', nargs='?', help='Parent folder containing the series folders')
+    parser.add_argument('--force', action='store_true', help='Rebuild all MIPs even if they are up to date')
+    parser.add_argument('--tiled', action='store_true',
+                        help='Process large mosaics tile by tile and write *_mip.tif plus a downsampled *_mip.png '
+                             'for the later stages. Only .npy and uncompressed .tif planes are read out of core; '
+                             'PNG planes are decoded whole, one at a time')
+    parser.add_argument('--tile-size', type=int, default=2048, help='Tile size in pixels for --tiled (default: 2048)')
+    parser.add_argument('--preview-max-side', type=int, default=8192,
+                        help='Longest side of the *_mip.png written by --tiled (default: 8192)')
+    parser.add_argument('--raw', action='store_true', help='Project native-depth planes from <channel>/raw/ when available (not with --tiled)')
+    parser.add_argument('--batch-masks', action='store_true',
+                        help='Threshold and denoise MIPs in batches across series instead of one at a time')
+    parser.add_argument('--batch-size', type=int, default=32, help='MIPs per batch for --batch-masks (default: 32)')
+    parser.add_argument('--z-range', type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        help='Only project planes with FIRST <= z <= LAST')
+    args = parser.parse_args()
+    if args.raw and args.tiled:
+        parser.error("--raw cannot be combined with --tiled, which projects the 8-bit planes tile by tile")
     
-    print("Select the parent folder containing your data folders")
-    parent_folder = filedialog.askdirectory(title="Select Parent Folder")
+    parent_folder = args.folder
+    if not parent_folder:
+        # Use filedialog to select folder
+        root = tk.Tk()
+        root.withdraw()  # Hide the main window
+        
+        print("Select the parent folder containing your data folders")
+        parent_folder = filedialog.askdirectory(title="Select Parent Folder")
     
     if not parent_folder:
         print("No folder selected. Exiting.")
@@ -384,11 +1168,22 @@ def main():
     print("- Nuclei: 25% dimmed + Otsu thresholding + Denoising + Morphological")
     print("- MBP: Full brightness (no additional processing)")
     print("- Pillar: Full brightness + Otsu thresholding + Denoising + Morphological + Yellow mask")
-    print("- Folder priority: valid → invalid → main folder")
+    print(f"- Folder priority: {MANIFEST_NAME} → valid → invalid → main folder")
+    if args.z_range:
+        print(f"- Z range: {args.z_range[0]} to {args.z_range[1]}")
     print("- Series folders skipped if no valid pillar images found")
+    print("- Unchanged MIPs are skipped" + (" (disabled by --force)" if args.force else ""))
+    if args.raw:
+        print("- Raw mode: MIP of native-depth planes, normalised once after projection")
+    if args.tiled:
+        print(f"- Tiled mode: {args.tile_size}px tiles, MIPs written as TIFF with a PNG copy "
+              f"of at most {args.preview_max_side}px")
     
     # Process folders
-    processor = FolderProcessor(parent_folder)
+    processor = FolderProcessor(parent_folder, force=args.force, tiled=args.tiled, tile_size=args.tile_size,
+                                raw=args.raw, z_range=tuple(args.z_range) if args.z_range else None,
+                                batch_masks=args.batch_masks, batch_size=args.batch_size,
+                                preview_max_side=args.preview_max_side)
     results = processor.process_all_series()
     
     # Print results
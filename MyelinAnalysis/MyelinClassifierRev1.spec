@@ -1,9 +1,12 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
+
+# Shared pipeline modules live at the repository root, one level up
 
 
 a = Analysis(
     ['MyelinClassifierRev1.py'],
-    pathex=[],
+    pathex=[os.path.join(SPECPATH, '..')],
     binaries=[],
     datas=[],
     hiddenimports=[],
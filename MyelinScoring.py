@@ -0,0 +1,768 @@
+import os
+import csv
+import time
+import argparse
+import json
+import cv2
+import numpy as np
+from CropStore import CropStore
+from PillarDetector import PillarDetector, DetectionCache, REFERENCE_UM_PER_PIXEL, load_pixel_size
+from PillarTable import PillarTable
+from ScoringEngine import ScoringEngine, EnsembleEngine
+from ScoringBackends import BACKENDS, load_backend, load_ensemble, backend_device
+from EmbeddingStore import EmbeddingStore
+from ProbeHead import ProbeHead, ProbeEngine
+from RunJournal import RunJournal
+from ResultsWarehouse import ResultsWarehouse
+from BoxScores import BoxScores
+from RingThickness import measure_ring
+from CascadeModel import CascadeStage, CascadeEngine, summarise_reports
+
+def scorer_options(argv, model_path, student_path):
+    """
+    MyelinScorer keyword arguments from the command-line flags shared by the front ends.
+
+    Args:
+        argv: Command-line arguments, e.g. sys.argv
+        model_path: Fine-tuned ViT folder
+        student_path: Distilled student folder, used with --student or --backend student
+
+    Returns:
+        Keyword arguments for MyelinScorer
+    """
+    parser = argparse.ArgumentParser(description="Score the series of a plate folder chosen in a dialog")
+    parser.add_argument('--backend', choices=BACKENDS, default="vit",
+                        help="vit, student, quantised (int8 on the CPU) or onnx (exported model.onnx)")
+    parser.add_argument('--student', action='store_true',
+                        help="Score with the distilled student folder; implied by --backend student")
+    parser.add_argument('--model', default=None, help="Model folder, overriding the default ViT and student")
+    parser.add_argument('--fused', action='store_true', help="Box and score each series from its MIPs in one pass")
+    parser.add_argument('--save-crops', action='store_true', help="Keep the crop store of fused runs")
+    parser.add_argument('--batch-size', type=int, default=32, help="Crops per batch")
+    parser.add_argument('--workers', type=int, default=None, help="DataLoader workers, 0 to load in the main process")
+    parser.add_argument('--head', default=None, help="Probe head trained with ProbeHead.py")
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument('--resume', dest='resume', action='store_const', const=True, default=None,
+                        help="Skip series finished by an earlier run without asking")
+    resume.add_argument('--restart', dest='resume', action='store_const', const=False,
+                        help="Rescore every series without asking")
+    parser.add_argument('--warehouse', default=None, help="Parquet warehouse folder, default <plate>/results_warehouse")
+    parser.add_argument('--ensemble', default=None, help="Comma-separated model folders to score with together")
+    parser.add_argument('--aggregate', choices=["mean", "vote"], default="mean", help="How ensemble models combine")
+    parser.add_argument('--no-thickness', action='store_true', help="Skip ring thickness of class 3 boxes")
+    parser.add_argument('--cascade', default=None, help="Cascade stage trained with CascadeModel.py")
+    parser.add_argument('--audit', type=float, default=0.05, help="Share of the cascade's settled boxes rechecked")
+    args = parser.parse_args(argv[1:])
+
+    if args.model is None:
+        args.model = student_path if args.student or args.backend == "student" else model_path
+    return {
+        'model_path': args.model,
+        'fused': args.fused,
+        'save_crops': args.save_crops,
+        'batch_size': args.batch_size,
+        'num_workers': args.workers,
+        'backend': args.backend,
+        'head_path': args.head,
+        'resume': args.resume,
+        'warehouse_root': args.warehouse,
+        'ensemble_paths': args.ensemble.split(',') if args.ensemble else None,
+        'aggregate': args.aggregate,
+        'thickness': not args.no_thickness,
+        'cascade_path': args.cascade,
+        'audit_fraction': args.audit
+    }
+
+class MyelinScorer:
+    """Headless scoring of series and plates; run_analysis wraps it in the dialogs of the Summary and ClassCount front ends"""
+
+    def __init__(self, model_path, fused=False, save_crops=False, batch_size=32, num_workers=None, backend="vit",
+                 head_path=None, resume=None, warehouse_root=None, ensemble_paths=None, aggregate="mean",
+                 nuclei=True, journal_name="analysis_journal.jsonl", summary_name="analysis_summary.csv",
+                 thickness=True, cascade_path=None, audit_fraction=0.05):
+        # An ensemble scores with every model in ensemble_paths, and model_path is its first model
+        self.model_path = ensemble_paths[0] if ensemble_paths else model_path
+        self.ensemble_paths = ensemble_paths
+        self.aggregate = aggregate
+        # Parquet warehouse for per-box results, <plate>/results_warehouse by default
+        self.warehouse_root = warehouse_root
+        self.head_path = head_path
+        # Resume from the run journal: True always, False never, None asks when there is one
+        self.resume = resume
+        # Nuclei counts go with each series; ClassCount runs without them
+        self.nuclei = nuclei
+        self.journal_name = journal_name
+        # Plate summary CSV written by score_plate, None for none
+        self.summary_name = summary_name
+        # Ring thickness and area of class 3 boxes, measured on their crops while scoring
+        self.thickness = thickness
+        # A cascade settles confident boxes with a colour-feature stage and escalates the rest
+        self.cascade_path = cascade_path
+        self.audit_fraction = audit_fraction
+        # Fused mode boxes and scores each series from its MIPs in one pass, without boxes/
+        self.fused = fused
+        self.save_crops = save_crops
+        # "vit" for the fine-tuned ViT, "student" for a CNN distilled from it with DistillStudent.py,
+        # "quantised" for either with int8 Linear layers, "onnx" for either exported with ScoringBackends.py
+        self.backend = backend
+        self.device = backend_device(backend)
+        if ensemble_paths:
+            if head_path:
+                raise ValueError("Probe heads cannot be combined with an ensemble")
+            # Each batch is decoded and preprocessed once and scored by every model
+            self.engine = load_ensemble(ensemble_paths, self.device, backend, batch_size=batch_size,
+                                        num_workers=num_workers, aggregate=aggregate)
+            self.model, self.processor = self.engine.model[0], self.engine.processor
+        else:
+            self.model, self.processor = load_backend(model_path, backend)
+            self.model = self.model.to(self.device)
+            # Batched scoring with decoding and preprocessing in loader workers
+            self.engine = ScoringEngine(self.model, self.processor, self.device,
+                                        batch_size=batch_size, num_workers=num_workers)
+        # A probe head scores from cached CLS embeddings, running the backbone only on new crops
+        if head_path:
+            if backend != "vit":
+                raise ValueError("Probe heads need the ViT backend")
+            self.engine = ProbeEngine(EmbeddingStore(model_path, engine=self.engine), ProbeHead.load(head_path))
+        if cascade_path:
+            if ensemble_paths:
+                raise ValueError("A cascade cannot escalate to an ensemble")
+            self.engine = CascadeEngine(CascadeStage.load(cascade_path), self.engine, audit_fraction)
+
+    def load_pillar_coordinates(self, subfolder_path, subfolder_name):
+        """Load the pillar table, or pillar_coords.json for older series"""
+        pillar_table = PillarTable.load(subfolder_path, subfolder_name)
+        if pillar_table is not None:
+            print(f"Loaded {len(pillar_table)} pillar coordinates for {subfolder_name}")
+            return pillar_table
+        else:
+            print(f"Warning: no pillar coordinates found in {subfolder_path}.")
+            return PillarTable.from_records([])
+
+    def wrapped_pillars_from_predictions(self, pillar_table, cell_ids, predictions):
+        """Join class 3 predictions to the pillar table"""
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        predictions = np.asarray(predictions, dtype=np.int64)
+        rows = pillar_table.rows(cell_ids[predictions == 3])
+        return pillar_table.records(rows[rows >= 0], predicted_class=3)
+
+    def add_ring_thickness(self, pillar_table, wrapped_pillars, get_crop, series_folder):
+        """Measure ring thickness and area on the crops of class 3 pillars and add them to their records"""
+        if not self.thickness:
+            return
+        start_time = time.time()
+        # Crops are cut at the series pixel size, like the boxes themselves
+        pixel_size = load_pixel_size(series_folder) or REFERENCE_UM_PER_PIXEL
+        measured = []
+        for record in wrapped_pillars:
+            try:
+                record.update(measure_ring(get_crop(record['cell_id']), pixel_size=pixel_size))
+                measured.append(record)
+            except Exception as e:
+                print(f"  Could not measure ring thickness of box {record['cell_id']}: {str(e)}")
+        # Also kept as pillar columns, NaN for other classes, so the warehouse has them
+        for name in ('thickness_mean_um', 'thickness_std_um', 'ring_area_um2'):
+            pillar_table.join(name, [r['cell_id'] for r in measured],
+                              np.array([r[name] for r in measured], dtype=np.float64), fill=np.nan)
+        if wrapped_pillars:
+            print(f"  Measured ring thickness of {len(measured)} class 3 boxes in {time.time() - start_time:.2f} seconds")
+
+    def load_nuclei_props(self, nuclei_props_path):
+        """Load nuclei properties from JSON file and count nuclei"""
+        if os.path.exists(nuclei_props_path):
+            with open(nuclei_props_path, 'r') as f:
+                nuclei_props = json.load(f)
+            nuclei_count = len(nuclei_props)
+            print(f"Loaded {nuclei_count} nuclei from {nuclei_props_path}")
+            return nuclei_count, nuclei_props
+        else:
+            print(f"Warning: {nuclei_props_path} not found.")
+            return 0, []
+
+    def find_subfolders_with_boxes(self, parent_directory):
+        """Find all subfolders that contain a crop store or 'boxes' folder and pillar_coords.json"""
+        valid_subfolders = []
+        for item in os.listdir(parent_directory):
+            subfolder_path = os.path.join(parent_directory, item)
+            if os.path.isdir(subfolder_path):
+                boxes_path = os.path.join(subfolder_path, 'boxes')
+                pillar_coords_path = os.path.join(subfolder_path, f'{item}_pillar_coords.json')
+                nuclei_props_path = os.path.join(subfolder_path, 'nuclei_mip_nuclei_props.json')
+                
+                crop_store = CropStore(subfolder_path, item)
+                
+                # The warehouse keeps a 'boxes' table, which is not a boxes folder
+                if ResultsWarehouse.is_warehouse(subfolder_path):
+                    continue
+                if crop_store.exists() or (os.path.exists(boxes_path) and os.path.isdir(boxes_path)):
+                    valid_subfolders.append({
+                        'subfolder_path': subfolder_path,
+                        'subfolder_name': item,
+                        'boxes_path': boxes_path,
+                        'crop_store': crop_store,
+                        'pillar_coords_path': pillar_coords_path,
+                        'nuclei_props_path': nuclei_props_path
+                    })
+        return valid_subfolders
+
+    def model_input_size(self):
+        """Side length the processor resizes crops to"""
+        size = self.processor.size
+        if isinstance(size, dict):
+            return size.get("height", size.get("shortest_edge", 224))
+        return int(size)
+
+    def count_classes(self, predictions):
+        """Class counts of a set of predictions, skipping boxes that failed (-1)"""
+        predictions = np.asarray(predictions, dtype=np.int64)
+        return {class_id: int(np.count_nonzero(predictions == class_id)) for class_id in range(4)}
+
+    def process_boxes_folder(self, boxes_folder, pillar_table):
+        """Process a single boxes folder and return class counts and class 3 pillars"""
+        print(f"\nProcessing folder: {boxes_folder}")
+        folder_start_time = time.time()
+        
+        filenames, cell_ids, probabilities = self.engine.score_folder(boxes_folder)
+        for img_file in np.asarray(filenames)[cell_ids < 0].tolist():
+            print(f"  Could not parse box number from {img_file}")
+        
+        predictions = ScoringEngine.predict(probabilities)
+        scored = predictions >= 0
+        class_counts = self.count_classes(predictions)
+        image_count = int(scored.sum())
+        model_probabilities = self.model_probabilities(scored)
+        cell_ids, predictions, probabilities = cell_ids[scored], predictions[scored], probabilities[scored]
+        
+        wrapped_pillars = self.wrapped_pillars_from_predictions(pillar_table, cell_ids, predictions)
+        # Only the class 3 boxes are read again
+        box_files = dict(zip(cell_ids.tolist(), np.asarray(filenames)[scored].tolist()))
+        self.add_ring_thickness(pillar_table, wrapped_pillars, lambda cell_id: cv2.cvtColor(
+            cv2.imread(os.path.join(boxes_folder, box_files[cell_id]), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB),
+            os.path.dirname(os.path.normpath(boxes_folder)))
+        
+        folder_end_time = time.time()
+        folder_elapsed_time = folder_end_time - folder_start_time
+        
+        return {
+            'class_counts': class_counts,
+            'wrapped_pillars': wrapped_pillars,
+            'image_count': image_count,
+            'processing_time': folder_elapsed_time,
+            'pillar_table': pillar_table,
+            'cell_ids': cell_ids,
+            'probabilities': probabilities,
+            'model_probabilities': model_probabilities
+        }
+    
+    def find_subfolders_with_mips(self, parent_directory):
+        """Find all subfolders that contain pillar and mbp MIPs for fused boxing and scoring"""
+        valid_subfolders = []
+        for item in os.listdir(parent_directory):
+            subfolder_path = os.path.join(parent_directory, item)
+            pillar_image_path = os.path.join(subfolder_path, 'pillar_mip.png')
+            myelin_image_path = os.path.join(subfolder_path, 'mbp_mip.png')
+            if os.path.exists(pillar_image_path) and os.path.exists(myelin_image_path):
+                valid_subfolders.append({
+                    'subfolder_path': subfolder_path,
+                    'subfolder_name': item,
+                    'pillar_image_path': pillar_image_path,
+                    'myelin_image_path': myelin_image_path,
+                    'pillar_coords_path': os.path.join(subfolder_path, f'{item}_pillar_coords.json'),
+                    'nuclei_props_path': os.path.join(subfolder_path, 'nuclei_mip_nuclei_props.json')
+                })
+        return valid_subfolders
+
+    def box_and_score(self, subfolder_info):
+        """Detect, crop and score every pillar of a series in memory"""
+        print(f"\nBoxing and scoring: {subfolder_info['subfolder_path']}")
+        folder_start_time = time.time()
+        
+        pillar_image = cv2.imread(subfolder_info['pillar_image_path'], cv2.IMREAD_COLOR)
+        myelin_image = cv2.imread(subfolder_info['myelin_image_path'], cv2.IMREAD_COLOR)
+        if pillar_image is None or myelin_image is None:
+            raise ValueError(f"Failed to load MIPs in {subfolder_info['subfolder_path']}")
+        
+        # Same detection and top-to-bottom, left-to-right order as AutoBoxer
+        detector = PillarDetector.for_series(subfolder_info['subfolder_path'])
+        centres = DetectionCache(detector).detect(subfolder_info['pillar_image_path'], pillar_image)
+        centres = sorted(centres, key=lambda pos: (pos[1], pos[0]))
+        store = CropStore(subfolder_info['subfolder_path'], subfolder_info['subfolder_name'], box_size=detector.box_size)
+        bounds = store.bounds(centres, myelin_image.shape)
+        # Stored crops and model-resolution crops come from one traversal of the image
+        input_size = self.model_input_size()
+        batches = store.engine.extract_sizes(myelin_image, centres, [(store.box_size, store.box_size),
+                                                                     (store.box_size, input_size)])
+        crops = batches[(store.box_size, store.box_size)]
+        
+        pillar_table = PillarTable.from_centres(centres)
+        pillar_table.save(subfolder_info['subfolder_path'], subfolder_info['subfolder_name'])
+        
+        if self.save_crops:
+            store.save(crops, [{
+                'cell_id': i,
+                'center_coordinates': {'x': int(xc), 'y': int(yc)},
+                'bounds': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+            } for i, ((xc, yc), (x1, y1, x2, y2)) in enumerate(zip(centres, bounds))])
+        
+        model_crops = batches[(store.box_size, input_size)]
+        if not len(crops):
+            probabilities = np.zeros((0, 0), dtype=np.float32)
+        elif isinstance(self.engine, CascadeEngine):
+            # The stage's features are computed at the native box size it was trained on
+            probabilities = self.engine.score_arrays(crops, model_crops=model_crops)
+        else:
+            probabilities = self.engine.score_arrays(model_crops, resized=True)
+        model_probabilities = self.model_probabilities() if len(crops) else None
+        predictions = ScoringEngine.predict(probabilities)
+        class_counts = self.count_classes(predictions)
+        wrapped_pillars = self.wrapped_pillars_from_predictions(pillar_table, pillar_table.cell_id, predictions)
+        # Thickness from the crops already in memory
+        self.add_ring_thickness(pillar_table, wrapped_pillars, lambda cell_id: crops[pillar_table.rows([cell_id])[0]],
+                                subfolder_info['subfolder_path'])
+        
+        folder_end_time = time.time()
+        folder_elapsed_time = folder_end_time - folder_start_time
+        
+        return {
+            'class_counts': class_counts,
+            'wrapped_pillars': wrapped_pillars,
+            'image_count': sum(class_counts.values()),
+            'processing_time': folder_elapsed_time,
+            'pillar_table': pillar_table,
+            'cell_ids': pillar_table.cell_id,
+            'probabilities': probabilities,
+            'model_probabilities': model_probabilities
+        }
+
+    def process_crop_store(self, crop_store, pillar_table):
+        """Process a packed crop store and return class counts and class 3 pillars"""
+        print(f"\nProcessing crop store: {crop_store.crops_path}")
+        folder_start_time = time.time()
+        
+        cell_ids, probabilities = self.engine.score_store(crop_store)
+        all_cell_ids = cell_ids
+        
+        predictions = ScoringEngine.predict(probabilities)
+        scored = predictions >= 0
+        class_counts = self.count_classes(predictions)
+        image_count = int(scored.sum())
+        model_probabilities = self.model_probabilities(scored)
+        cell_ids, predictions, probabilities = cell_ids[scored], predictions[scored], probabilities[scored]
+        
+        wrapped_pillars = self.wrapped_pillars_from_predictions(pillar_table, cell_ids, predictions)
+        # Thickness from the memory-mapped store, touching only the class 3 crops
+        crops, _ = crop_store.load()
+        crop_rows = {cell_id: row for row, cell_id in enumerate(all_cell_ids.tolist())}
+        self.add_ring_thickness(pillar_table, wrapped_pillars, lambda cell_id: np.asarray(crops[crop_rows[cell_id]]),
+                                crop_store.series_folder)
+        
+        folder_end_time = time.time()
+        folder_elapsed_time = folder_end_time - folder_start_time
+        
+        return {
+            'class_counts': class_counts,
+            'wrapped_pillars': wrapped_pillars,
+            'image_count': image_count,
+            'processing_time': folder_elapsed_time,
+            'pillar_table': pillar_table,
+            'cell_ids': cell_ids,
+            'probabilities': probabilities,
+            'model_probabilities': model_probabilities
+        }
+    
+    def run_settings(self):
+        """Settings a journalled result depends on; a run with other settings starts afresh"""
+        return {
+            'model_path': os.path.abspath(self.model_path),
+            'backend': self.backend,
+            'head_path': os.path.abspath(self.head_path) if self.head_path else None,
+            'ensemble': [os.path.abspath(p) for p in self.ensemble_paths] if self.ensemble_paths else None,
+            'aggregate': self.aggregate if self.ensemble_paths else None,
+            'fused': self.fused,
+            'thickness': self.thickness,
+            'cascade_path': os.path.abspath(self.cascade_path) if self.cascade_path else None
+        }
+
+    def model_name(self):
+        """Name of the scoring model recorded with each box"""
+        if isinstance(self.engine, EnsembleEngine):
+            return f"ensemble-{self.aggregate}(" + "+".join(self.engine.names) + ")"
+        name = os.path.basename(os.path.normpath(self.model_path))
+        if self.head_path:
+            name += "+" + os.path.splitext(os.path.basename(self.head_path))[0]
+        if self.cascade_path:
+            name = "cascade>" + name
+        return name
+
+    def model_probabilities(self, scored=None):
+        """Probabilities of each ensemble model from the last scoring call, None for a single model"""
+        if not isinstance(self.engine, EnsembleEngine):
+            return None
+        model_probabilities = self.engine.last_model_probabilities
+        return model_probabilities if scored is None else model_probabilities[scored]
+
+    def save_model_scores(self, subfolder_info, result):
+        """
+        Save the scores of each ensemble model next to the aggregated ones and compare their counts.
+
+        Returns:
+            Class counts and agreement with the ensemble per model name
+        """
+        ensemble_predictions = ScoringEngine.predict(result['probabilities'])
+        model_results = {}
+        for index, name in enumerate(self.engine.names):
+            probabilities = result['model_probabilities'][:, index]
+            scores = BoxScores.from_predictions(result['pillar_table'], result['cell_ids'], probabilities, name)
+            scores.save(subfolder_info['subfolder_path'], subfolder_info['subfolder_name'], variant=name)
+            predictions = ScoringEngine.predict(probabilities)
+            scored = (predictions >= 0) & (ensemble_predictions >= 0)
+            model_results[name] = {
+                'class_counts': self.count_classes(predictions),
+                'agreement': float(np.mean(predictions[scored] == ensemble_predictions[scored])) if scored.any() else None
+            }
+            agreement = model_results[name]['agreement']
+            print(f"  {name}: {model_results[name]['class_counts']}"
+                  + (f", agreement with ensemble {agreement:.3f}" if agreement is not None else ""))
+        return model_results
+
+    def save_box_scores(self, subfolder_info, result):
+        """Keep the softmax vector and entropy of every box, so counts can be redone under other decision rules"""
+        scores = BoxScores.from_predictions(result['pillar_table'], result['cell_ids'], result['probabilities'],
+                                            self.model_name())
+        scores.save(subfolder_info['subfolder_path'], subfolder_info['subfolder_name'])
+
+    def save_to_warehouse(self, warehouse, plate, subfolder_info, result):
+        """Write the per-box scores, pillars, nuclei and summary row of a series to the warehouse"""
+        series = subfolder_info['subfolder_name']
+        try:
+            warehouse.write_boxes(plate, series, result['pillar_table'], result['cell_ids'],
+                                  result['probabilities'], self.model_name())
+            warehouse.write_pillars(plate, series, result['pillar_table'])
+            if self.nuclei:
+                warehouse.write_nuclei(plate, series, result['nuclei_props'])
+            warehouse.write_series(plate, series, {
+                'nuclei_count': result.get('nuclei_count'),
+                'pillars_count': result['image_count'],
+                'class_counts': result['class_counts'],
+                'processing_time': result['processing_time']
+            })
+        except Exception as e:
+            print(f"Error writing {series} to the results warehouse: {str(e)}")
+
+    def print_cascade_report(self, report):
+        """Print how many boxes a cascade escalated and how its kept boxes compared with the full model"""
+        print(f"  Escalated to the full model: {report['escalated']} of {report['boxes']} boxes "
+              f"({report['escalation_rate']:.1%})")
+        if report['audit_agreement'] is not None:
+            print(f"  Agreement with the full model on {report['audited']} audited boxes: {report['audit_agreement']:.3f}")
+
+    def save_cascade_report(self, reports, output_path):
+        """Save per-series and plate escalation rates and audit agreement, with the stage's calibration"""
+        totals = summarise_reports(reports)
+        report = {
+            'stage': os.path.abspath(self.cascade_path),
+            'threshold': self.engine.stage.threshold,
+            'audit_fraction': self.audit_fraction,
+            'calibration': self.engine.stage.metrics,
+            'plate': totals,
+            'series': reports
+        }
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nCascade escalated {totals['escalated']} of {totals['boxes']} boxes ({totals['escalation_rate']:.1%})")
+        if totals['audit_agreement'] is not None:
+            print(f"Agreement with the full model on {totals['audited']} audited boxes: {totals['audit_agreement']:.3f}")
+        print(f"Saved cascade report to: {output_path}")
+        return report
+
+    def save_wrapped_pillars(self, wrapped_pillars, output_path):
+        """Save class 3 pillars to JSON file"""
+        with open(output_path, 'w') as f:
+            json.dump(wrapped_pillars, f, indent=2)
+        print(f"Saved {len(wrapped_pillars)} class 3 pillar properties to: {output_path}")
+
+    def save_summary_csv(self, summary_data, output_path):
+        """Save summary data to CSV file"""
+        with open(output_path, 'w', newline='') as csvfile:
+            fieldnames = ['subfolder_name', 'nuclei_count', 'pillars_count', 
+                         'class_0_count', 'class_1_count', 'class_2_count', 'class_3_count',
+                         'processing_time_seconds']
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            
+            writer.writeheader()
+            for data in summary_data:
+                writer.writerow({
+                    'subfolder_name': data['subfolder_name'],
+                    'nuclei_count': data['nuclei_count'],
+                    'pillars_count': data['pillars_count'],
+                    'class_0_count': data['class_counts'][0],
+                    'class_1_count': data['class_counts'][1],
+                    'class_2_count': data['class_counts'][2],
+                    'class_3_count': data['class_counts'][3],
+                    'processing_time_seconds': data['processing_time']
+                })
+        
+        print(f"Saved summary CSV to: {output_path}")
+
+    def save_model_comparison_csv(self, comparison_data, output_path):
+        """Save the class counts of each ensemble model and its agreement with the ensemble to CSV file"""
+        with open(output_path, 'w', newline='') as csvfile:
+            fieldnames = ['subfolder_name', 'model', 'class_0_count', 'class_1_count', 'class_2_count',
+                          'class_3_count', 'agreement_with_ensemble']
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            
+            writer.writeheader()
+            for data in comparison_data:
+                writer.writerow({
+                    'subfolder_name': data['subfolder_name'],
+                    'model': data['model'],
+                    'class_0_count': data['class_counts'][0],
+                    'class_1_count': data['class_counts'][1],
+                    'class_2_count': data['class_counts'][2],
+                    'class_3_count': data['class_counts'][3],
+                    'agreement_with_ensemble': '' if data['agreement'] is None else data['agreement']
+                })
+        
+        print(f"Saved model comparison CSV to: {output_path}")
+
+    def find_series(self, parent_directory):
+        """Series of a plate that can be scored: folders with MIPs in fused mode, else with crops or boxes"""
+        if self.fused:
+            return self.find_subfolders_with_mips(parent_directory)
+        return self.find_subfolders_with_boxes(parent_directory)
+
+    def score_series(self, subfolder_info):
+        """
+        Score one series and save its per-series outputs, without touching the journal or warehouse.
+
+        Args:
+            subfolder_info: Entry from find_series, or a series folder
+
+        Returns:
+            Result dict with class counts, class 3 pillars, per-box probabilities and nuclei
+        """
+        if isinstance(subfolder_info, str):
+            subfolder_path = os.path.normpath(subfolder_info)
+            matches = [s for s in self.find_series(os.path.dirname(subfolder_path) or '.')
+                       if s['subfolder_name'] == os.path.basename(subfolder_path)]
+            if not matches:
+                raise ValueError(f"Nothing to score in {subfolder_path}")
+            subfolder_info = matches[0]
+        
+        if self.fused:
+            result = self.box_and_score(subfolder_info)
+        else:
+            # Load pillar coordinates for this subfolder
+            pillar_table = self.load_pillar_coordinates(subfolder_info['subfolder_path'], subfolder_info['subfolder_name'])
+            
+            # Process the packed crops, or the boxes folder from older runs
+            if subfolder_info['crop_store'].exists():
+                result = self.process_crop_store(subfolder_info['crop_store'], pillar_table)
+            else:
+                result = self.process_boxes_folder(subfolder_info['boxes_path'], pillar_table)
+        
+        # Load nuclei count for this subfolder
+        result['nuclei_count'], result['nuclei_props'] = None, []
+        if self.nuclei:
+            result['nuclei_count'], result['nuclei_props'] = self.load_nuclei_props(subfolder_info['nuclei_props_path'])
+        
+        # Print folder results
+        print(f"\nPrediction Counts for {subfolder_info['subfolder_name']}:")
+        if self.nuclei:
+            print(f"  Nuclei count: {result['nuclei_count']}")
+            print(f"  Pillars count: {result['image_count']}")
+        for class_id, count in result['class_counts'].items():
+            print(f"  Class {class_id}: {count} images")
+        print(f"  Total images processed: {result['image_count']}")
+        print(f"  Time elapsed: {result['processing_time']:.2f} seconds")
+        
+        # Save wrapped pillars in the same subfolder
+        if result['wrapped_pillars']:
+            output_filename = f"{subfolder_info['subfolder_name']}_wrapped_pillars.json"
+            output_path = os.path.join(subfolder_info['subfolder_path'], output_filename)
+            self.save_wrapped_pillars(result['wrapped_pillars'], output_path)
+            print(f"  Class 3 pillars found: {len(result['wrapped_pillars'])}")
+        else:
+            print(f"  No class 3 pillars found in this folder")
+        
+        # Escalations since the last series, as the cascade scores a series in one or more calls
+        result['cascade'] = None
+        if isinstance(self.engine, CascadeEngine):
+            result['cascade'] = self.engine.take_report()
+            self.print_cascade_report(result['cascade'])
+        
+        self.save_box_scores(subfolder_info, result)
+        result['model_results'] = None
+        if result['model_probabilities'] is not None:
+            result['model_results'] = self.save_model_scores(subfolder_info, result)
+        return result
+
+    def score_plate(self, parent_directory, ask_resume=None):
+        """
+        Score every series of a plate, journalling each one so an interrupted run can resume.
+
+        Args:
+            parent_directory: Plate folder
+            ask_resume: Called with (completed, total) series counts when self.resume is None and an
+                earlier run completed some; returns whether to skip them. Without it the run resumes
+
+        Returns:
+            Dict with the series found ('subfolders'), their journalled results in plate order
+            ('results'), 'total_class_3_count', 'summary_path' and 'processing_time'
+        """
+        valid_subfolders = self.find_series(parent_directory)
+        print(f"Found {len(valid_subfolders)} valid subfolders:")
+        for subfolder_info in valid_subfolders:
+            print(f"  - {subfolder_info['subfolder_name']}")
+        
+        # Every finished series goes to the run journal, so a restarted run skips it
+        journal = RunJournal(parent_directory, self.run_settings(), name=self.journal_name)
+        completed = journal.read() or {}
+        resume = self.resume
+        finished = [s for s in valid_subfolders if s['subfolder_name'] in completed]
+        if finished and resume is None and ask_resume is not None:
+            resume = ask_resume(len(finished), len(valid_subfolders))
+        completed = journal.start(completed if resume is not False else None)
+        
+        # Per-box results also go to the Parquet warehouse when pyarrow is installed
+        plate = os.path.basename(os.path.normpath(parent_directory))
+        warehouse = None
+        if ResultsWarehouse.available():
+            warehouse = ResultsWarehouse(self.warehouse_root or os.path.join(parent_directory, "results_warehouse"))
+        else:
+            print("pyarrow is not installed, skipping the results warehouse")
+        
+        # Process all subfolders
+        total_start_time = time.time()
+        for subfolder_info in valid_subfolders:
+            if subfolder_info['subfolder_name'] in completed:
+                print(f"\n=== Skipping {subfolder_info['subfolder_name']} (completed by an earlier run) ===")
+                continue
+            print(f"\n=== Processing {subfolder_info['subfolder_name']} ===")
+            
+            try:
+                result = self.score_series(subfolder_info)
+            except Exception as e:
+                print(f"Error processing {subfolder_info['subfolder_name']}: {str(e)}")
+                continue
+            
+            # Warehouse first, so a series in the journal is always in the warehouse too
+            if warehouse is not None:
+                self.save_to_warehouse(warehouse, plate, subfolder_info, result)
+            
+            record = {
+                'class_counts': result['class_counts'],
+                'wrapped_pillars': result['wrapped_pillars'],
+                'image_count': result['image_count'],
+                'processing_time': result['processing_time'],
+                'model_results': result['model_results'],
+                'cascade': result['cascade']
+            }
+            if self.nuclei:
+                record['nuclei_count'] = result['nuclei_count']
+            journal.record(subfolder_info['subfolder_name'], record)
+        
+        # Build the summary from the journal, covering resumed and new series alike
+        results = {}
+        total_class_3_count = 0
+        summary_data = []
+        comparison_data = []
+        for subfolder_info in valid_subfolders:
+            result = journal.results.get(subfolder_info['subfolder_name'])
+            if result is None:
+                continue
+            results[subfolder_info['subfolder_name']] = result
+            total_class_3_count += len(result['wrapped_pillars'])
+            summary_data.append({
+                'subfolder_name': subfolder_info['subfolder_name'],
+                'nuclei_count': result.get('nuclei_count'),
+                'pillars_count': result['image_count'],
+                'class_counts': result['class_counts'],
+                'processing_time': result['processing_time']
+            })
+            comparison_data.append({
+                'subfolder_name': subfolder_info['subfolder_name'],
+                'model': self.model_name(),
+                'class_counts': result['class_counts'],
+                'agreement': 1.0
+            })
+            for name, model_result in (result.get('model_results') or {}).items():
+                comparison_data.append({'subfolder_name': subfolder_info['subfolder_name'], 'model': name,
+                                        **model_result})
+        
+        # Save summary CSV
+        summary_path = None
+        if self.summary_name:
+            summary_path = os.path.join(parent_directory, self.summary_name)
+            self.save_summary_csv(summary_data, summary_path)
+        if self.summary_name and self.ensemble_paths:
+            self.save_model_comparison_csv(comparison_data, os.path.join(parent_directory, "model_comparison.csv"))
+        cascade = None
+        if self.cascade_path:
+            cascade = self.save_cascade_report(
+                {name: r['cascade'] for name, r in results.items() if r.get('cascade')},
+                os.path.join(parent_directory, "cascade_report.json"))
+        
+        return {
+            'subfolders': valid_subfolders,
+            'results': results,
+            'total_class_3_count': total_class_3_count,
+            'summary_path': summary_path,
+            'cascade': cascade,
+            'processing_time': time.time() - total_start_time
+        }
+
+    def run_analysis(self):
+        """Ask for a plate folder, score it and report the totals in dialogs."""
+        # Only the front ends need Tk, the scorer itself runs headless
+        from tkinter import Tk, filedialog, messagebox
+
+        # Initialise Tkinter root
+        root = Tk()
+        root.withdraw()
+        
+        # Ask user for parent directory
+        print("Please select the parent directory containing your subfolders...")
+        parent_directory = filedialog.askdirectory(title="Select Parent Directory")
+        if not parent_directory:
+            messagebox.showerror("Error", "Please select a parent directory.")
+            root.destroy()
+            return
+        
+        # Find valid subfolders
+        if not self.find_series(parent_directory):
+            if self.fused:
+                messagebox.showinfo("Info", "No valid subfolders found. Each subfolder should contain pillar_mip.png and mbp_mip.png.")
+            else:
+                messagebox.showinfo("Info", "No valid subfolders found. Each subfolder should contain a crop store or 'boxes' folder and pillar_coords.json.")
+            root.destroy()
+            return
+        
+        total_start_time = time.time()
+        plate = self.score_plate(parent_directory, ask_resume=lambda finished, total: messagebox.askyesno(
+            "Resume Analysis",
+            f"{finished} of {total} subfolders were completed by an earlier run.\n\n"
+            f"Skip them and resume?"
+        ))
+        
+        total_end_time = time.time()
+        total_elapsed_time = total_end_time - total_start_time
+        
+        # The summary CSV lines only apply when summary_name is set
+        summary_line = f"Summary CSV saved to: {plate['summary_path']}\n" if plate['summary_path'] else ""
+        print(f"\n=== ANALYSIS COMPLETE ===")
+        print(f"Total processing time: {total_elapsed_time:.2f} seconds")
+        print(f"Total subfolders processed: {len(plate['subfolders'])}")
+        print(f"Total class 3 pillars found across all subfolders: {plate['total_class_3_count']}")
+        print(f"{summary_line}Individual results saved in respective subfolders")
+        
+        messagebox.showinfo(
+            "Analysis Complete", 
+            f"Analysis completed successfully!\n\n"
+            f"Total subfolders processed: {len(plate['subfolders'])}\n"
+            f"Total class 3 pillars found: {plate['total_class_3_count']}\n"
+            f"{summary_line}"
+            f"Results saved in respective subfolders"
+        )
+        
+        root.destroy()
@@ -4,12 +4,15 @@ import os
 import json
 from tkinter import Tk, filedialog, messagebox
 import glob
+from PillarDetector import REFERENCE_UM_PER_PIXEL, load_pixel_size
 
 
 class NucleiAnalyser:
-    def __init__(self, image_path, output_folder):
+    def __init__(self, image_path, output_folder, um_per_pixel=None):
         self.image_path = image_path
         self.output_folder = output_folder
+        # Size limits are in pixels at the reference pixel size and scale with the series pixel size
+        self.area_scale = (REFERENCE_UM_PER_PIXEL / (um_per_pixel or REFERENCE_UM_PER_PIXEL)) ** 2
         self.image = None
         self.nuclei_count = []
         self.nuclei_prop = []
@@ -37,7 +40,7 @@ class NucleiAnalyser:
         # Find them nuclei
         contours, _ = cv2.findContours(binary_cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        MIN_CONTOUR_AREA = 20
+        MIN_CONTOUR_AREA = 20 * self.area_scale
         filtered_contours = []
 
         for cnt in contours:
@@ -50,8 +53,8 @@ class NucleiAnalyser:
 
         contours_final, _ = cv2.findContours(final_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        MIN_SIZE_THRESHOLD = 450
-        MAX_SIZE_THRESHOLD = 10000
+        MIN_SIZE_THRESHOLD = 450 * self.area_scale
+        MAX_SIZE_THRESHOLD = 10000 * self.area_scale
 
         self.nuclei_count = []
         self.nuclei_prop = []
@@ -155,7 +158,7 @@ def process_all_subfolders(parent_directory):
                 
                 try:
                     # Process this folder - output goes to the same subfolder
-                    analyser = NucleiAnalyser(nuclei_image_path, subfolder_path)
+                    analyser = NucleiAnalyser(nuclei_image_path, subfolder_path, load_pixel_size(subfolder_path))
                     success = analyser.process()
                     
                     if success:
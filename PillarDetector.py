@@ -0,0 +1,733 @@
+import os
+import re
+import json
+import hashlib
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import List, Optional, Tuple
+
+# Pixel size the default parameters were tuned at (244.86 um field over 2048 px)
+REFERENCE_UM_PER_PIXEL = 244.86 / 2048
+# Per-series pixel size written by the LIF extractor
+PIXEL_SIZE_NAME = 'pixel_size.json'
+
+def load_pixel_size(series_folder: str) -> Optional[float]:
+    """
+    Read the physical pixel size of a series from its sidecar file.
+
+    Args:
+        series_folder: Series folder containing pixel_size.json
+
+    Returns:
+        Microns per pixel, or None if there is no usable sidecar
+    """
+    sidecar_path = os.path.join(series_folder, PIXEL_SIZE_NAME)
+    if not os.path.exists(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'r') as f:
+            um_per_pixel = float(json.load(f)['um_per_pixel'])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Warning: could not read {sidecar_path}: {e}")
+        return None
+    return um_per_pixel if um_per_pixel > 0 else None
+
+def load_mosaic_pixel_size(series_folder: str) -> Optional[float]:
+    """
+    Pixel size of the full-resolution planes, before any MIP downsampling.
+
+    Args:
+        series_folder: Series folder containing pixel_size.json
+
+    Returns:
+        Microns per pixel, or None if there is no usable sidecar
+    """
+    sidecar_path = os.path.join(series_folder, PIXEL_SIZE_NAME)
+    if not os.path.exists(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'r') as f:
+            sidecar = json.load(f)
+        um_per_pixel = float(sidecar.get('mosaic_um_per_pixel', sidecar['um_per_pixel']))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Warning: could not read {sidecar_path}: {e}")
+        return None
+    return um_per_pixel if um_per_pixel > 0 else None
+
+def save_pixel_size(series_folder: str, um_per_pixel: float, source: str = '', downsample: int = 1):
+    """
+    Write the physical pixel size of a series to its sidecar file.
+
+    Args:
+        series_folder: Series folder
+        um_per_pixel: Microns per pixel in x (pixels are square) of the full-resolution planes
+        source: Where the value came from, e.g. the LIF file
+        downsample: Factor the MIPs used downstream were shrunk by, e.g. tiled-mode PNGs
+    """
+    sidecar = {'um_per_pixel': um_per_pixel * downsample, 'source': source}
+    # The full-resolution size is kept so downsampling again never compounds
+    if downsample > 1:
+        sidecar.update(mosaic_um_per_pixel=um_per_pixel, downsample=downsample)
+    with open(os.path.join(series_folder, PIXEL_SIZE_NAME), 'w') as f:
+        json.dump(sidecar, f, indent=2)
+
+class PillarDetector:
+    """Detects pillar centres in a pillar MIP"""
+
+    def __init__(self, radius: int = 15, min_area: int = 2250, threshold: int = 128,
+                 box_size: int = 100, min_radius: Optional[int] = None, full_border: bool = False):
+
+        self.radius = radius
+        self.min_area = min_area
+        self.threshold = threshold
+        # Crop size that goes with this pillar size
+        self.box_size = box_size
+        # Detect on the coarsest pyramid level where the filter radius is still at least this; None keeps full resolution
+        self.min_radius = min_radius
+        # AutoBoxer has only ever dropped pillars touching the left edge; True drops those touching any edge
+        self.full_border = full_border
+
+        # Same disc as the old 31x31 scipy convolution kernel
+        self.disc = self.make_disc(radius)
+
+    @classmethod
+    def from_pixel_size(cls, um_per_pixel: float, min_radius: Optional[int] = 6,
+                        full_border: bool = False) -> 'PillarDetector':
+        """
+        Detector with the default physical pillar size scaled to this pixel size.
+
+        Args:
+            um_per_pixel: Microns per pixel of the pillar image
+            min_radius: Smallest filter radius for choosing the pyramid level
+            full_border: Drop pillars touching any image edge, not only the left one
+
+        Returns:
+            PillarDetector
+        """
+        scale = REFERENCE_UM_PER_PIXEL / um_per_pixel
+        defaults = cls()
+        return cls(radius=max(1, int(round(defaults.radius * scale))),
+                   min_area=max(1, int(round(defaults.min_area * scale ** 2))),
+                   threshold=defaults.threshold,
+                   box_size=max(2, int(round(defaults.box_size * scale))),
+                   min_radius=min_radius,
+                   full_border=full_border)
+
+    @classmethod
+    def for_series(cls, series_folder: str, min_radius: Optional[int] = 6,
+                   full_border: bool = False) -> 'PillarDetector':
+        """
+        Detector sized from the series pixel-size sidecar.
+
+        Series without a sidecar are assumed to be at the reference pixel size.
+
+        Args:
+            series_folder: Series folder
+            min_radius: Smallest filter radius for choosing the pyramid level
+            full_border: Drop pillars touching any image edge, not only the left one
+
+        Returns:
+            PillarDetector
+        """
+        um_per_pixel = load_pixel_size(series_folder)
+        if um_per_pixel is None:
+            um_per_pixel = REFERENCE_UM_PER_PIXEL
+        return cls.from_pixel_size(um_per_pixel, min_radius=min_radius, full_border=full_border)
+
+    def make_disc(self, radius: int) -> np.ndarray:
+        """Binary disc kernel of the given radius."""
+        y, x = np.ogrid[-radius: radius + 1, -radius: radius + 1]
+        return (x**2 + y**2 <= radius**2).astype(np.uint8)
+
+    def pyramid_level(self) -> int:
+        """Number of 2x downsamplings that keep the filter radius at least min_radius."""
+        if not self.min_radius or self.radius < 2 * self.min_radius:
+            return 0
+        return int(np.floor(np.log2(self.radius / self.min_radius)))
+
+    def binary_mask(self, pillar_image: np.ndarray) -> np.ndarray:
+        """
+        Threshold the pillar MIP.
+
+        Args:
+            pillar_image: BGR or greyscale pillar image
+
+        Returns:
+            uint8 binary mask (0/255)
+        """
+        if pillar_image.ndim == 3:
+            grey_image = cv2.cvtColor(pillar_image, cv2.COLOR_BGR2GRAY)
+        else:
+            grey_image = pillar_image
+        _, binary_mask = cv2.threshold(grey_image, self.threshold, 255, cv2.THRESH_BINARY)
+        return binary_mask
+
+    def filter_mask(self, binary_mask: np.ndarray) -> np.ndarray:
+        """
+        Saturating disc filter of the binary mask.
+
+        Any pixel with mask within the disc becomes 255, which is the support of
+        the old convolution without its float64 pass and uint8 wrap-around.
+
+        Args:
+            binary_mask: uint8 binary mask
+
+        Returns:
+            uint8 filtered mask (0/255)
+        """
+        return cv2.dilate(binary_mask, self.disc)
+
+    def find_pillars(self, pillar_image: np.ndarray) -> List[dict]:
+        """
+        Detect pillars with their contour properties.
+
+        With a pyramid level above 0 the pillars are found on the downsampled image
+        and each one is re-measured at full resolution in a small window, so the
+        full-resolution work scales with the number of pillars.
+
+        Args:
+            pillar_image: BGR or greyscale pillar image
+
+        Returns:
+            List of dicts with 'center' (x, y), 'area' and 'bbox' (x, y, w, h), in contour order
+        """
+        grey_image = cv2.cvtColor(pillar_image, cv2.COLOR_BGR2GRAY) if pillar_image.ndim == 3 else pillar_image
+        level = self.pyramid_level()
+        if level == 0:
+            return self.measure(grey_image, self.disc, self.min_area, grey_image.shape[:2])
+        return self.find_pillars_pyramid(grey_image, level)
+
+    def measure(self, grey_image: np.ndarray, disc: np.ndarray, min_area: float,
+                image_shape: Tuple[int, int], offset: Tuple[int, int] = (0, 0)) -> List[dict]:
+        """
+        Threshold, filter and measure pillar contours.
+
+        Args:
+            grey_image: Greyscale image or window of it
+            disc: Filter kernel
+            min_area: Smallest contour area kept
+            image_shape: (height, width) of the full image, for the border check
+            offset: (x, y) of the window in the full image
+
+        Returns:
+            Pillar dicts in full-image coordinates
+        """
+        binary_mask = self.binary_mask(grey_image)
+        filtered_image = cv2.dilate(binary_mask, disc)
+        contours, _ = cv2.findContours(filtered_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                       offset=offset)
+
+        img_h, img_w = image_shape
+        pillars = []
+
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < min_area:  # Skip small areas (cut-off pillars, noise)
+                continue
+
+            # Skip partial pillars touching the image border
+            x, y, w, h = cv2.boundingRect(contour)
+            if self.full_border:
+                if x <= 0 or y <= 0 or x + w >= img_w or y + h >= img_h:
+                    continue
+            elif x <= 0:
+                # The original chained test 'x <= 0 or y <= 0 >= img_h' only checked x; kept so
+                # pillar counts and cell_ids stay comparable with earlier plates
+                continue
+
+            moments = cv2.moments(contour)
+            if moments["m00"] != 0:
+                xc = int(moments["m10"] / moments["m00"])
+                yc = int(moments["m01"] / moments["m00"])
+                pillars.append({'center': (xc, yc), 'area': float(area), 'bbox': (x, y, w, h)})
+
+        return pillars
+
+    def find_pillars_pyramid(self, grey_image: np.ndarray, level: int) -> List[dict]:
+        """
+        Find pillars on a downsampled level and refine their centres at full resolution.
+
+        Only each pillar's own box is read at full resolution, where the centre
+        becomes the centroid of the thresholded pillar.
+
+        Args:
+            grey_image: Full-resolution greyscale pillar image
+            level: Number of 2x downsamplings
+
+        Returns:
+            Pillar dicts in full-resolution coordinates, in coarse contour order
+        """
+        factor = 2 ** level
+        img_h, img_w = grey_image.shape[:2]
+        small = cv2.resize(grey_image, (max(1, img_w // factor), max(1, img_h // factor)),
+                           interpolation=cv2.INTER_AREA)
+
+        coarse_radius = max(1, int(round(self.radius / factor)))
+        coarse = self.measure(small, self.make_disc(coarse_radius), self.min_area / factor ** 2, small.shape[:2])
+
+        pillars = []
+        for candidate in coarse:
+            x, y, w, h = (v * factor for v in candidate['bbox'])
+            x0, y0 = max(0, x - factor), max(0, y - factor)
+            x1, y1 = min(img_w, x + w + factor), min(img_h, y + h + factor)
+
+            # Centre back at full resolution: halfway through the coarse pixel, then the thresholded centroid
+            xc, yc = (candidate['center'][0] + 0.5) * factor, (candidate['center'][1] + 0.5) * factor
+            moments = cv2.moments(self.binary_mask(grey_image[y0:y1, x0:x1]), binaryImage=True)
+            if moments["m00"] != 0:
+                xc = x0 + moments["m10"] / moments["m00"]
+                yc = y0 + moments["m01"] / moments["m00"]
+
+            pillars.append({'center': (int(xc), int(yc)),
+                            'area': candidate['area'] * factor ** 2,
+                            'bbox': (x, y, w, h)})
+
+        return pillars
+
+    def detect(self, pillar_image: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        Detect pillar centres.
+
+        Args:
+            pillar_image: BGR or greyscale pillar image
+
+        Returns:
+            List of (x, y) centres in image pixels, in contour order
+        """
+        return [pillar['center'] for pillar in self.find_pillars(pillar_image)]
+
+    def detect_lattice(self, pillar_image: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        Detect pillar centres by fitting the pillar lattice to the confident detections.
+
+        Falls back to the plain detections when too few pillars are found to fit a lattice.
+
+        Args:
+            pillar_image: BGR or greyscale pillar image
+
+        Returns:
+            List of (x, y) centres ordered by lattice row, then column
+        """
+        pillars = self.find_pillars(pillar_image)
+        centres = LatticeLocaliser(threshold=self.threshold).localise(pillar_image, pillars)
+        if centres is None:
+            print("Lattice fit failed, using individual detections")
+            return [pillar['center'] for pillar in pillars]
+        return centres
+
+class LatticeLocaliser:
+    """Predicts every pillar of a regular micropillar array from a few confident detections"""
+
+    def __init__(self, min_detections: int = 6, angle_tolerance: float = 10.0, max_residual: float = 0.25,
+                 threshold: int = 128, min_signal: float = 0.1):
+
+        self.min_detections = min_detections
+        self.angle_tolerance = np.deg2rad(angle_tolerance)
+        # Detections further than this fraction of a lattice cell from their node are outliers
+        self.max_residual = max_residual
+        # Nodes are kept only where the pillar mask (grey > threshold) covers at least
+        # min_signal of what it covers around a typical confident detection
+        self.threshold = threshold
+        self.min_signal = min_signal
+
+    def wrap_angle(self, angles: np.ndarray) -> np.ndarray:
+        """Wrap direction differences into [-pi/2, pi/2), since v and -v are the same direction."""
+        return (angles + np.pi / 2) % np.pi - np.pi / 2
+
+    def dominant_direction(self, offsets: np.ndarray, angles: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Find the most common offset direction and its average offset.
+
+        Args:
+            offsets: Mx2 neighbour offsets
+            angles: Direction of each offset
+
+        Returns:
+            Average offset along the dominant direction, or None if there are no offsets
+        """
+        if len(offsets) == 0:
+            return None
+
+        # Offset histogram over direction, smoothed across neighbouring (and wrapping) bins
+        n_bins = int(round(np.pi / (self.angle_tolerance / 2)))
+        counts, edges = np.histogram(angles, bins=n_bins, range=(-np.pi / 2, np.pi / 2))
+        counts = counts + np.roll(counts, 1) + np.roll(counts, -1)
+        peak = (edges[np.argmax(counts)] + edges[np.argmax(counts) + 1]) / 2
+
+        members = offsets[np.abs(self.wrap_angle(angles - peak)) < self.angle_tolerance]
+        if len(members) == 0:
+            return None
+
+        # Point every member the same way before averaging
+        direction = np.array([np.cos(peak), np.sin(peak)])
+        members = np.where((members @ direction < 0)[:, None], -members, members)
+        return np.median(members, axis=0)
+
+    def estimate_vectors(self, points: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Estimate the two lattice vectors from nearest-neighbour offsets.
+
+        Args:
+            points: Nx2 confident pillar centres
+
+        Returns:
+            (a, b) lattice vectors with a the more horizontal one, or None if the fit fails
+        """
+        tree = cKDTree(points)
+        dists, idx = tree.query(points, k=min(7, len(points)))
+        spacing = np.median(dists[:, 1])
+
+        offsets = (points[idx[:, 1:]] - points[:, None, :]).reshape(-1, 2)
+        lengths = np.hypot(offsets[:, 0], offsets[:, 1])
+        offsets = offsets[(lengths > 0) & (lengths < 1.25 * spacing)]
+        angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+
+        a = self.dominant_direction(offsets, angles)
+        if a is None:
+            return None
+
+        # Second vector: the densest direction well away from the first
+        angle_a = np.arctan2(a[1], a[0])
+        others = np.abs(self.wrap_angle(angles - angle_a)) > np.deg2rad(30)
+        b = self.dominant_direction(offsets[others], angles[others])
+        if b is None:
+            return None
+
+        if abs(a[0]) < abs(b[0]):
+            a, b = b, a
+        if a[0] < 0:
+            a = -a
+        if b[1] < 0:
+            b = -b
+        return a, b
+
+    def fit(self, points: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Fit origin and lattice vectors to the detections by least squares.
+
+        Args:
+            points: Nx2 confident pillar centres
+
+        Returns:
+            (origin, a, b), or None if the fit fails
+        """
+        vectors = self.estimate_vectors(points)
+        if vectors is None:
+            return None
+        a, b = vectors
+
+        basis = np.column_stack([a, b])
+        if abs(np.linalg.det(basis)) < 1e-6:
+            return None
+        frac = points @ np.linalg.inv(basis).T
+
+        # Phase of the lattice from the circular mean of the fractional coordinates
+        phase = np.angle(np.exp(2j * np.pi * frac).mean(axis=0)) / (2 * np.pi)
+        indices = np.round(frac - phase)
+        residual = np.abs(frac - phase - indices).max(axis=1)
+        inliers = residual < self.max_residual
+        if inliers.sum() < self.min_detections:
+            return None
+
+        # points = origin + i * a + j * b
+        design = np.column_stack([np.ones(inliers.sum()), indices[inliers]])
+        solution, _, _, _ = np.linalg.lstsq(design, points[inliers], rcond=None)
+        return solution[0], solution[1], solution[2]
+
+    def predict(self, shape: Tuple[int, int], origin: np.ndarray, a: np.ndarray, b: np.ndarray,
+                margin: float) -> np.ndarray:
+        """
+        Predict every lattice node that lies inside the image.
+
+        Args:
+            shape: Image (height, width)
+            origin, a, b: Fitted lattice
+            margin: Minimum distance of a node from the image border
+
+        Returns:
+            Mx4 array of (x, y, i, j) for each in-bounds node
+        """
+        img_h, img_w = shape
+        corners = np.array([[0, 0], [img_w, 0], [0, img_h], [img_w, img_h]], dtype=np.float64)
+        corner_frac = (corners - origin) @ np.linalg.inv(np.column_stack([a, b])).T
+
+        i_range = np.arange(np.floor(corner_frac[:, 0].min()), np.ceil(corner_frac[:, 0].max()) + 1)
+        j_range = np.arange(np.floor(corner_frac[:, 1].min()), np.ceil(corner_frac[:, 1].max()) + 1)
+        jj, ii = np.meshgrid(j_range, i_range, indexing='ij')
+        ii, jj = ii.ravel(), jj.ravel()
+        nodes = origin + ii[:, None] * a + jj[:, None] * b
+
+        inside = ((nodes[:, 0] >= margin) & (nodes[:, 0] < img_w - margin) &
+                  (nodes[:, 1] >= margin) & (nodes[:, 1] < img_h - margin))
+        return np.column_stack([nodes[inside], ii[inside], jj[inside]])
+
+    def signal(self, mask: np.ndarray, points: np.ndarray, half: int) -> np.ndarray:
+        """
+        Pillar mask pixels in the square window around each point.
+
+        Args:
+            mask: Binary pillar mask (nonzero = pillar)
+            points: Mx2 centres
+            half: Half-size of the window
+
+        Returns:
+            Pixel count per point
+        """
+        img_h, img_w = mask.shape[:2]
+        integral = cv2.integral((mask > 0).astype(np.uint8))
+        x = np.round(points[:, 0]).astype(np.int64)
+        y = np.round(points[:, 1]).astype(np.int64)
+        x0, x1 = np.clip(x - half, 0, img_w), np.clip(x + half + 1, 0, img_w)
+        y0, y1 = np.clip(y - half, 0, img_h), np.clip(y + half + 1, 0, img_h)
+        return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+    def refine(self, grey_image: np.ndarray, nodes: np.ndarray, radius: float) -> np.ndarray:
+        """
+        Move each predicted node to the intensity centroid of its neighbourhood.
+
+        Nodes whose centroid is unusable keep their predicted position; localise has
+        already dropped the ones without pillar signal.
+
+        Args:
+            grey_image: Greyscale pillar image
+            nodes: Mx2 predicted centres
+            radius: Half-size of the search window
+
+        Returns:
+            Mx2 refined centres
+        """
+        img_h, img_w = grey_image.shape[:2]
+        half = int(radius)
+        refined = nodes.copy()
+
+        for k, (x, y) in enumerate(nodes):
+            x0, x1 = max(0, int(x) - half), min(img_w, int(x) + half + 1)
+            y0, y1 = max(0, int(y) - half), min(img_h, int(y) + half + 1)
+            window = grey_image[y0:y1, x0:x1].astype(np.float32)
+            window -= window.min()
+            moments = cv2.moments(window)
+            if moments["m00"] <= 0:
+                continue
+
+            cx = x0 + moments["m10"] / moments["m00"]
+            cy = y0 + moments["m01"] / moments["m00"]
+            # Ignore centroids dragged away by neighbouring structure
+            if np.hypot(cx - x, cy - y) <= radius / 2:
+                refined[k] = (cx, cy)
+
+        return refined
+
+    def localise(self, pillar_image: np.ndarray, pillars: List[dict]) -> Optional[List[Tuple[int, int]]]:
+        """
+        Fit the lattice to confident detections and return every in-bounds node with pillar signal.
+
+        Args:
+            pillar_image: BGR or greyscale pillar image
+            pillars: Confident detections from PillarDetector.find_pillars
+
+        Returns:
+            List of (x, y) centres ordered by lattice row, then column, or None if the fit fails
+        """
+        if len(pillars) < self.min_detections:
+            return None
+
+        points = np.array([pillar['center'] for pillar in pillars], dtype=np.float64)
+        lattice = self.fit(points)
+        if lattice is None:
+            return None
+        origin, a, b = lattice
+
+        # Keep the same border exclusion as the detector: whole pillar inside the image
+        margin = np.median([max(pillar['bbox'][2], pillar['bbox'][3]) for pillar in pillars]) / 2
+        grey_image = cv2.cvtColor(pillar_image, cv2.COLOR_BGR2GRAY) if pillar_image.ndim == 3 else pillar_image
+        nodes = self.predict(grey_image.shape[:2], origin, a, b, margin)
+        if len(nodes) == 0:
+            return None
+
+        # Drop nodes over empty, damaged or out-of-array regions, where no pillar was imaged
+        mask = grey_image > self.threshold
+        half = max(1, int(round(margin)))
+        reference = np.median(self.signal(mask, points, half))
+        present = self.signal(mask, nodes[:, :2], half) >= max(1.0, self.min_signal * reference)
+        nodes = nodes[present]
+        if len(nodes) == 0:
+            return None
+
+        spacing = min(np.hypot(*a), np.hypot(*b))
+        centres = self.refine(grey_image, nodes[:, :2], 0.35 * spacing)
+
+        # Row (j) then column (i) gives the same cell_id order in every series
+        order = np.lexsort((nodes[:, 2], nodes[:, 3]))
+        return [(int(round(x)), int(round(y))) for x, y in centres[order]]
+
+class DetectionCache:
+    """Pillar detections cached next to the pillar image, keyed by image content and detector parameters"""
+
+    CACHE_DIR = '.pillar_cache'
+    # Bump when detection itself changes so old entries are recomputed
+    VERSION = 2
+
+    def __init__(self, detector: Optional[PillarDetector] = None):
+
+        self.detector = detector or PillarDetector()
+
+    def key(self, image_path: str) -> str:
+        """
+        Cache key for an image and this detector.
+
+        Args:
+            image_path: Pillar image file
+
+        Returns:
+            Hex digest of the image bytes and detector parameters
+        """
+        params = {
+            'version': self.VERSION,
+            'radius': self.detector.radius,
+            'min_area': self.detector.min_area,
+            'threshold': self.detector.threshold,
+            'min_radius': self.detector.min_radius,
+            'full_border': self.detector.full_border
+        }
+        digest = hashlib.sha1()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()[:20]
+
+    def cache_path(self, image_path: str, key: str) -> str:
+        """Cache file for a key, in the image's folder and named after the image."""
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(os.path.dirname(os.path.abspath(image_path)), self.CACHE_DIR, f"{stem}-{key}.npz")
+
+    def load(self, image_path: str, key: Optional[str] = None) -> Optional[dict]:
+        """
+        Load cached detections for an image.
+
+        Args:
+            image_path: Pillar image file
+            key: Cache key if the caller already computed it
+
+        Returns:
+            Dict of arrays ('centers', 'areas', 'bboxes', 'mask', 'shape', optionally 'lattice'), or None
+        """
+        path = self.cache_path(image_path, key or self.key(image_path))
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable detection cache {path}: {e}")
+            return None
+
+    def save(self, image_path: str, entry: dict, key: Optional[str] = None):
+        """
+        Write detections for an image; a read-only folder just skips caching.
+
+        Entries for older versions of the image or other detector settings are removed.
+
+        Args:
+            image_path: Pillar image file
+            entry: Dict of detection arrays
+            key: Cache key if the caller already computed it
+        """
+        key = key or self.key(image_path)
+        path = self.cache_path(image_path, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **entry)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not cache detections in {path}: {e}")
+            return
+        self.prune(image_path, key)
+
+    def prune(self, image_path: str, key: str):
+        """Delete the image's cache entries other than the one for key."""
+        keep_path = self.cache_path(image_path, key)
+        cache_dir, keep_name = os.path.split(keep_path)
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        stale = re.compile(re.escape(stem) + r"-[0-9a-f]{20}\.npz")
+        for name in os.listdir(cache_dir):
+            if name != keep_name and stale.fullmatch(name):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError as e:
+                    print(f"Warning: could not remove stale detection cache {name}: {e}")
+
+    def compute(self, pillar_image: np.ndarray) -> dict:
+        """Run the detector and pack its results as arrays."""
+        pillars = self.detector.find_pillars(pillar_image)
+        return {
+            'centers': np.array([p['center'] for p in pillars], dtype=np.int64).reshape(-1, 2),
+            'areas': np.array([p['area'] for p in pillars], dtype=np.float64),
+            'bboxes': np.array([p['bbox'] for p in pillars], dtype=np.int64).reshape(-1, 4),
+            # Thresholded pillar mask, bit-packed
+            'mask': np.packbits(self.detector.binary_mask(pillar_image) > 0, axis=None),
+            'shape': np.array(pillar_image.shape[:2], dtype=np.int64)
+        }
+
+    def get(self, image_path: str, pillar_image: Optional[np.ndarray] = None, lattice: bool = False) -> dict:
+        """
+        Cached detections for an image, computing and caching them on a miss.
+
+        Args:
+            image_path: Pillar image file
+            pillar_image: The decoded image if the caller already has it
+            lattice: Also make sure the lattice-fitted centres are cached
+
+        Returns:
+            Dict of detection arrays, see load
+        """
+        key = self.key(image_path)
+        entry = self.load(image_path, key)
+        if entry is not None and (not lattice or 'lattice' in entry):
+            print(f"Loaded cached pillar detections for {image_path}")
+            return entry
+
+        if pillar_image is None:
+            pillar_image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+            if pillar_image is None:
+                raise ValueError(f"Failed to load pillar image: {image_path}")
+
+        if entry is None:
+            entry = self.compute(pillar_image)
+        if lattice:
+            pillars = [{'center': tuple(c), 'bbox': tuple(b)} for c, b in zip(entry['centers'].tolist(), entry['bboxes'].tolist())]
+            centres = LatticeLocaliser(threshold=self.detector.threshold).localise(pillar_image, pillars)
+            if centres is None:
+                print("Lattice fit failed, using individual detections")
+                centres = entry['centers']
+            entry['lattice'] = np.array(centres, dtype=np.int64).reshape(-1, 2)
+
+        self.save(image_path, entry, key)
+        return entry
+
+    def detect(self, image_path: str, pillar_image: Optional[np.ndarray] = None,
+               lattice: bool = False) -> List[Tuple[int, int]]:
+        """
+        Pillar centres of an image, from the cache when possible.
+
+        Args:
+            image_path: Pillar image file
+            pillar_image: The decoded image if the caller already has it
+            lattice: Use the lattice-fitted centres (see PillarDetector.detect_lattice)
+
+        Returns:
+            List of (x, y) centres
+        """
+        entry = self.get(image_path, pillar_image, lattice=lattice)
+        centres = entry['lattice'] if lattice else entry['centers']
+        return [(int(x), int(y)) for x, y in centres]
+
+    def load_mask(self, image_path: str, pillar_image: Optional[np.ndarray] = None) -> np.ndarray:
+        """Thresholded pillar mask (uint8 0/255) of an image, from the cache when possible."""
+        entry = self.get(image_path, pillar_image)
+        height, width = entry['shape'].tolist()
+        bits = np.unpackbits(entry['mask'], count=height * width)
+        return bits.reshape(height, width) * np.uint8(255)
@@ -0,0 +1,240 @@
+import os
+import json
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+class PillarTable:
+    """Column-oriented pillar coordinates for one series, indexed by cell_id"""
+
+    def __init__(self, cell_id: np.ndarray, x: np.ndarray, y: np.ndarray,
+                 columns: Optional[Dict[str, np.ndarray]] = None):
+
+        self.cell_id = np.asarray(cell_id, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.int64)
+        self.y = np.asarray(y, dtype=np.int64)
+        # Extra per-pillar columns, e.g. predicted_class, aligned with cell_id
+        self.columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+
+        # Dense cell_id -> row lookup, -1 where there is no pillar
+        size = int(self.cell_id.max()) + 1 if len(self.cell_id) else 0
+        self.index = np.full(size, -1, dtype=np.int64)
+        self.index[self.cell_id] = np.arange(len(self.cell_id))
+
+    def __len__(self) -> int:
+        return len(self.cell_id)
+
+    @classmethod
+    def from_records(cls, records: List[dict]) -> 'PillarTable':
+        """
+        Build a table from pillar_coords.json / wrapped_pillars.json records.
+
+        Args:
+            records: Dicts with 'cell_id' and 'center_coordinates' {'x', 'y'}
+
+        Returns:
+            PillarTable, with 'predicted_class' kept as a column if present
+        """
+        cell_id = [r['cell_id'] for r in records]
+        x = [r['center_coordinates']['x'] for r in records]
+        y = [r['center_coordinates']['y'] for r in records]
+        columns = {}
+        if records and all('predicted_class' in r for r in records):
+            columns['predicted_class'] = np.array([r['predicted_class'] for r in records], dtype=np.int64)
+        return cls(cell_id, x, y, columns)
+
+    @classmethod
+    def from_centres(cls, centres: List[Tuple[int, int]]) -> 'PillarTable':
+        """Build a table with cell_id i for the i-th (x, y) centre."""
+        points = np.asarray(centres, dtype=np.int64).reshape(-1, 2)
+        return cls(np.arange(len(points)), points[:, 0], points[:, 1])
+
+    @staticmethod
+    def paths(series_folder: str, series_name: Optional[str] = None) -> Dict[str, str]:
+        """File names of each format for a series."""
+        series_name = series_name or os.path.basename(os.path.normpath(series_folder))
+        return {
+            'npz': os.path.join(series_folder, f"{series_name}_pillars.npz"),
+            'parquet': os.path.join(series_folder, f"{series_name}_pillars.parquet"),
+            'json': os.path.join(series_folder, f"{series_name}_pillar_coords.json")
+        }
+
+    @classmethod
+    def load(cls, series_folder: str, series_name: Optional[str] = None) -> Optional['PillarTable']:
+        """
+        Load the pillar table of a series, preferring the columnar formats.
+
+        Falls back to pillar_coords.json for series boxed before the table existed.
+
+        Args:
+            series_folder: Series folder
+            series_name: Series name, defaults to the folder name
+
+        Returns:
+            PillarTable, or None if the series has no pillar coordinates
+        """
+        paths = cls.paths(series_folder, series_name)
+        if os.path.exists(paths['npz']):
+            return cls.load_npz(paths['npz'])
+        if pq is not None and os.path.exists(paths['parquet']):
+            return cls.load_parquet(paths['parquet'])
+        if os.path.exists(paths['json']):
+            return cls.load_json(paths['json'])
+        return None
+
+    @classmethod
+    def load_npz(cls, path: str) -> 'PillarTable':
+        """Load a table saved by save_npz."""
+        with np.load(path) as data:
+            columns = {name[4:]: data[name] for name in data.files if name.startswith('col_')}
+            return cls(data['cell_id'], data['x'], data['y'], columns)
+
+    @classmethod
+    def load_parquet(cls, path: str) -> 'PillarTable':
+        """Load a table saved by save_parquet."""
+        table = pq.read_table(path)
+        data = {name: table.column(name).to_numpy() for name in table.column_names}
+        cell_id, x, y = data.pop('cell_id'), data.pop('x'), data.pop('y')
+        return cls(cell_id, x, y, data)
+
+    @classmethod
+    def load_json(cls, path: str) -> 'PillarTable':
+        """Load a pillar_coords.json or wrapped_pillars.json file."""
+        with open(path, 'r') as f:
+            return cls.from_records(json.load(f))
+
+    def save(self, series_folder: str, series_name: Optional[str] = None, export_json: bool = True):
+        """
+        Save the table as .npz (and .parquet when pyarrow is installed).
+
+        Args:
+            series_folder: Series folder
+            series_name: Series name, defaults to the folder name
+            export_json: Also write pillar_coords.json for older tools
+        """
+        paths = self.paths(series_folder, series_name)
+        self.save_npz(paths['npz'])
+        if pa is not None:
+            self.save_parquet(paths['parquet'])
+        if export_json:
+            with open(paths['json'], 'w') as f:
+                json.dump(self.records(), f, indent=4)
+        print(f"Saved {len(self)} pillars to {paths['npz']}")
+
+    def save_npz(self, path: str):
+        """Save the columns to an .npz file."""
+        columns = {f"col_{name}": values for name, values in self.columns.items()}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, cell_id=self.cell_id, x=self.x, y=self.y, **columns)
+        os.replace(tmp_path, path)
+
+    def save_parquet(self, path: str):
+        """Save the columns to a Parquet file."""
+        data = {'cell_id': self.cell_id, 'x': self.x, 'y': self.y}
+        data.update(self.columns)
+        pq.write_table(pa.table(data), path)
+
+    def rows(self, cell_ids) -> np.ndarray:
+        """
+        Row of each cell_id, vectorised.
+
+        Args:
+            cell_ids: Scalar or array of cell_ids
+
+        Returns:
+            Row indices, -1 for ids that are not in the table
+        """
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        rows = np.full(cell_ids.shape, -1, dtype=np.int64)
+        valid = (cell_ids >= 0) & (cell_ids < len(self.index))
+        rows[valid] = self.index[cell_ids[valid]]
+        return rows
+
+    def join(self, name: str, cell_ids, values, fill=-1) -> np.ndarray:
+        """
+        Add a column from values keyed by cell_id, e.g. per-box predictions.
+
+        Args:
+            name: Column name
+            cell_ids: cell_id of each value
+            values: Values to join
+            fill: Value for pillars without an entry
+
+        Returns:
+            The new column, aligned with the table rows
+        """
+        values = np.asarray(values)
+        column = np.full(len(self), fill, dtype=np.result_type(values.dtype, np.min_scalar_type(fill)))
+        rows = self.rows(cell_ids)
+        found = rows >= 0
+        column[rows[found]] = values[found]
+        self.columns[name] = column
+        return column
+
+    def centres(self) -> np.ndarray:
+        """Nx2 array of (x, y) centres."""
+        return np.column_stack([self.x, self.y])
+
+    def nearest(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest pillar to each point, e.g. nuclei centroids.
+
+        Args:
+            points: Mx2 (x, y) points
+
+        Returns:
+            (distances, rows) for each point
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(self) == 0 or len(points) == 0:
+            return np.full(len(points), np.inf), np.full(len(points), -1, dtype=np.int64)
+        distances, rows = cKDTree(self.centres()).query(points)
+        return distances, rows.astype(np.int64)
+
+    def within(self, points: np.ndarray, radius: float) -> List[np.ndarray]:
+        """
+        Points within radius of each pillar.
+
+        Args:
+            points: Mx2 (x, y) points
+            radius: Search radius in pixels
+
+        Returns:
+            For each pillar row, the indices of the points within radius
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(self) == 0 or len(points) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in range(len(self))]
+        matches = cKDTree(points).query_ball_point(self.centres(), radius)
+        return [np.asarray(m, dtype=np.int64) for m in matches]
+
+    def records(self, rows: Optional[np.ndarray] = None, **fields) -> List[dict]:
+        """
+        pillar_coords.json style records for the compatibility export.
+
+        Args:
+            rows: Rows to export, default all
+            fields: Constant fields added to every record, e.g. predicted_class=3
+
+        Returns:
+            List of dicts with cell_id, image_filename, center_coordinates and the fields
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        records = []
+        for cell_id, x, y in zip(self.cell_id[rows].tolist(), self.x[rows].tolist(), self.y[rows].tolist()):
+            record = {
+                'cell_id': cell_id,
+                'image_filename': f"box_{cell_id}.png",
+                'center_coordinates': {'x': x, 'y': y}
+            }
+            record.update(fields)
+            records.append(record)
+        return records
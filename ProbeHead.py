@@ -0,0 +1,214 @@
+import os
+import time
+import argparse
+import joblib
+import numpy as np
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LogisticRegression
+from sklearn.neural_network import MLPClassifier
+from typing import List, Optional, Tuple
+from CropStore import CropStore
+from EmbeddingStore import EmbeddingStore
+from DistillStudent import collect_boxes
+
+class ProbeHead:
+    """Classifier head trained on stored ViT CLS embeddings instead of fine-tuning the backbone"""
+
+    def __init__(self, kind: str = "logistic", model_id: Optional[str] = None, C: float = 1.0, hidden: int = 256):
+
+        if kind not in ("logistic", "mlp"):
+            raise ValueError(f"Unknown head '{kind}', expected 'logistic' or 'mlp'")
+        self.kind = kind
+        # Embeddings are only comparable within one backbone
+        self.model_id = model_id
+        self.C = C
+        self.hidden = hidden
+        self.pipeline = None
+        self.metrics = {}
+
+    def build(self):
+        """Standardised embeddings into a logistic regression or a one-hidden-layer MLP."""
+        if self.kind == "logistic":
+            classifier = LogisticRegression(C=self.C, max_iter=2000)
+        else:
+            classifier = MLPClassifier(hidden_layer_sizes=(self.hidden,), alpha=1e-3, early_stopping=True,
+                                       max_iter=500, random_state=0)
+        return make_pipeline(StandardScaler(), classifier)
+
+    def fit(self, embeddings: np.ndarray, labels: np.ndarray) -> 'ProbeHead':
+        """
+        Train the head on labelled embeddings.
+
+        Args:
+            embeddings: NxD CLS embeddings
+            labels: Class of each embedding
+
+        Returns:
+            self
+        """
+        self.pipeline = self.build()
+        self.pipeline.fit(embeddings.astype(np.float32), labels)
+        return self
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """Predicted class per embedding, -1 for NaN rows (crops that failed to load)."""
+        predictions = np.full(len(embeddings), -1, dtype=np.int64)
+        valid = ~np.isnan(embeddings).any(axis=1) if embeddings.shape[1] else np.zeros(len(embeddings), dtype=bool)
+        if valid.any():
+            predictions[valid] = self.pipeline.predict(embeddings[valid].astype(np.float32))
+        return predictions
+
+    def predict_proba(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Class probabilities per embedding.
+
+        Returns:
+            NxC float32 probabilities, column c for class c, NaN rows for NaN embeddings
+        """
+        classes = self.pipeline.classes_.astype(np.int64)
+        probabilities = np.full((len(embeddings), int(classes.max()) + 1), np.nan, dtype=np.float32)
+        valid = ~np.isnan(embeddings).any(axis=1) if embeddings.shape[1] else np.zeros(len(embeddings), dtype=bool)
+        if valid.any():
+            # Classes missing from the training labels get probability 0
+            probabilities[valid] = 0
+            probabilities[np.ix_(valid, classes)] = self.pipeline.predict_proba(embeddings[valid].astype(np.float32))
+        return probabilities
+
+    def save(self, head_path: str):
+        """Save the head with the backbone it was trained on."""
+        os.makedirs(os.path.dirname(os.path.abspath(head_path)), exist_ok=True)
+        joblib.dump({'kind': self.kind, 'model_id': self.model_id, 'C': self.C, 'hidden': self.hidden,
+                     'pipeline': self.pipeline, 'metrics': self.metrics}, head_path)
+        print(f"Saved {self.kind} head to {head_path}")
+
+    @classmethod
+    def load(cls, head_path: str) -> 'ProbeHead':
+        """Load a head saved by save."""
+        data = joblib.load(head_path)
+        head = cls(data['kind'], data['model_id'], data['C'], data['hidden'])
+        head.pipeline = data['pipeline']
+        head.metrics = data.get('metrics', {})
+        return head
+
+class ProbeEngine:
+    """Scores boxes from stored embeddings with a probe head, with the ScoringEngine interface"""
+
+    def __init__(self, store: EmbeddingStore, head: ProbeHead):
+
+        if head.model_id != store.model_id:
+            raise ValueError(f"Head was trained on embeddings of model {head.model_id}, "
+                             f"but {store.model_path} is {store.model_id}")
+        self.store = store
+        self.head = head
+
+    def score_folder(self, boxes_folder: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(filenames, cell_ids, probabilities) for a folder of box images."""
+        filenames, cell_ids, embeddings = self.store.embed_folder(boxes_folder)
+        return filenames, cell_ids, self.head.predict_proba(embeddings)
+
+    def score_store(self, crop_store) -> Tuple[np.ndarray, np.ndarray]:
+        """(cell_ids, probabilities) for a packed crop store."""
+        cell_ids, embeddings = self.store.embed_store(crop_store)
+        return cell_ids, self.head.predict_proba(embeddings)
+
+    def score_arrays(self, crops: np.ndarray, resized: bool = False) -> np.ndarray:
+        """Class probabilities for an in-memory batch of RGB crops."""
+        return self.head.predict_proba(self.store.embed(crops, resized=resized))
+
+def train_head(store: EmbeddingStore, dataset_folders: List[str], head_path: str, kind: str = "logistic",
+               C: float = 1.0, hidden: int = 256, val_fraction: float = 0.15, seed: int = 0) -> ProbeHead:
+    """
+    Train a probe head on labelled box datasets and report it against the fine-tuned ViT head.
+
+    Args:
+        store: Embedding store of the backbone
+        dataset_folders: Imagefolder box datasets with numbered class folders
+        head_path: Where to save the head
+        kind: "logistic" or "mlp"
+        C: Inverse regularisation strength of the logistic regression
+        hidden: Hidden units of the MLP
+        val_fraction: Share held out when a dataset has no test split
+        seed: Seed of the hold-out split
+
+    Returns:
+        The trained ProbeHead
+    """
+    paths, labels, held_out = [], [], []
+    for folder in dataset_folders:
+        folder_paths, folder_labels, folder_held_out = collect_boxes(folder)
+        paths += folder_paths
+        labels.append(folder_labels)
+        held_out.append(folder_held_out)
+    labels = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int64)
+    held_out = np.concatenate(held_out) if held_out else np.zeros(0, dtype=bool)
+
+    embeddings = store.embed_paths(paths)
+    usable = (labels >= 0) & ~np.isnan(embeddings).any(axis=1)
+    if not held_out.any():
+        held_out = np.random.default_rng(seed).random(len(paths)) < val_fraction
+    train_rows = np.flatnonzero(usable & ~held_out)
+    val_rows = np.flatnonzero(usable & held_out)
+    if not len(train_rows):
+        raise ValueError("No labelled boxes to train the head on")
+    print(f"Training {kind} head on {len(train_rows)} boxes, {len(val_rows)} held out")
+
+    start_time = time.time()
+    head = ProbeHead(kind, store.model_id, C, hidden).fit(embeddings[train_rows], labels[train_rows])
+    head.metrics = {'train_boxes': int(len(train_rows)), 'held_out_boxes': int(len(val_rows)),
+                    'training_seconds': time.time() - start_time}
+
+    if len(val_rows):
+        predictions = head.predict(embeddings[val_rows])
+        vit_predictions = store.vit_head_logits(embeddings[val_rows]).argmax(axis=1)
+        head.metrics.update({
+            'held_out_accuracy': float(np.mean(predictions == labels[val_rows])),
+            'vit_head_accuracy': float(np.mean(vit_predictions == labels[val_rows])),
+            'agreement_with_vit_head': float(np.mean(predictions == vit_predictions))
+        })
+        print(f"Held-out accuracy: head {head.metrics['held_out_accuracy']:.4f}, "
+              f"fine-tuned ViT {head.metrics['vit_head_accuracy']:.4f}, "
+              f"agreement {head.metrics['agreement_with_vit_head']:.4f}")
+    print(f"Trained in {head.metrics['training_seconds']:.2f} seconds")
+    head.save(head_path)
+    return head
+
+def embed_plate(store: EmbeddingStore, parent_directory: str):
+    """Embed every crop store and boxes folder of a plate ahead of scoring."""
+    for item in sorted(os.listdir(parent_directory)):
+        subfolder_path = os.path.join(parent_directory, item)
+        if not os.path.isdir(subfolder_path):
+            continue
+        crop_store = CropStore(subfolder_path, item)
+        boxes_path = os.path.join(subfolder_path, 'boxes')
+        try:
+            if crop_store.exists():
+                print(f"Embedding {item} (crop store)")
+                store.embed_store(crop_store)
+            elif os.path.isdir(boxes_path):
+                print(f"Embedding {item} (boxes folder)")
+                store.embed_folder(boxes_path)
+        except Exception as e:
+            print(f"Error embedding {item}: {str(e)}")
+    print(f"Embedding store holds {len(store)} crops: {store.folder}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache ViT box embeddings and train classifier heads on them")
+    parser.add_argument('command', choices=['embed', 'train'], help="embed a plate, or train a head")
+    parser.add_argument('folders', nargs='+', help="Plate folders to embed, or box datasets to train on")
+    parser.add_argument('--model', default="./Modelv1.4/Run3New", help="Fine-tuned ViT backbone")
+    parser.add_argument('--store', default=None, help="Embedding store root (default: <model>/embeddings)")
+    parser.add_argument('--head', default="./Modelv1.4/heads/probe.joblib", help="Head file to write")
+    parser.add_argument('--kind', choices=['logistic', 'mlp'], default='logistic')
+    parser.add_argument('--C', type=float, default=1.0, help="Inverse regularisation of the logistic head")
+    parser.add_argument('--hidden', type=int, default=256, help="Hidden units of the MLP head")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.model, args.store, batch_size=args.batch_size, num_workers=args.workers)
+    if args.command == 'embed':
+        for folder in args.folders:
+            embed_plate(store, folder)
+    else:
+        train_head(store, args.folders, args.head, args.kind, args.C, args.hidden)
@@ -0,0 +1,272 @@
+import os
+import csv
+import json
+import time
+import argparse
+import numpy as np
+from urllib.parse import quote
+from typing import Dict, List, Optional, Sequence, Union
+from PillarTable import PillarTable
+from BoxScores import entropy
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    ds = None
+    pq = None
+
+# One Parquet dataset per table under the warehouse root
+TABLES = ('boxes', 'pillars', 'nuclei', 'series')
+
+class ResultsWarehouse:
+    """Per-box scores, pillars, nuclei and series summaries as Parquet datasets partitioned by plate and series"""
+
+    def __init__(self, root: str):
+
+        if pa is None:
+            raise ImportError("The results warehouse needs pyarrow (pip install pyarrow)")
+        self.root = root
+
+    @staticmethod
+    def available() -> bool:
+        """Check that pyarrow is installed."""
+        return pa is not None
+
+    @staticmethod
+    def is_warehouse(folder: str) -> bool:
+        """Check whether a folder holds warehouse tables, so it is not mistaken for a series."""
+        for table in TABLES:
+            table_path = os.path.join(folder, table)
+            if os.path.isdir(table_path) and any(name.startswith('plate=') for name in os.listdir(table_path)):
+                return True
+        return False
+
+    def partition_path(self, table: str, plate: str, series: str) -> str:
+        """Hive-style plate=<plate>/series=<series> folder of one series."""
+        # Names are URI-encoded, as pyarrow decodes them when reading the partitions
+        return os.path.join(self.root, table, f"plate={quote(plate, safe='')}", f"series={quote(series, safe='')}")
+
+    def write(self, table: str, plate: str, series: str, columns: Dict[str, Union[np.ndarray, list]]):
+        """
+        Write the rows of one series to a table, replacing any earlier rows of that series.
+
+        Args:
+            table: One of TABLES
+            plate: Plate name
+            series: Series name
+            columns: Column name to values (arrays, lists or pyarrow arrays), all the same length
+        """
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}', expected one of {TABLES}")
+        folder = self.partition_path(table, plate, series)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "part-0.parquet")
+        # Dot-prefixed so a leftover from a crash is skipped when the dataset is read
+        tmp_path = os.path.join(folder, ".part-0.parquet.tmp")
+        pq.write_table(pa.table({name: values if isinstance(values, pa.Array) else pa.array(values)
+                                 for name, values in columns.items()}), tmp_path)
+        os.replace(tmp_path, path)
+
+    def write_boxes(self, plate: str, series: str, pillar_table: PillarTable, cell_ids: np.ndarray,
+                    probabilities: np.ndarray, model: str):
+        """
+        Per-box predictions, class probabilities and entropy, with the pillar coordinates joined on.
+
+        Args:
+            plate: Plate name
+            series: Series name
+            pillar_table: Pillars of the series
+            cell_ids: cell_id of each scored box
+            probabilities: NxC class probabilities of the boxes
+            model: Model that scored them
+        """
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        if probabilities.ndim != 2:
+            probabilities = probabilities.reshape(len(cell_ids), -1)
+        rows = pillar_table.rows(cell_ids)
+        found = rows >= 0
+        x = np.full(len(cell_ids), -1, dtype=np.int64)
+        y = np.full(len(cell_ids), -1, dtype=np.int64)
+        x[found] = pillar_table.x[rows[found]]
+        y[found] = pillar_table.y[rows[found]]
+        predicted = np.full(len(cell_ids), -1, dtype=np.int64)
+        if probabilities.shape[1]:
+            scored = ~np.isnan(probabilities).any(axis=1)
+            predicted[scored] = probabilities[scored].argmax(axis=1)
+
+        columns = {'cell_id': cell_ids, 'x': x, 'y': y, 'predicted_class': predicted}
+        for class_id in range(probabilities.shape[1]):
+            columns[f'prob_{class_id}'] = probabilities[:, class_id]
+        columns['entropy'] = entropy(probabilities) if probabilities.shape[1] else np.full(len(cell_ids), np.nan, np.float32)
+        columns['model'] = [model] * len(cell_ids)
+        self.write('boxes', plate, series, columns)
+
+    def write_pillars(self, plate: str, series: str, pillar_table: PillarTable):
+        """Pillar coordinates and any extra pillar columns of a series."""
+        columns = {'cell_id': pillar_table.cell_id, 'x': pillar_table.x, 'y': pillar_table.y}
+        columns.update(pillar_table.columns)
+        self.write('pillars', plate, series, columns)
+
+    def write_nuclei(self, plate: str, series: str, nuclei_props: List[dict]):
+        """Nuclei properties as written to *_nuclei_props.json."""
+        columns = {
+            'nuclei_id': np.array([n['nuclei_id'] for n in nuclei_props], dtype=np.int64),
+            'x_c': np.array([n['x_c'] for n in nuclei_props], dtype=np.int64),
+            'y_c': np.array([n['y_c'] for n in nuclei_props], dtype=np.int64),
+            'area': np.array([n['area'] for n in nuclei_props], dtype=np.float64),
+            'circularity': np.array([n['circularity'] for n in nuclei_props], dtype=np.float64)
+        }
+        self.write('nuclei', plate, series, columns)
+
+    def write_series(self, plate: str, series: str, summary: dict):
+        """
+        One summary row of a series, as in analysis_summary.csv.
+
+        Args:
+            plate: Plate name
+            series: Series name
+            summary: pillars_count, class_counts, processing_time and nuclei_count if known
+        """
+        nuclei_count = summary.get('nuclei_count')
+        columns = {
+            # Typed explicitly so series without a nuclei count still share one schema
+            'nuclei_count': pa.array([None if nuclei_count is None else int(nuclei_count)], type=pa.int64()),
+            'pillars_count': [int(summary['pillars_count'])],
+        }
+        for class_id, count in sorted(summary['class_counts'].items()):
+            columns[f'class_{class_id}_count'] = [int(count)]
+        columns['processing_time_seconds'] = [float(summary.get('processing_time', 0.0))]
+        columns['written_at'] = [time.time()]
+        self.write('series', plate, series, columns)
+
+    def dataset(self, table: str, partitions=None):
+        """
+        pyarrow dataset of a table, with plate and series read back from the partition folders.
+
+        Args:
+            table: One of TABLES
+            partitions: Expression on plate and series; only those files are opened to build the schema
+
+        Returns:
+            pyarrow dataset
+        """
+        partition_schema = pa.schema([('plate', pa.string()), ('series', pa.string())])
+        partitioning = ds.partitioning(partition_schema, flavor='hive')
+        dataset = ds.dataset(os.path.join(self.root, table), format='parquet', partitioning=partitioning)
+        # Series written with different options (thickness, ensembles, probe heads) have different columns,
+        # and the dataset would otherwise take its schema from the first file alone
+        fragments = dataset.get_fragments() if partitions is None else dataset.get_fragments(filter=partitions)
+        schemas = [fragment.physical_schema for fragment in fragments]
+        if not schemas:
+            return dataset
+        schema = pa.unify_schemas(schemas + [partition_schema], promote_options='permissive')
+        return ds.dataset(os.path.join(self.root, table), schema=schema, format='parquet', partitioning=partitioning)
+
+    def query(self, table: str, plates: Optional[Union[str, Sequence[str]]] = None,
+              series: Optional[Union[str, Sequence[str]]] = None, columns: Optional[List[str]] = None,
+              filter=None):
+        """
+        Load a table as a pandas DataFrame, reading only the matching partitions and columns.
+
+        Columns missing from some series, e.g. thickness when it was switched off, come back as nulls there.
+
+        Args:
+            table: One of TABLES
+            plates: Plate name(s) to load, default all
+            series: Series name(s) to load, default all
+            columns: Columns to load, default all; 'plate' and 'series' come from the partitions
+            filter: Extra pyarrow expression, e.g. ds.field('predicted_class') == 3
+
+        Returns:
+            pandas DataFrame, empty if the table has not been written yet
+        """
+        if not os.path.isdir(os.path.join(self.root, table)):
+            import pandas as pd
+            return pd.DataFrame(columns=columns or [])
+        partitions = None
+        for field, values in (('plate', plates), ('series', series)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            condition = ds.field(field).isin(values)
+            partitions = condition if partitions is None else partitions & condition
+        if partitions is None:
+            expression = filter
+        else:
+            expression = partitions if filter is None else partitions & filter
+        return self.dataset(table, partitions).to_table(columns=columns, filter=expression).to_pandas()
+
+    def ingest_plate(self, parent_directory: str, plate: Optional[str] = None):
+        """
+        Load the per-series JSON files and analysis_summary.csv of an already analysed plate.
+
+        Boxes are not ingested, as the JSON files hold no per-box probabilities.
+
+        Args:
+            parent_directory: Plate folder
+            plate: Plate name, defaults to the folder name
+        """
+        plate = plate or os.path.basename(os.path.normpath(parent_directory))
+        series_count = 0
+        for item in sorted(os.listdir(parent_directory)):
+            subfolder_path = os.path.join(parent_directory, item)
+            # The warehouse itself may live inside the plate folder
+            if not os.path.isdir(subfolder_path) or self.is_warehouse(subfolder_path):
+                continue
+            try:
+                pillar_table = PillarTable.load(subfolder_path, item)
+                if pillar_table is not None:
+                    wrapped_path = os.path.join(subfolder_path, f"{item}_wrapped_pillars.json")
+                    if os.path.exists(wrapped_path):
+                        with open(wrapped_path, 'r') as f:
+                            wrapped_ids = [p['cell_id'] for p in json.load(f)]
+                        pillar_table.join('wrapped', wrapped_ids, np.ones(len(wrapped_ids), dtype=bool), fill=False)
+                    self.write_pillars(plate, item, pillar_table)
+                for nuclei_path in (os.path.join(subfolder_path, 'nuclei_mip_nuclei_props.json'),
+                                    os.path.join(subfolder_path, f"{item}_nuclei_props.json")):
+                    if os.path.exists(nuclei_path):
+                        with open(nuclei_path, 'r') as f:
+                            self.write_nuclei(plate, item, json.load(f))
+                        break
+                series_count += 1
+            except Exception as e:
+                print(f"Error ingesting {item}: {str(e)}")
+
+        summary_path = os.path.join(parent_directory, "analysis_summary.csv")
+        if os.path.exists(summary_path):
+            with open(summary_path, 'r', newline='') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    try:
+                        self.write_series(plate, row['subfolder_name'], {
+                            # Left empty when a series had no nuclei file
+                            'nuclei_count': row['nuclei_count'] or None,
+                            'pillars_count': row['pillars_count'],
+                            'class_counts': {c: row[f'class_{c}_count'] for c in range(4)},
+                            'processing_time': float(row['processing_time_seconds'] or 0.0)
+                        })
+                    except (KeyError, TypeError, ValueError) as e:
+                        print(f"Error ingesting summary row {row.get('subfolder_name')}: {str(e)}")
+        print(f"Ingested {series_count} series of {plate} into {self.root}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parquet warehouse of scoring results")
+    parser.add_argument('command', choices=['ingest', 'query'], help="ingest plate folders, or print a table")
+    parser.add_argument('targets', nargs='+', help="Plate folders to ingest, or the table to query")
+    parser.add_argument('--root', required=True, help="Warehouse folder")
+    parser.add_argument('--plate', nargs='*', default=None, help="Only these plates (query)")
+    parser.add_argument('--series', nargs='*', default=None, help="Only these series (query)")
+    args = parser.parse_args()
+
+    warehouse = ResultsWarehouse(args.root)
+    if args.command == 'ingest':
+        for parent_directory in args.targets:
+            warehouse.ingest_plate(parent_directory)
+    else:
+        start_time = time.time()
+        frame = warehouse.query(args.targets[0], args.plate, args.series)
+        print(frame)
+        print(f"{len(frame)} rows in {time.time() - start_time:.3f} seconds")
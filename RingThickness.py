@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+from skimage.morphology import skeletonize
+from skimage.measure import label, regionprops
+from typing import Dict, Optional, Tuple
+from PillarDetector import REFERENCE_UM_PER_PIXEL
+
+# Microns per pixel the mask parameters were tuned at (2048 px wide MIPs); series can differ
+PIXEL_SIZE_UM = REFERENCE_UM_PER_PIXEL
+# HSV range of the cyan MBP stain
+LOWER_CYAN = np.array([50, 40, 40])
+UPPER_CYAN = np.array([100, 255, 255])
+
+def ring_masks(image: np.ndarray, max_centre_distance: float = 25, min_area: float = 50,
+               min_contour_area: float = 10,
+               pixel_size: float = PIXEL_SIZE_UM) -> Tuple[np.ndarray, np.ndarray, Optional[float]]:
+    """
+    Isolate the myelin ring around the centre of a box crop and trace its skeleton.
+
+    Distances and areas are given in pixels at PIXEL_SIZE_UM and scaled to the crop's pixel size,
+    as the box size is.
+
+    Args:
+        image: BGR box crop
+        max_centre_distance: Furthest a stained region's centroid may be from the crop centre, in pixels
+        min_area: Smallest stained region kept, in pixels
+        min_contour_area: Smallest region kept after intensity thresholding, in pixels
+        pixel_size: Microns per pixel of the crop
+
+    Returns:
+        (ring mask, skeleton of its largest component, intensity threshold or None if no ring pixels)
+    """
+    scale = PIXEL_SIZE_UM / pixel_size
+    max_centre_distance *= scale
+    min_area *= scale ** 2
+    min_contour_area *= scale ** 2
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    cyan_mask = cv2.inRange(hsv, LOWER_CYAN, UPPER_CYAN)
+
+    # Denoise
+    kernel = np.ones((3, 3), np.uint8)
+    cyan_mask = cv2.morphologyEx(cyan_mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    contours, _ = cv2.findContours(cyan_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    h, w = cyan_mask.shape
+    image_center = np.array([w / 2, h / 2])
+    ring_mask = np.zeros_like(cyan_mask)
+    for c in contours:
+        if cv2.contourArea(c) < min_area:
+            continue
+        # Keep stained regions whose centroid is close enough to the crop centre
+        M = cv2.moments(c)
+        if M["m00"] == 0:
+            continue
+        centroid = np.array([M["m10"] / M["m00"], M["m01"] / M["m00"]])
+        if np.linalg.norm(centroid - image_center) <= max_centre_distance:
+            cv2.drawContours(ring_mask, [c], -1, 255, thickness=cv2.FILLED)
+
+    # Keep the ring pixels at least as bright as the ring's mean intensity
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    ring_pixels = gray[ring_mask == 255]
+    intensity_threshold = None
+    if len(ring_pixels) > 0:
+        intensity_threshold = float(np.mean(ring_pixels))
+        enhanced_ring_mask = np.zeros_like(gray)
+        enhanced_ring_mask[(gray >= intensity_threshold) & (ring_mask == 255)] = 255
+    else:
+        enhanced_ring_mask = ring_mask.copy()
+
+    # Denoise
+    enhanced_ring_mask = cv2.morphologyEx(enhanced_ring_mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    enhanced_ring_mask = cv2.morphologyEx(enhanced_ring_mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+
+    # Remove small noise components
+    contours, _ = cv2.findContours(enhanced_ring_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        if cv2.contourArea(contour) < min_contour_area:
+            cv2.drawContours(enhanced_ring_mask, [contour], -1, 0, thickness=cv2.FILLED)
+
+    skeleton = skeletonize(enhanced_ring_mask.astype(bool)).astype(np.uint8) * 255
+    labeled = label(skeleton > 0, connectivity=2)
+    props = regionprops(labeled)
+    if props:
+        largest_label = max(props, key=lambda x: x.area).label
+        skeleton = (labeled == largest_label).astype(np.uint8) * 255
+    return enhanced_ring_mask, skeleton, intensity_threshold
+
+def measure_ring(image: np.ndarray, rgb: bool = True, pixel_size: float = PIXEL_SIZE_UM,
+                 masks: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[str, float]:
+    """
+    Ring thickness and area of one box crop, as measured by ThicknessRev2.py.
+
+    Thickness is twice the distance from the skeleton to the ring edge, sampled along the skeleton.
+
+    Args:
+        image: Box crop
+        rgb: The crop is RGB, as in crop stores and the scorer; False for BGR from cv2.imread
+        pixel_size: Microns per pixel of the crop, e.g. from the series pixel_size.json
+        masks: (ring mask, skeleton) from ring_masks, to skip recomputing them
+
+    Returns:
+        thickness_mean_um, thickness_std_um (0 without a ring) and ring_area_um2
+    """
+    if masks is None:
+        masks = ring_masks(cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if rgb else image, pixel_size=pixel_size)[:2]
+    ring_mask, skeleton = masks
+    dist_transform = cv2.distanceTransform(ring_mask, cv2.DIST_L2, 3)
+    thickness_values = dist_transform[skeleton == 255] * 2
+    return {
+        'thickness_mean_um': float(pixel_size * np.mean(thickness_values)) if len(thickness_values) else 0.0,
+        'thickness_std_um': float(pixel_size * np.std(thickness_values)) if len(thickness_values) else 0.0,
+        'ring_area_um2': float(np.sum(ring_mask > 0) * pixel_size ** 2)
+    }
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+from typing import Dict, List, Optional
+
+class RunJournal:
+    """Append-only record of finished series, so an interrupted plate run can resume"""
+
+    def __init__(self, parent_directory: str, settings: dict, name: str = "analysis_journal.jsonl"):
+
+        self.path = os.path.join(parent_directory, name)
+        # Results are only reused by a run with the same model and mode
+        self.settings = settings
+        self.results = {}
+
+    def read(self) -> Optional[Dict[str, dict]]:
+        """
+        Series results recorded by an earlier run with the same settings.
+
+        A torn last line from a crash mid-write is ignored, so that series is run again.
+
+        Returns:
+            Results keyed by series name, or None if there is no usable journal
+        """
+        if not os.path.exists(self.path):
+            return None
+        results = {}
+        with open(self.path, 'r') as f:
+            lines = f.read().splitlines()
+        for number, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Ignoring incomplete journal line {number + 1} in {self.path}")
+                continue
+            if record.get('type') == 'run':
+                if record['settings'] != self.settings:
+                    print(f"Journal {self.path} was written with different settings, not resuming")
+                    return None
+            elif record.get('type') == 'series':
+                results[record['series']] = self.decode(record['result'])
+        return results
+
+    def start(self, previous: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+        """
+        Open the journal for this run.
+
+        Args:
+            previous: Results from read() to carry over, None to start afresh
+
+        Returns:
+            Results of series that are already complete
+        """
+        records = [{'type': 'run', 'settings': self.settings, 'started': time.time()}]
+        self.results = dict(previous or {})
+        # Rewritten without any torn line, so new records start on a clean line
+        records += [{'type': 'series', 'series': s, 'result': r} for s, r in self.results.items()]
+        self.write_atomic(records)
+        return dict(self.results)
+
+    def write_atomic(self, records: List[dict]):
+        """Replace the journal with the given records."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record(self, series: str, result: dict):
+        """
+        Commit one finished series to disk before the next one starts.
+
+        Args:
+            series: Series name
+            result: Its result (class counts, wrapped pillars, timing, ...)
+        """
+        # One write of a whole line, flushed and synced, so a crash leaves at most a torn last line
+        line = json.dumps({'type': 'series', 'series': series, 'result': result}) + "\n"
+        with open(self.path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.results[series] = result
+
+    def decode(self, result: dict) -> dict:
+        """JSON object keys are strings; class counts are keyed by class id."""
+        if 'class_counts' in result:
+            result['class_counts'] = {int(class_id): count for class_id, count in result['class_counts'].items()}
+        for model_result in (result.get('model_results') or {}).values():
+            self.decode(model_result)
+        return result
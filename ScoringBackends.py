@@ -0,0 +1,161 @@
+import os
+import argparse
+import torch
+from types import SimpleNamespace
+from typing import Optional, Sequence
+from StudentModel import StudentClassifier, StudentProcessor, CONFIG_NAME
+from ScoringEngine import EnsembleEngine, processor_settings
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# "vit" and "student" run in PyTorch, "quantised" is either with int8 Linear layers on the CPU,
+# and "onnx" runs model.onnx exported from either with onnxruntime
+BACKENDS = ("vit", "student", "quantised", "onnx")
+ONNX_NAME = "model.onnx"
+
+class OnnxClassifier(torch.nn.Module):
+    """Exported classifier run by onnxruntime, called like the PyTorch models"""
+
+    def __init__(self, onnx_path: str, providers: Optional[Sequence[str]] = None):
+
+        super().__init__()
+        if ort is None:
+            raise ImportError("The ONNX backend needs onnxruntime (pip install onnxruntime)")
+        # GPU when the onnxruntime build has it, else CPU
+        self.session = ort.InferenceSession(onnx_path, providers=list(providers or ort.get_available_providers()))
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, pixel_values: torch.Tensor) -> SimpleNamespace:
+        pixel_values = pixel_values.detach().cpu().float().contiguous().numpy()
+        logits = self.session.run(None, {self.input_name: pixel_values})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+class LogitsOnly(torch.nn.Module):
+    """Wraps a classifier so it returns a plain logits tensor, for export"""
+
+    def __init__(self, model: torch.nn.Module):
+
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model(pixel_values=pixel_values).logits
+
+def base_backend(model_path: str) -> str:
+    """PyTorch backend of a model folder: "student" for a distilled student, else "vit"."""
+    return "student" if os.path.exists(os.path.join(model_path, CONFIG_NAME)) else "vit"
+
+def backend_device(backend: str) -> torch.device:
+    """Device to feed a backend; quantised and ONNX models take their inputs on the CPU."""
+    if backend in ("vit", "student") and torch.cuda.is_available():
+        return torch.device("cuda")
+    return torch.device("cpu")
+
+def quantise(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantisation of the Linear layers, which hold most of the ViT's compute."""
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_pytorch(model_path: str, backend: str):
+    """Classifier and processor of the "vit" or "student" PyTorch backend."""
+    if backend == "student":
+        return StudentClassifier.from_pretrained(model_path), StudentProcessor.from_pretrained(model_path)
+    from transformers import ViTImageProcessor, ViTForImageClassification
+    return ViTForImageClassification.from_pretrained(model_path), ViTImageProcessor.from_pretrained(model_path)
+
+def load_processor(model_path: str):
+    """Processor of a model folder, for backends that do not load the PyTorch model."""
+    if base_backend(model_path) == "student":
+        return StudentProcessor.from_pretrained(model_path)
+    from transformers import ViTImageProcessor
+    return ViTImageProcessor.from_pretrained(model_path)
+
+def load_backend(model_path: str, backend: str = "vit"):
+    """
+    Load the classifier and processor for any scoring backend.
+
+    Args:
+        model_path: Model folder
+        backend: One of BACKENDS
+
+    Returns:
+        (model, processor)
+    """
+    if backend in ("vit", "student"):
+        return load_pytorch(model_path, backend)
+    if backend == "quantised":
+        model, processor = load_pytorch(model_path, base_backend(model_path))
+        return quantise(model), processor
+    if backend == "onnx":
+        onnx_path = os.path.join(model_path, ONNX_NAME)
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"{onnx_path} not found, export it with: python ScoringBackends.py {model_path}")
+        return OnnxClassifier(onnx_path), load_processor(model_path)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+def export_onnx(model_path: str, output_path: Optional[str] = None, opset: int = 17) -> str:
+    """
+    Export a ViT or student model to ONNX for the "onnx" backend.
+
+    Args:
+        model_path: Model folder
+        output_path: ONNX file, default model.onnx in the model folder
+        opset: ONNX opset version
+
+    Returns:
+        Path of the ONNX file
+    """
+    output_path = output_path or os.path.join(model_path, ONNX_NAME)
+    model, processor = load_pytorch(model_path, base_backend(model_path))
+    size = processor.size
+    side = size.get("height", size.get("shortest_edge", 224)) if isinstance(size, dict) else int(size)
+    dummy = torch.zeros(1, 3, side, side)
+    # Batch size stays dynamic, so the scorer's batches of any size can be fed
+    torch.onnx.export(LogitsOnly(model.eval()).float(), (dummy,), output_path, input_names=["pixel_values"],
+                      output_names=["logits"], opset_version=opset, dynamo=False,
+                      dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}})
+    print(f"Exported {model_path} to {output_path}")
+    return output_path
+
+def load_ensemble(model_paths: Sequence[str], device, backend: str = "vit", batch_size: int = 32,
+                  num_workers: Optional[int] = None, aggregate: str = "mean") -> EnsembleEngine:
+    """
+    Load several models into one EnsembleEngine.
+
+    Args:
+        model_paths: Model folders, all with the same preprocessing
+        device: Device to run the models on
+        backend: Backend of every model, as in load_backend
+        batch_size: Crops per batch
+        num_workers: DataLoader workers
+        aggregate: "mean" of the logits, or majority "vote"
+
+    Returns:
+        EnsembleEngine, its models named after their folders
+    """
+    models = {}
+    processor = None
+    for model_path in model_paths:
+        model, model_processor = load_backend(model_path, backend)
+        # Crops are preprocessed once per batch, so every model must expect the same input
+        if processor is None:
+            processor = model_processor
+        elif processor_settings(model_processor) != processor_settings(processor):
+            raise ValueError(f"{model_path} preprocesses crops differently from {model_paths[0]}, "
+                             f"so it cannot share batches with it")
+        name = os.path.basename(os.path.normpath(model_path))
+        if name in models:
+            name = f"{name}_{len(models)}"
+        models[name] = model.to(device)
+    return EnsembleEngine(models, processor, device, batch_size, num_workers, aggregate)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a ViT or student model for the ONNX scoring backend")
+    parser.add_argument('model_path', help="Model folder")
+    parser.add_argument('--output', default=None, help="ONNX file (default: <model>/model.onnx)")
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+
+    export_onnx(args.model_path, args.output, args.opset)
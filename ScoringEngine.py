@@ -0,0 +1,259 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from typing import Callable, Dict, List, Optional, Tuple
+
+def parse_cell_id(filename: str) -> int:
+    """cell_id from a box_{i}.png name, -1 if it has none."""
+    try:
+        return int(filename.split('_')[1].split('.')[0])
+    except (IndexError, ValueError):
+        return -1
+
+class BoxImageDataset(Dataset):
+    """Box PNGs decoded and preprocessed in the loader workers"""
+
+    def __init__(self, image_paths: List[str], processor):
+
+        self.image_paths = image_paths
+        self.processor = processor
+
+    def __len__(self) -> int:
+        return len(self.image_paths)
+
+    def __getitem__(self, index: int):
+        image_path = self.image_paths[index]
+        try:
+            # Boxes may be saved as RGBA or greyscale; the model expects RGB
+            with Image.open(image_path) as image:
+                pixel_values = self.processor(images=image.convert('RGB'), return_tensors="pt")["pixel_values"][0]
+            return pixel_values, True, ""
+        except Exception as e:
+            return torch.zeros(0), False, f"Error processing {os.path.basename(image_path)}: {str(e)}"
+
+class CropArrayDataset(Dataset):
+    """Crops from an array or a packed crop store, preprocessed in the loader workers"""
+
+    def __init__(self, processor, crops: Optional[np.ndarray] = None, crops_path: Optional[str] = None,
+                 resized: bool = False):
+
+        self.processor = processor
+        # Workers re-open the store by path instead of receiving a pickled copy of it
+        self.crops = crops
+        self.crops_path = crops_path
+        self.resized = resized
+
+    def get_crops(self) -> np.ndarray:
+        if self.crops is None:
+            self.crops = np.load(self.crops_path, mmap_mode='r')
+        return self.crops
+
+    def __len__(self) -> int:
+        return len(self.get_crops())
+
+    def __getitem__(self, index: int):
+        try:
+            crop = np.asarray(self.get_crops()[index])
+            if crop.ndim == 2:
+                crop = np.repeat(crop[..., None], 3, axis=2)
+            pixel_values = self.processor(images=crop, do_resize=not self.resized,
+                                          return_tensors="pt")["pixel_values"][0]
+            return pixel_values, True, ""
+        except Exception as e:
+            return torch.zeros(0), False, f"Error processing crop {index}: {str(e)}"
+
+def collate_boxes(items):
+    """Stack the boxes that loaded and keep the errors of those that did not."""
+    valid = [i for i, item in enumerate(items) if item[1]]
+    pixel_values = torch.stack([items[i][0] for i in valid]) if valid else None
+    errors = [item[2] for item in items if not item[1]]
+    return pixel_values, valid, errors
+
+class ScoringEngine:
+    """Batched box classification with decoding and preprocessing in DataLoader workers"""
+
+    def __init__(self, model, processor, device, batch_size: int = 32, num_workers: Optional[int] = None):
+
+        self.model = model
+        self.processor = processor
+        self.device = device
+        self.batch_size = batch_size
+        self.num_workers = min(4, os.cpu_count() or 1) if num_workers is None else num_workers
+
+    def outputs(self, dataset: Dataset, forward: Callable[[torch.Tensor], torch.Tensor]) -> np.ndarray:
+        """
+        Run a forward function over every item of a dataset in batches.
+
+        Args:
+            dataset: Dataset yielding (pixel_values, ok, error)
+            forward: Maps a batch of pixel_values to an NxD output tensor
+
+        Returns:
+            NxD float32 outputs, NaN rows for items that failed to load
+        """
+        outputs = None
+        workers = self.num_workers if len(dataset) > self.batch_size else 0
+        loader = DataLoader(dataset, batch_size=self.batch_size, num_workers=workers,
+                            collate_fn=collate_boxes, pin_memory=self.device.type == "cuda")
+
+        self.model.eval()
+        start = 0
+        with torch.no_grad():
+            for pixel_values, valid, errors in loader:
+                for error in errors:
+                    print(error)
+                if pixel_values is not None:
+                    batch_outputs = forward(pixel_values.to(self.device, non_blocking=True))
+                    if outputs is None:
+                        outputs = np.full((len(dataset), batch_outputs.shape[-1]), np.nan, dtype=np.float32)
+                    outputs[start + np.asarray(valid)] = batch_outputs.float().cpu().numpy()
+                start += len(valid) + len(errors)
+        if outputs is None:
+            outputs = np.full((len(dataset), 0), np.nan, dtype=np.float32)
+        return outputs
+
+    def logits(self, dataset: Dataset) -> np.ndarray:
+        """Raw class logits for every item, NaN rows for items that failed to load."""
+        return self.outputs(dataset, lambda pixel_values: self.model(pixel_values=pixel_values).logits)
+
+    def embeddings(self, dataset: Dataset) -> np.ndarray:
+        """ViT CLS embeddings (the classifier head input) for every item, NaN rows for failures."""
+        return self.outputs(dataset, lambda pixel_values: self.model.vit(pixel_values=pixel_values).last_hidden_state[:, 0])
+
+    def probabilities(self, dataset: Dataset) -> np.ndarray:
+        """
+        Softmax class probabilities for every item of a dataset.
+
+        Args:
+            dataset: Dataset yielding (pixel_values, ok, error)
+
+        Returns:
+            NxC float32 probabilities, NaN rows for items that failed to load
+        """
+        logits = self.logits(dataset)
+        if not logits.shape[1]:
+            return logits
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return (exp / exp.sum(axis=1, keepdims=True)).astype(np.float32)
+
+    @staticmethod
+    def predict(probabilities: np.ndarray) -> np.ndarray:
+        """Most probable class per row, -1 for NaN rows."""
+        predictions = np.full(len(probabilities), -1, dtype=np.int64)
+        if probabilities.shape[1]:
+            scored = ~np.isnan(probabilities).any(axis=1)
+            predictions[scored] = probabilities[scored].argmax(axis=1)
+        return predictions
+
+    def run(self, dataset: Dataset) -> np.ndarray:
+        """Predicted class per item, -1 for items that failed to load."""
+        return self.predict(self.logits(dataset))
+
+    def score_folder(self, boxes_folder: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Classify the box images of a folder.
+
+        Args:
+            boxes_folder: Folder of box_{i}.png images
+
+        Returns:
+            (filenames, cell_ids, probabilities), cell_id -1 where the name has no box number
+        """
+        filenames = [f for f in sorted(os.listdir(boxes_folder))
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        dataset = BoxImageDataset([os.path.join(boxes_folder, f) for f in filenames], self.processor)
+        cell_ids = np.array([parse_cell_id(f) for f in filenames], dtype=np.int64)
+        return filenames, cell_ids, self.probabilities(dataset)
+
+    def score_store(self, crop_store) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify the crops of a packed crop store.
+
+        Args:
+            crop_store: CropStore
+
+        Returns:
+            (cell_ids, probabilities)
+        """
+        _, index = crop_store.load()
+        cell_ids = np.array([entry['cell_id'] for entry in index], dtype=np.int64)
+        return cell_ids, self.probabilities(CropArrayDataset(self.processor, crops_path=crop_store.crops_path))
+
+    def score_arrays(self, crops: np.ndarray, resized: bool = False) -> np.ndarray:
+        """
+        Classify an in-memory batch of RGB crops.
+
+        Args:
+            crops: NxHxWx3 uint8 crops
+            resized: Crops are already at the model input size
+
+        Returns:
+            NxC class probabilities
+        """
+        return self.probabilities(CropArrayDataset(self.processor, crops=crops, resized=resized))
+
+# Processor settings that must match for models to share preprocessed batches
+PROCESSOR_SETTINGS = ["size", "resample", "do_resize", "do_rescale", "rescale_factor",
+                      "do_normalize", "image_mean", "image_std"]
+
+def processor_settings(processor) -> dict:
+    """The preprocessing a processor applies, for comparing models' processors."""
+    settings = {name: getattr(processor, name, None) for name in PROCESSOR_SETTINGS}
+    return {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in settings.items()}
+
+class EnsembleEngine(ScoringEngine):
+    """Several classifiers scoring the same decoded and preprocessed batches in one pass"""
+
+    def __init__(self, models: Dict[str, torch.nn.Module], processor, device, batch_size: int = 32,
+                 num_workers: Optional[int] = None, aggregate: str = "mean"):
+
+        if aggregate not in ("mean", "vote"):
+            raise ValueError(f"Unknown aggregate '{aggregate}', expected 'mean' or 'vote'")
+        super().__init__(torch.nn.ModuleList(models.values()), processor, device, batch_size, num_workers)
+        self.names = list(models)
+        # "mean" averages the logits; "vote" takes the share of models voting for each class
+        self.aggregate = aggregate
+        # NxMxC probabilities of each model from the last scoring call, aligned with its result
+        self.last_model_probabilities = None
+
+    def model_logits(self, dataset: Dataset) -> np.ndarray:
+        """
+        Logits of every model, each batch preprocessed once and passed to all of them.
+
+        Returns:
+            NxMxC float32 logits, NaN rows for items that failed to load
+        """
+        logits = self.outputs(dataset, lambda pixel_values: torch.cat(
+            [model(pixel_values=pixel_values).logits for model in self.model], dim=-1))
+        return logits.reshape(len(dataset), len(self.names), logits.shape[1] // len(self.names))
+
+    def probabilities(self, dataset: Dataset) -> np.ndarray:
+        """
+        Aggregated class probabilities; each model's own are kept in last_model_probabilities.
+
+        With "vote", the values are vote shares and ties go to the lower class.
+
+        Returns:
+            NxC float32 probabilities, NaN rows for items that failed to load
+        """
+        logits = self.model_logits(dataset)
+        if not logits.shape[2]:
+            self.last_model_probabilities = logits
+            return logits[:, 0]
+        exp = np.exp(logits - logits.max(axis=2, keepdims=True))
+        self.last_model_probabilities = (exp / exp.sum(axis=2, keepdims=True)).astype(np.float32)
+
+        if self.aggregate == "mean":
+            mean_logits = logits.mean(axis=1)
+            exp = np.exp(mean_logits - mean_logits.max(axis=1, keepdims=True))
+            return (exp / exp.sum(axis=1, keepdims=True)).astype(np.float32)
+
+        scored = ~np.isnan(logits).any(axis=(1, 2))
+        votes = np.full(logits.shape[::2], np.nan, dtype=np.float32)
+        votes[scored] = 0
+        choices = logits[scored].argmax(axis=2)
+        for model_index in range(len(self.names)):
+            votes[np.flatnonzero(scored), choices[:, model_index]] += 1.0 / len(self.names)
+        return votes
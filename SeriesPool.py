@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import traceback
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+def limit_worker_threads():
+    """Keep each worker to one OpenCV thread so the pool doesn't oversubscribe the cores."""
+    cv2.setNumThreads(1)
+
+class SeriesPool:
+    """Runs one headless job per series over a process pool, isolating failures per series"""
+
+    def __init__(self, workers: Optional[int] = None):
+
+        self.workers = workers or os.cpu_count() or 1
+
+    def run(self, worker: Callable[..., dict], tasks: Dict[str, tuple]) -> List[dict]:
+        """
+        Run worker(*args) for every series.
+
+        Workers return a result dict with at least 'series' and 'status'. A worker
+        that raises, or a crashed worker process, gives an 'error' result for its
+        series instead of stopping the batch.
+
+        Args:
+            worker: Module-level function to run in each process
+            tasks: Mapping of series name to the worker arguments
+
+        Returns:
+            Result dicts sorted by series name
+        """
+        results = []
+        start_time = time.time()
+
+        if self.workers == 1 or len(tasks) <= 1:
+            for series, args in tasks.items():
+                results.append(self.call(worker, series, args))
+                self.report(results[-1], len(results), len(tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks)),
+                                     initializer=limit_worker_threads) as pool:
+                futures = {pool.submit(worker, *args): series for series, args in tasks.items()}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = self.error_result(futures[future], e)
+                    results.append(result)
+                    self.report(result, len(results), len(tasks))
+
+        print(f"Finished {len(tasks)} series in {time.time() - start_time:.2f} seconds")
+        return sorted(results, key=lambda r: r['series'])
+
+    def call(self, worker: Callable[..., dict], series: str, args: tuple) -> dict:
+        """Run one series in this process."""
+        try:
+            return worker(*args)
+        except Exception as e:
+            return self.error_result(series, e)
+
+    def error_result(self, series: str, error: Exception) -> dict:
+        """Result for a series whose worker raised."""
+        return {
+            'series': series,
+            'status': 'error',
+            'error': f"{type(error).__name__}: {error}",
+            'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+        }
+
+    def report(self, result: dict, done: int, total: int):
+        """Print one line per finished series."""
+        mark = "✓" if result['status'] == 'ok' else "✗"
+        detail = result.get('error') or result.get('message', result['status'])
+        print(f"[{done}/{total}] {mark} {result['series']}: {detail}")
+
+    def save_results(self, results: List[dict], output_path: str):
+        """Save the per-series results next to the plate."""
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved per-series results to {output_path}")
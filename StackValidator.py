@@ -1,4 +1,7 @@
 import os
+import re
+import sys
+import json
 import time
 import shutil
 from PIL import Image
@@ -6,9 +9,14 @@ import torch
 from transformers import ViTImageProcessor, ViTForImageClassification
 from tkinter import Tk, filedialog, messagebox
 
+# Per-plane validity written next to the planes, read by MIP.FolderProcessor
+MANIFEST_NAME = "validation_manifest.json"
+
 class StackValidator:
-    def __init__(self, model_path):
+    def __init__(self, model_path, move_files=True):
         self.model_path = model_path
+        # With move_files=False planes stay in place and only the manifest records validity
+        self.move_files = move_files
         # Don't load model here - wait for user selection
         self.model = None
         self.processor = None
@@ -41,8 +49,9 @@ class StackValidator:
         # Create output directories within the subfolder
         valid_dir = os.path.join(subfolder_path, "valid")
         invalid_dir = os.path.join(subfolder_path, "invalid")
-        os.makedirs(valid_dir, exist_ok=True)
-        os.makedirs(invalid_dir, exist_ok=True)
+        if self.move_files:
+            os.makedirs(valid_dir, exist_ok=True)
+            os.makedirs(invalid_dir, exist_ok=True)
         
         # Get all PNG files in the subfolder
         png_files = [f for f in os.listdir(subfolder_path) 
@@ -56,48 +65,60 @@ class StackValidator:
         
         # Process images
         results = {"valid": 0, "invalid": 0, "total": len(png_files)}
-        processed_count = 0
+        manifest = []
         
         for img_file in png_files:
-            try:
-                img_path = os.path.join(subfolder_path, img_file)
-                predicted_class, confidence = self.predict_image(img_path)
-                
-                if predicted_class is not None:
-                    class_name = self.class_labels.get(predicted_class, "unknown")
-                    
-                    # Move image to appropriate folder
-                    if class_name == "valid":
-                        destination = os.path.join(valid_dir, img_file)
-                        results["valid"] += 1
-                    else:  # invalid or unknown
-                        destination = os.path.join(invalid_dir, img_file)
-                        results["invalid"] += 1
-                    
-                    shutil.move(img_path, destination)
-                    processed_count += 1
-                    
-                    print(f"      {img_file}: {class_name} (confidence: {confidence:.3f})")
-                else:
-                    # If prediction failed, move to invalid folder
-                    destination = os.path.join(invalid_dir, img_file)
-                    shutil.move(img_path, destination)
-                    results["invalid"] += 1
-                    print(f"      {img_file}: prediction failed - moved to invalid")
-                    
-            except Exception as e:
-                print(f"    Error processing {img_file}: {str(e)}")
-                # Move problematic files to invalid folder
+            img_path = os.path.join(subfolder_path, img_file)
+            predicted_class, confidence = self.predict_image(img_path)
+            
+            if predicted_class is not None:
+                class_name = self.class_labels.get(predicted_class, "unknown")
+                print(f"      {img_file}: {class_name} (confidence: {confidence:.3f})")
+            else:
+                # If prediction failed, treat the plane as invalid
+                class_name = "invalid"
+                print(f"      {img_file}: prediction failed - marked invalid")
+            
+            is_valid = class_name == "valid"
+            results["valid" if is_valid else "invalid"] += 1
+            
+            # Move image to appropriate folder
+            relative_file = img_file
+            if self.move_files:
+                target_dir = "valid" if is_valid else "invalid"
                 try:
-                    destination = os.path.join(invalid_dir, img_file)
-                    shutil.move(os.path.join(subfolder_path, img_file), destination)
-                    results["invalid"] += 1
-                except:
-                    pass
+                    shutil.move(img_path, os.path.join(subfolder_path, target_dir, img_file))
+                    relative_file = f"{target_dir}/{img_file}"
+                except OSError as e:
+                    print(f"    Error moving {img_file}: {str(e)}")
+            
+            manifest.append({
+                "file": relative_file,
+                "z": self.parse_z_index(img_file),
+                "valid": is_valid,
+                "confidence": confidence
+            })
+        
+        self.save_manifest(subfolder_path, manifest)
         
         print(f"    {folder_type} folder complete: {results['valid']} valid, {results['invalid']} invalid")
         return results
 
+    def parse_z_index(self, filename):
+        """Read the z index from an extracted plane name (..._z<z>_t<t>.png)"""
+        match = re.search(r'_z(\d+)', filename)
+        return int(match.group(1)) if match else None
+
+    def save_manifest(self, subfolder_path, manifest):
+        """Save per-plane validity so the MIP stage can read only the valid planes"""
+        manifest = sorted(manifest, key=lambda p: (p["z"] is None, p["z"] or 0, p["file"]))
+        manifest_path = os.path.join(subfolder_path, MANIFEST_NAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"planes": manifest}, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+        print(f"    Saved validation manifest: {manifest_path}")
+
     def process_root_folder(self, parent_folder):
         """Process the parent folder and find all mbp and pillar subfolders recursively"""
         print(f"\nScanning parent folder: {parent_folder}")
@@ -205,7 +226,8 @@ class StackValidator:
                 f"Total valid images: {results['valid']}\n"
                 f"Total invalid images: {results['invalid']}\n"
                 f"Total images processed: {results['total']}\n\n"
-                f"Images have been moved into 'valid' and 'invalid' subfolders\n"
+                + (f"Images have been moved into 'valid' and 'invalid' subfolders\n" if self.move_files else "")
+                + f"Per-plane results are saved to {MANIFEST_NAME}\n"
                 f"within each found 'mbp' and 'pillar' folder."
             )
             
@@ -217,7 +239,7 @@ class StackValidator:
 
 if __name__ == "__main__":
     try:
-        validator = StackValidator(None)
+        validator = StackValidator(None, move_files='--no-move' not in sys.argv)
         validator.run_validation()
 
     except Exception as e:
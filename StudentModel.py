@@ -0,0 +1,159 @@
+import os
+import json
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from types import SimpleNamespace
+from typing import Dict, Optional, Sequence
+
+CONFIG_NAME = "student_config.json"
+WEIGHTS_NAME = "student.pt"
+
+class StudentInputs(dict):
+    """Processor output that moves to a device like a transformers BatchFeature"""
+
+    def to(self, device) -> 'StudentInputs':
+        return StudentInputs({name: value.to(device) for name, value in self.items()})
+
+class StudentProcessor:
+    """Resizes and normalises crops for the student, with the ViTImageProcessor call signature"""
+
+    def __init__(self, input_size: int = 112, image_mean: Sequence[float] = (0.5, 0.5, 0.5),
+                 image_std: Sequence[float] = (0.5, 0.5, 0.5)):
+
+        self.input_size = input_size
+        self.size = {"height": input_size, "width": input_size}
+        self.image_mean = np.asarray(image_mean, dtype=np.float32)
+        self.image_std = np.asarray(image_std, dtype=np.float32)
+
+    @classmethod
+    def from_pretrained(cls, model_path: str) -> 'StudentProcessor':
+        """Load the preprocessing settings saved with a student."""
+        with open(os.path.join(model_path, CONFIG_NAME), 'r') as f:
+            config = json.load(f)
+        return cls(config["input_size"], config["image_mean"], config["image_std"])
+
+    def resize(self, image: np.ndarray) -> np.ndarray:
+        """Area-average when shrinking, linear when enlarging, as CropEngine does."""
+        height, width = image.shape[:2]
+        if (height, width) == (self.input_size, self.input_size):
+            return image
+        shrinking = height * width > self.input_size * self.input_size
+        return cv2.resize(image, (self.input_size, self.input_size),
+                          interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+    def to_array(self, image) -> np.ndarray:
+        """HxWx3 uint8 RGB array from a PIL image or array."""
+        if isinstance(image, Image.Image):
+            return np.asarray(image.convert('RGB'))
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = np.repeat(image[..., None], 3, axis=2)
+        return image[..., :3]
+
+    def __call__(self, images, do_resize: bool = True, return_tensors: str = "pt") -> StudentInputs:
+        """
+        Preprocess one image or a list of images.
+
+        Args:
+            images: PIL image, HxWx3 RGB array, list of either or NxHxWx3 batch
+            do_resize: Resize to input_size; crops from extract_sizes already are
+            return_tensors: Only "pt" is supported
+
+        Returns:
+            StudentInputs with NxCxHxW float32 'pixel_values'
+        """
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            images = list(images)
+        elif not isinstance(images, (list, tuple)):
+            images = [images]
+        arrays = [self.to_array(image) for image in images]
+        if do_resize:
+            arrays = [self.resize(image) for image in arrays]
+        batch = np.stack(arrays).astype(np.float32) / 255.0
+        batch = (batch - self.image_mean) / self.image_std
+        return StudentInputs(pixel_values=torch.from_numpy(np.ascontiguousarray(batch.transpose(0, 3, 1, 2))))
+
+class InvertedResidual(nn.Module):
+    """MobileNetV2 block: 1x1 expand, 3x3 depthwise, 1x1 project"""
+
+    def __init__(self, in_channels: int, out_channels: int, stride: int, expansion: int = 4):
+
+        super().__init__()
+        hidden = in_channels * expansion
+        self.use_residual = stride == 1 and in_channels == out_channels
+        self.block = nn.Sequential(
+            nn.Conv2d(in_channels, hidden, 1, bias=False),
+            nn.BatchNorm2d(hidden),
+            nn.ReLU6(inplace=True),
+            nn.Conv2d(hidden, hidden, 3, stride, 1, groups=hidden, bias=False),
+            nn.BatchNorm2d(hidden),
+            nn.ReLU6(inplace=True),
+            nn.Conv2d(hidden, out_channels, 1, bias=False),
+            nn.BatchNorm2d(out_channels)
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x + self.block(x) if self.use_residual else self.block(x)
+
+class StudentClassifier(nn.Module):
+    """Small MobileNet-style CNN for ring completeness at the native box resolution"""
+
+    # (output channels, stride) of each inverted residual block
+    BLOCKS = [(24, 2), (24, 1), (40, 2), (40, 1), (80, 2), (80, 1), (128, 1)]
+
+    def __init__(self, num_labels: int = 4, input_size: int = 112, width: float = 1.0,
+                 image_mean: Sequence[float] = (0.5, 0.5, 0.5), image_std: Sequence[float] = (0.5, 0.5, 0.5),
+                 metadata: Optional[Dict] = None):
+
+        super().__init__()
+        self.config = {
+            "architecture": "StudentClassifier",
+            "num_labels": num_labels,
+            "input_size": input_size,
+            "width": width,
+            "image_mean": list(image_mean),
+            "image_std": list(image_std)
+        }
+        # Where the student came from, e.g. teacher path and distillation settings
+        self.metadata = metadata or {}
+
+        channels = max(8, int(16 * width))
+        layers = [nn.Conv2d(3, channels, 3, 2, 1, bias=False), nn.BatchNorm2d(channels), nn.ReLU6(inplace=True)]
+        for out_channels, stride in self.BLOCKS:
+            out_channels = max(8, int(out_channels * width))
+            layers.append(InvertedResidual(channels, out_channels, stride))
+            channels = out_channels
+        head = max(16, int(256 * width))
+        layers += [nn.Conv2d(channels, head, 1, bias=False), nn.BatchNorm2d(head), nn.ReLU6(inplace=True)]
+        self.features = nn.Sequential(*layers)
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.classifier = nn.Sequential(nn.Dropout(0.2), nn.Linear(head, num_labels))
+
+    def forward(self, pixel_values: torch.Tensor) -> SimpleNamespace:
+        """Logits in the same .logits form as ViTForImageClassification."""
+        # Depthwise convolutions run faster on CPU in channels-last layout
+        pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        features = self.pool(self.features(pixel_values)).flatten(1)
+        return SimpleNamespace(logits=self.classifier(features))
+
+    def save_pretrained(self, model_path: str):
+        """Save the weights and config to a folder."""
+        os.makedirs(model_path, exist_ok=True)
+        with open(os.path.join(model_path, CONFIG_NAME), 'w') as f:
+            json.dump(dict(self.config, metadata=self.metadata), f, indent=2)
+        torch.save(self.state_dict(), os.path.join(model_path, WEIGHTS_NAME))
+        print(f"Saved student model to {model_path}")
+
+    @classmethod
+    def from_pretrained(cls, model_path: str) -> 'StudentClassifier':
+        """Load a student saved by save_pretrained."""
+        with open(os.path.join(model_path, CONFIG_NAME), 'r') as f:
+            config = json.load(f)
+        model = cls(config["num_labels"], config["input_size"], config["width"],
+                    config["image_mean"], config["image_std"], config.get("metadata"))
+        state = torch.load(os.path.join(model_path, WEIGHTS_NAME), map_location="cpu", weights_only=True)
+        model.load_state_dict(state)
+        return model.to(memory_format=torch.channels_last)
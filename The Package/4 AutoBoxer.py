@@ -1,23 +1,38 @@
 import cv2
 import os
-import numpy as np
-import json
+import sys
+import time
+import argparse
 from tkinter import Tk, filedialog, messagebox
-from scipy.ndimage import convolve
+
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PillarDetector import PillarDetector, DetectionCache
+from CropStore import CropStore
+from CropEngine import CropEngine
+from SeriesPool import SeriesPool
+from PillarTable import PillarTable
 
 #os.makedirs('boxes', exist_ok=True)
 
 
 class AutoBoxer:
 
-    def __init__(self, pillar_image_path, myelin_image_path, output_folder):
+    def __init__(self, pillar_image_path, myelin_image_path, output_folder, use_lattice=False, save_pngs=False):
         self.pillar_image_path = pillar_image_path        
         self.myelin_image_path = myelin_image_path
+        # Fit the pillar lattice instead of trusting each detection on its own
+        self.use_lattice = use_lattice
+        # Also write boxes/box_{i}.png next to the packed crop store
+        self.save_pngs = save_pngs
         
         self.output_folder = output_folder
         self.dot_positions = []
         self.box_positions = []  
 
+        # Pillar and box sizes follow the series pixel size, detection runs on a pyramid level
+        self.detector = PillarDetector.for_series(output_folder)
+
         self.pillar_image = cv2.imread(pillar_image_path, cv2.IMREAD_COLOR)
         self.myelin_image = cv2.imread(myelin_image_path, cv2.IMREAD_COLOR)
 
@@ -36,109 +51,64 @@ class AutoBoxer:
 
         """Detect centers of pillars"""
 
-        gray_image = cv2.cvtColor(self.pillar_image, cv2.COLOR_BGR2GRAY)
-        _, binary_mask = cv2.threshold(gray_image, 128, 255, cv2.THRESH_BINARY)
-        radius = 15
-        y, x = np.ogrid[-radius: radius+1, -radius: radius+1]
-        circular_filter = x**2 + y**2 <= radius**2
-        filtered_image = convolve(binary_mask, circular_filter.astype(float))
-        contours, _ = cv2.findContours(filtered_image.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        self.dot_positions = []
-        self.dot_visuals = []
-
-        min_area = 2250
-        img_h, img_w = binary_mask.shape[:2]
-        
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area < min_area:  
-                continue
-            moments = cv2.moments(contour)
-
-            # Check if contour touches image border
-            x, y, w, h = cv2.boundingRect(contour)
-            if x <= 0 or y <= 0 >= img_h:
-                continue  # Skip partial pillars touching edges
-
-            if moments["m00"] != 0:
-                xc = int(moments["m10"] / moments["m00"])
-                yc = int(moments["m01"] / moments["m00"])
-                self.dot_positions.append((xc, yc))
+        # Detections are cached per series, keyed by the image content and detector parameters
+        self.dot_positions = DetectionCache(self.detector).detect(self.pillar_image_path, self.pillar_image,
+                                                                  lattice=self.use_lattice)
 
         if not self.dot_positions:
-            messagebox.showinfo("Detection Complete", "No pillars detected.")
+            print(f"No pillars detected in {self.pillar_image_path}")
             return False   
         return True
 
     def create_box(self):
         """Create boxes around detected centers and display scoring buttons."""
-        box_size = 100
-        self.box_positions = []  # Reset box positions
-
-        # Sort dot positions by top-to-bottom, left-to-right
-        self.dot_positions = sorted(self.dot_positions, key=lambda pos: (pos[1], pos[0]))
+        box_size = self.detector.box_size
 
-        for (x, y) in self.dot_positions:
-            x1 = max(0, x - box_size // 2)
-            y1 = max(0, y - box_size // 2)
-            x2 = min(self.myelin_image.shape[1], x + box_size // 2)
-            y2 = min(self.myelin_image.shape[0], y + box_size // 2)
+        # Sort dot positions by top-to-bottom, left-to-right (lattice positions are already in row order)
+        if not self.use_lattice:
+            self.dot_positions = sorted(self.dot_positions, key=lambda pos: (pos[1], pos[0]))
 
-            # Store the rectangle's position
-            self.box_positions.append((x1, y1, x2, y2))
+        # Store the rectangle positions, clipped to the image
+        self.box_positions = CropEngine(box_size).bounds(self.dot_positions, self.myelin_image.shape)
 
         print(f"Created {len(self.box_positions)} boxes.")
         return True
     
     def save_box(self):
 
-        """Save all cropped box images."""
+        """Pack all cropped boxes into the series crop store."""
 
         if not self.box_positions:
-            messagebox.showwarning("No Boxes", "Please create boxes before saving.")
-            return
+            print("No boxes to save.")
+            return False
 
-        # Load the original myelin image for cropping
-        base_image = cv2.imread(self.myelin_image_path, cv2.IMREAD_COLOR)
-        
-        cell_data = []
-
-        for i, (x1, y1, x2, y2) in enumerate(self.box_positions):
-            # Add padding and ensure bounds are within the image dimensions
-            y1_cropped = max(0, y1)
-            y2_cropped = min(base_image.shape[0], y2)
-            x1_cropped = max(0, x1)
-            x2_cropped = min(base_image.shape[1], x2)
-            cropped_img = base_image[y1_cropped:y2_cropped, x1_cropped:x2_cropped]
-            file_path = os.path.join(self.output_folder, "boxes", f"box_{i}.png")
-            cv2.imwrite(file_path, cropped_img)
-
-            xc, yc = self.dot_positions[i]
-
-             # Store data for this pillar
-            cell_info = {
-                "cell_id": i,
-                "image_filename": f"box_{i}.png",
-                "center_coordinates": {
-                    "x": xc,
-                    "y": yc
-                }
-            }
-
-            cell_data.append(cell_info)
-            print(f"Saved {file_path}")
         # Get parent folder name for naming
         if os.path.isdir(self.output_folder):
             parent_folder_name = os.path.basename(os.path.normpath(self.output_folder))
         else:
             parent_folder_name = os.path.splitext(os.path.basename(self.output_folder))[0]
 
-        
-        json_path = os.path.join(self.output_folder, f"{parent_folder_name}_pillar_coords.json")
-        with open(json_path, 'w') as json_file:
-            json.dump(cell_data, json_file, indent=4)
+        store = CropStore(self.output_folder, parent_folder_name, box_size=self.detector.box_size)
+        # Crops come from the already decoded myelin image in one vectorised pass
+        crops = store.pack(self.myelin_image, self.dot_positions)
+
+        # Pillar i is box i
+        pillar_table = PillarTable.from_centres(self.dot_positions)
+        crop_index = [{
+            "cell_id": i,
+            "center_coordinates": {"x": int(xc), "y": int(yc)},
+            "bounds": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+        } for i, ((xc, yc), (x1, y1, x2, y2)) in enumerate(zip(self.dot_positions, self.box_positions))]
+
+        store.save(crops, crop_index)
+
+        # PNGs are only needed to look at the boxes by eye
+        if self.save_pngs:
+            store.export_pngs()
+
+        # The table is written with pillar_coords.json alongside for older tools
+        pillar_table.save(self.output_folder, parent_folder_name)
         print(f"All {len(self.box_positions)} boxes have been saved.")
-        print(f"Pillar coordinates saved to {json_path}")
         return True
         
     def process(self):
@@ -153,64 +123,78 @@ class AutoBoxer:
             return False
         return True
 
-def process_all_subfolders(parent_directory):
-    """Process all subfolders in the parent directory that contain the required images."""
-    processed_folders = 0
-    successful_folders = 0
-    
+def box_series(folder_name, subfolder_path, use_lattice=False, save_pngs=False):
+    """Box one series without any GUI calls and return a structured result."""
+    pillar_image_path = os.path.join(subfolder_path, "pillar_mip.png")
+    myelin_image_path = os.path.join(subfolder_path, "mbp_mip.png")
+    result = {'series': folder_name, 'path': subfolder_path}
+
+    # Check if both images exist
+    if not (os.path.exists(pillar_image_path) and os.path.exists(myelin_image_path)):
+        result.update(status='skipped', message="Required images not found")
+        return result
+
+    start_time = time.time()
+    analyser = AutoBoxer(pillar_image_path, myelin_image_path, subfolder_path,
+                         use_lattice=use_lattice, save_pngs=save_pngs)
+    success = analyser.process()
+
+    result.update(
+        status='ok' if success else 'no_pillars',
+        pillars=len(analyser.box_positions),
+        message=f"{len(analyser.box_positions)} boxes" if success else "No pillars detected",
+        seconds=time.time() - start_time
+    )
+    return result
+
+def process_all_subfolders(parent_directory, use_lattice=False, save_pngs=False, workers=None):
+    """Box every subfolder with the required images over a process pool."""
+    tasks = {}
+
     # Get all subdirectories in the parent directory
-    for folder_name in os.listdir(parent_directory):
+    for folder_name in sorted(os.listdir(parent_directory)):
         subfolder_path = os.path.join(parent_directory, folder_name)
-        
-        # Check if it's a directory
         if os.path.isdir(subfolder_path):
-            # Look for the required image files
-            pillar_image_path = os.path.join(subfolder_path, "pillar_mip.png")
-            myelin_image_path = os.path.join(subfolder_path, "mbp_mip.png")
-            
-            # Check if both images exist
-            if os.path.exists(pillar_image_path) and os.path.exists(myelin_image_path):
-                print(f"Processing folder: {folder_name}")
-                processed_folders += 1
-                
-                try:
-                    # Create boxes directory in the subfolder
-                    boxes_dir = os.path.join(subfolder_path, "boxes")
-                    os.makedirs(boxes_dir, exist_ok=True)
-                    
-                    # Process this folder
-                    analyser = AutoBoxer(pillar_image_path, myelin_image_path, subfolder_path)
-                    success = analyser.process()
-                    
-                    if success:
-                        successful_folders += 1
-                        print(f"✓ Successfully processed {folder_name}")
-                    else:
-                        print(f"✗ Processing failed for {folder_name}")
-                        
-                except Exception as e:
-                    print(f"✗ Error processing {folder_name}: {str(e)}")
-            else:
-                print(f"Skipping {folder_name}: Required images not found")
-    
+            tasks[folder_name] = (folder_name, subfolder_path, use_lattice, save_pngs)
+
+    pool = SeriesPool(workers)
+    results = pool.run(box_series, tasks)
+    pool.save_results(results, os.path.join(parent_directory, "autoboxer_results.json"))
+
+    processed_folders = sum(1 for r in results if r['status'] != 'skipped')
+    successful_folders = sum(1 for r in results if r['status'] == 'ok')
     return processed_folders, successful_folders
 
 if __name__ == "__main__":
-    root = Tk()
-    root.withdraw()  # Hide the main window
-    
-    # Ask for parent directory instead of individual files
-    parent_directory = filedialog.askdirectory(title="Select Parent Directory Containing Subfolders")
-    
-    if parent_directory:
-        print(f"Processing all subfolders in: {parent_directory}")
-        processed, successful = process_all_subfolders(parent_directory)
-        
-        messagebox.showinfo("Processing Complete", 
-                           f"Processed {processed} folders\n"
-                           f"Successfully completed: {successful}\n"
-                           f"Failed: {processed - successful}")
+    parser = argparse.ArgumentParser(description="Box every series in a parent directory")
+    parser.add_argument('parent_directory', nargs='?', help="Parent directory (asks with a dialog if omitted)")
+    parser.add_argument('--lattice', action='store_true', help="Fit the pillar lattice")
+    parser.add_argument('--pngs', action='store_true', help="Also write boxes/box_{i}.png")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    # With a directory on the command line the run is fully headless
+    if args.parent_directory:
+        processed, successful = process_all_subfolders(args.parent_directory, use_lattice=args.lattice,
+                                                       save_pngs=args.pngs, workers=args.workers)
+        print(f"Processed {processed} folders, successfully completed: {successful}, failed: {processed - successful}")
     else:
-        messagebox.showerror("Error", "Please select a parent directory.")
-    
-    root.destroy()
\ No newline at end of file
+        root = Tk()
+        root.withdraw()  # Hide the main window
+        
+        # Ask for parent directory instead of individual files
+        parent_directory = filedialog.askdirectory(title="Select Parent Directory Containing Subfolders")
+        
+        if parent_directory:
+            print(f"Processing all subfolders in: {parent_directory}")
+            processed, successful = process_all_subfolders(parent_directory, use_lattice=args.lattice,
+                                                           save_pngs=args.pngs, workers=args.workers)
+            
+            messagebox.showinfo("Processing Complete", 
+                               f"Processed {processed} folders\n"
+                               f"Successfully completed: {successful}\n"
+                               f"Failed: {processed - successful}")
+        else:
+            messagebox.showerror("Error", "Please select a parent directory.")
+        
+        root.destroy()
@@ -4,10 +4,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 from tkinter import Tk, filedialog, messagebox
 import os
+import sys
 import glob
 import scipy.stats as stats
 from scipy.stats import linregress
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PillarTable import PillarTable
+
 class PillarNucleiAnalyser:
     def __init__(self):
         self.wrapped_pillars = []
@@ -94,17 +99,12 @@ class PillarNucleiAnalyser:
                 'prox_nuclei': []  # will store nuclei assigned to this pillar
             })
 
-        # For each nucleus, find the closest pillar within search_radius
-        for nucleus in self.nuclei_properties:
-            min_distance = float('inf')
-            closest_pillar_index = -1
-
-            for idx, pillar in enumerate(self.wrapped_pillars):
-                distance = self.calculate_distance(pillar['center_coordinates'], nucleus)
-                if distance < min_distance:
-                    min_distance = distance
-                    closest_pillar_index = idx
+        # For each nucleus, find the closest pillar in one KD-tree query
+        pillar_table = PillarTable.from_records(self.wrapped_pillars)
+        nuclei_xy = [(nucleus['x_c'], nucleus['y_c']) for nucleus in self.nuclei_properties]
+        distances, closest_rows = pillar_table.nearest(nuclei_xy)
 
+        for nucleus, min_distance, closest_pillar_index in zip(self.nuclei_properties, distances.tolist(), closest_rows.tolist()):
             # If a pillar is found within search_radius, assign nucleus to it
             if min_distance <= search_radius:
                 self.analysis_results[closest_pillar_index]['prox_nuclei'].append({
@@ -1,13 +1,15 @@
 import cv2
 import os
-import numpy as np
 from tkinter import Tk, Button, Canvas, Label, messagebox, filedialog
 from PIL import Image, ImageTk
-from scipy.ndimage import convolve
 import sys
 import json
 import tempfile
 
+# Shared pipeline modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PillarDetector import PillarDetector, DetectionCache
+
 class MyelinAnalyser:
 
     def __init__(self, root, pillar_image_path, myelin_image_path):
@@ -98,33 +100,15 @@ class MyelinAnalyser:
         return cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
 
     def detect_pillar_centers(self):
-        gray_image = cv2.cvtColor(self.pillar_image, cv2.COLOR_BGR2GRAY)
-        _, binary_mask = cv2.threshold(gray_image, 128, 255, cv2.THRESH_BINARY)
-        radius = 15
-        y, x = np.ogrid[-radius: radius+1, -radius: radius+1]
-        circular_filter = x**2 + y**2 <= radius**2
-        filtered_image = convolve(binary_mask, circular_filter.astype(float))
-        contours, _ = cv2.findContours(filtered_image.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
         self.dot_positions = []
         self.dot_visuals = []
-        min_area = 2250
-        img_h, img_w = binary_mask.shape[:2]
         
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area < min_area: continue
-            
-            x, y, w, h = cv2.boundingRect(contour)
-            if x <= 0 or y <= 0 or x+w >= img_w or y+h >= img_h: continue
-
-            moments = cv2.moments(contour)
-            if moments["m00"] != 0:
-                center_x = int(moments["m10"] / moments["m00"])
-                center_y = int(moments["m01"] / moments["m00"])
-                display_x, display_y = int(center_x / self.display_pillar_scale), int(center_y / self.display_pillar_scale)
-                self.dot_positions.append((display_x, display_y))
-                self.dot_visuals.append(self.canvas.create_oval(display_x - 2, display_y - 2, display_x + 2, display_y + 2, fill="red"))
+        # Same detector as the auto boxer, so both see the same pillars
+        detector = PillarDetector.for_series(os.path.dirname(self.pillar_image_path))
+        for center_x, center_y in DetectionCache(detector).detect(self.pillar_image_path, self.pillar_image):
+            display_x, display_y = int(center_x / self.display_pillar_scale), int(center_y / self.display_pillar_scale)
+            self.dot_positions.append((display_x, display_y))
+            self.dot_visuals.append(self.canvas.create_oval(display_x - 2, display_y - 2, display_x + 2, display_y + 2, fill="red"))
         
         messagebox.showinfo("Detection Complete", f"Detected {len(self.dot_positions)} pillars.")
 